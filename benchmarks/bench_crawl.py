@@ -0,0 +1,319 @@
+"""Offline benchmark of whole crawls against a local mock server
+
+Crawls each endpoint of `mock_server.MockServer` with no rate limit, at three
+levels:
+
+- `request`: `_request_transit_land`, fetching and parsing pages
+- `base`: `base()`, which also filters GeoJSON results by a polygon. For
+  `onestop_id`, `onestop_ids()`.
+- `cli`: the `transitland` command, which also loads the polygon from a file
+  and writes NDJSON to /dev/null
+
+The server runs in its own process, and each crawl in a forked process, so
+that its peak RSS is its own. Each crawl reports pages/s, results/s, peak RSS
+and the time spent in each stage: fetching responses, parsing JSON, filtering
+by the polygon and serializing output. Stages are timed by wrapping the
+functions that run them, which adds a little overhead to each call, and are
+summed over threads with --workers.
+
+    python benchmarks/bench_crawl.py
+    python benchmarks/bench_crawl.py --endpoints routes --features 20000 \\
+        --latency 0.05 --fail-every 10 --json results.jsonl
+
+With `--json`, results are appended as one line of JSON per run, to track
+them over time.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+import requests
+from shapely.geometry import shape
+
+import transitland_wrapper
+from transitland_wrapper import (
+    cli, filtering, ratelimit, retry, sinks, transitland)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_server import ENDPOINTS, MockServerProcess, circle  # noqa: E402
+
+MODES = ['request', 'base', 'cli']
+STAGES = ['fetch', 'parse', 'filter', 'serialize']
+
+# Number of onestop_id lookups per run
+ONESTOP_IDS = 500
+
+
+class StageTimer:
+    """Time spent in each stage, from any thread"""
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.calls = dict.fromkeys(STAGES, 0)
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.seconds[stage] += elapsed
+                    self.calls[stage] += 1
+
+        return timed
+
+    def install(self):
+        """Wrap the functions of each stage"""
+        transitland._send_request = self.wrap(
+            'fetch', transitland._send_request)
+        requests.Response.json = self.wrap('parse', requests.Response.json)
+        filtering.IntersectionFilter.filter = self.wrap(
+            'filter', filtering.IntersectionFilter.filter)
+
+        json_encoder = sinks._json_encoder
+
+        def timed_encoder(encoder=None):
+            return self.wrap('serialize', json_encoder(encoder))
+
+        sinks._json_encoder = timed_encoder
+        return self
+
+
+def run_request(endpoint, config):
+    if endpoint == 'onestop_id':
+        results = 0
+        for oid in config['onestop_ids']:
+            for _ in transitland._request_transit_land(
+                    'onestop_id', params={'id': oid}):
+                results += 1
+        return results
+
+    pages = transitland._request_transit_land(
+        endpoint,
+        params={'per_page': config['per_page']},
+        workers=config['workers'])
+    return sum(len(page) for page in pages)
+
+
+def run_base(endpoint, config):
+    if endpoint == 'onestop_id':
+        results = transitland.onestop_ids(
+            config['onestop_ids'], workers=config['workers'])
+        return sum(1 for _ in results)
+
+    geometry = None
+    if transitland.ALL_ENDPOINT_TYPES[endpoint] == '.geojson':
+        geometry = shape(config['geometry'])
+    pages = transitland.base(
+        endpoint,
+        geometry=geometry,
+        per_page=config['per_page'],
+        workers=config['workers'])
+    return sum(len(page) for page in pages)
+
+
+def run_cli(endpoint, config, timer):
+    command = endpoint.replace('_', '-')
+    args = ['--rate-limit', '0', command, '-w', str(config['workers'])]
+    if endpoint == 'onestop_id':
+        args += ['--file', config['onestop_id_file']]
+    else:
+        args += ['--page-all', '--per-page', str(config['per_page'])]
+        if transitland.ALL_ENDPOINT_TYPES[endpoint] == '.geojson':
+            args += ['--geometry', config['geometry_file']]
+    args += ['--output', os.devnull]
+
+    cli.main.main(args, prog_name='transitland', standalone_mode=False)
+    return timer.calls['serialize']
+
+
+def run(endpoint, mode, config):
+    """Run one crawl in this process"""
+    transitland.BASE_URL = config['url']
+    ratelimit.configure_rate_limiter(0)
+    retry.configure_retry(backoff_factor=0)
+    timer = StageTimer().install()
+
+    start = time.perf_counter()
+    if mode == 'cli':
+        results = run_cli(endpoint, config, timer)
+    else:
+        results = {'request': run_request, 'base': run_base}[mode](
+            endpoint, config)
+    seconds = time.perf_counter() - start
+
+    pages = timer.calls['fetch']
+    return {
+        'endpoint': endpoint,
+        'mode': mode,
+        'seconds': seconds,
+        'pages': pages,
+        'results': results,
+        'pages_per_second': pages / seconds,
+        'results_per_second': results / seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': timer.seconds,
+    }
+
+
+def run_forked(endpoint, mode, config):
+    """Run one crawl in a forked process, if possible"""
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        # Peak RSS is then that of all crawls so far
+        return run(endpoint, mode, config)
+
+    reader, writer = context.Pipe(duplex=False)
+
+    def target():
+        try:
+            writer.send(run(endpoint, mode, config))
+        except BaseException as e:
+            writer.send(e)
+            raise
+
+    process = context.Process(target=target)
+    process.start()
+    result = reader.recv()
+    process.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return rss / 1024 ** 2
+    return rss / 1024
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--endpoints', default=','.join(ENDPOINTS),
+        help='comma-separated endpoints to crawl')
+    parser.add_argument(
+        '--modes', default=','.join(MODES),
+        help='comma-separated levels to crawl at')
+    parser.add_argument(
+        '--features', type=int, default=5000,
+        help='results of each paged endpoint')
+    parser.add_argument(
+        '--vertices', type=int, default=200,
+        help='vertices of each route geometry')
+    parser.add_argument('--per-page', type=int, default=500)
+    parser.add_argument(
+        '--max-per-page', type=int, default=1000,
+        help='largest page the server returns')
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help='seconds the server waits per request')
+    parser.add_argument(
+        '--latency-per-result', type=float, default=0,
+        help='seconds the server waits per result')
+    parser.add_argument(
+        '--fail-every', type=int, default=None,
+        help='answer every nth request with a 429')
+    parser.add_argument(
+        '--fixtures', default=None,
+        help='directory of recorded <endpoint>.json results to serve')
+    parser.add_argument(
+        '--json', default=None, help='file to append results to as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Geometry.type is deprecated in shapely 2
+    warnings.filterwarnings('ignore', message="The 'type' attribute")
+    endpoints = args.endpoints.split(',')
+    modes = args.modes.split(',')
+
+    server = MockServerProcess(
+        features=args.features,
+        vertices=args.vertices,
+        latency=args.latency,
+        latency_per_result=args.latency_per_result,
+        fail_every=args.fail_every,
+        max_per_page=args.max_per_page,
+        fixtures=args.fixtures)
+
+    tmpdir = tempfile.mkdtemp()
+    geometry = circle()
+    geometry_file = os.path.join(tmpdir, 'geometry.geojson')
+    with open(geometry_file, 'w') as f:
+        json.dump(geometry, f)
+
+    runs = []
+    with server:
+        onestop_ids = server.onestop_ids[:ONESTOP_IDS]
+        onestop_id_file = os.path.join(tmpdir, 'onestop_ids.txt')
+        with open(onestop_id_file, 'w') as f:
+            f.write('\n'.join(onestop_ids) + '\n')
+
+        config = {
+            'url': server.url,
+            'per_page': args.per_page,
+            'workers': args.workers,
+            'geometry': geometry,
+            'geometry_file': geometry_file,
+            'onestop_ids': onestop_ids,
+            'onestop_id_file': onestop_id_file,
+        }
+
+        header = (
+            f'{"endpoint":>20} {"mode":>8} {"s":>7} {"pages/s":>8} '
+            f'{"results/s":>10} {"RSS MB":>7}')
+        header += ''.join(f' {stage:>9}' for stage in STAGES)
+        print(header)
+        for endpoint in endpoints:
+            for mode in modes:
+                result = run_forked(endpoint, mode, config)
+                runs.append(result)
+                line = (
+                    f'{endpoint:>20} {mode:>8} {result["seconds"]:>7.2f} '
+                    f'{result["pages_per_second"]:>8.1f} '
+                    f'{result["results_per_second"]:>10.0f} '
+                    f'{result["peak_rss_mb"] or 0:>7.0f}')
+                line += ''.join(
+                    f' {result["stages"][stage]:>9.3f}' for stage in STAGES)
+                print(line)
+
+    print(
+        f'server: {server.stats["requests"]} requests, '
+        f'{server.stats["throttled"]} throttled, '
+        f'{server.stats["bytes"] / 1024 ** 2:.1f} MB')
+
+    if args.json is not None:
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'version': transitland_wrapper.__version__,
+            'python': platform.python_version(),
+            'config': {
+                k: v for k, v in vars(args).items() if k != 'json'},
+            'runs': runs,
+        }
+        with open(args.json, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Microbenchmark of the intersection filter in base()
+
+Compares the per-feature loop that base() used to run against
+`IntersectionFilter` on pages of point and line features:
+
+    python benchmarks/bench_filter.py
+"""
+import random
+import timeit
+
+from shapely.geometry import Point, shape
+from shapely.prepared import prep
+
+from transitland_wrapper.filtering import SHAPELY_2, IntersectionFilter
+
+PAGE_SIZES = [50, 500, 5000]
+
+
+def make_points(n):
+    return [{
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [random.uniform(-1, 1),
+                            random.uniform(-1, 1)]},
+        'properties': {}} for _ in range(n)]
+
+
+def make_lines(n, vertices=200):
+    features = []
+    for _ in range(n):
+        x, y = random.uniform(-1, 1), random.uniform(-1, 1)
+        coords = []
+        for _ in range(vertices):
+            x += random.uniform(-0.01, 0.01)
+            y += random.uniform(-0.01, 0.01)
+            coords.append([x, y])
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': coords},
+            'properties': {}})
+    return features
+
+
+def loop_filter(features, prepared_geometry):
+    """The filter base() ran before IntersectionFilter"""
+    kept_features = []
+    for feature in features:
+        if prepared_geometry.intersects(shape(feature['geometry'])):
+            kept_features.append(feature)
+
+    return kept_features
+
+
+def main():
+    random.seed(0)
+    mask = Point(0, 0).buffer(0.5, 64)
+    prepared_geometry = prep(mask)
+    geometry_filter = IntersectionFilter(mask)
+
+    print(f'shapely 2: {SHAPELY_2}')
+    print(f'{"features":>10} {"n":>6} {"loop ms":>10} {"batch ms":>10} '
+          f'{"speedup":>8}')
+    for name, make in [('points', make_points), ('lines', make_lines)]:
+        for n in PAGE_SIZES:
+            features = make(n)
+            expected = loop_filter(features, prepared_geometry)
+            assert geometry_filter.filter(features) == expected
+
+            number = max(1, 5000 // n)
+            loop = timeit.timeit(
+                lambda: loop_filter(features, prepared_geometry),
+                number=number) / number
+            batch = timeit.timeit(
+                lambda: geometry_filter.filter(features),
+                number=number) / number
+            print(f'{name:>10} {n:>6} {loop * 1000:>10.2f} '
+                  f'{batch * 1000:>10.2f} {loop / batch:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
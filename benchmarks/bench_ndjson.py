@@ -0,0 +1,74 @@
+"""Benchmark of NDJSON output
+
+Compares the per-feature `click.echo(json.dumps(...))` loop that the CLI used
+to run against `NDJSONSink` with each encoder and compression:
+
+    python benchmarks/bench_ndjson.py
+"""
+import json
+import os
+import tempfile
+import time
+
+import click
+
+from transitland_wrapper.sinks import NDJSONSink, write_pages
+
+N_FEATURES = 200000
+PAGE_SIZE = 1000
+
+
+def make_pages(n, page_size):
+    features = [{
+        'type': 'Feature',
+        'id': f's-9q9-{i}',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [i * 0.001, 37.5]},
+        'properties': {
+            'name': f'Stop {i}',
+            'onestop_id': f's-9q9-{i}',
+            'tags': {
+                'wheelchair_boarding': None}}} for i in range(n)]
+    return [
+        features[i:i + page_size] for i in range(0, len(features), page_size)]
+
+
+def echo_loop(pages, path):
+    """The writer the CLI used before NDJSONSink"""
+    with open(path, 'w') as f:
+        for features in pages:
+            for feature in features:
+                click.echo(json.dumps(feature, separators=(',', ':')), file=f)
+
+
+def main():
+    pages = make_pages(N_FEATURES, PAGE_SIZE)
+    path = os.path.join(tempfile.mkdtemp(), 'out')
+
+    start = time.perf_counter()
+    echo_loop(pages, path)
+    baseline = time.perf_counter() - start
+
+    print(f'{N_FEATURES} features')
+    print(f'{"encoder":>8} {"compress":>8} {"s":>8} {"MB":>8} {"speedup":>8}')
+    print(f'{"echo":>8} {"-":>8} {baseline:>8.2f} '
+          f'{os.path.getsize(path) / 1024 ** 2:>8.1f} {1:>7.1f}x')
+    for encoder in ['json', 'orjson']:
+        for compress in [None, 'gzip', 'zstd']:
+            try:
+                sink = NDJSONSink(path, compress=compress, encoder=encoder)
+            except ImportError as e:
+                print(f'{encoder:>8} {str(compress):>8} skipped: {e}')
+                continue
+
+            start = time.perf_counter()
+            write_pages(pages, sink)
+            elapsed = time.perf_counter() - start
+            print(f'{encoder:>8} {str(compress):>8} {elapsed:>8.2f} '
+                  f'{os.path.getsize(path) / 1024 ** 2:>8.1f} '
+                  f'{baseline / elapsed:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
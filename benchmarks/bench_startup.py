@@ -0,0 +1,152 @@
+"""Benchmark of package import and CLI startup time
+
+The CLI is run many times a day from scripts, so its startup time adds up.
+Heavy dependencies (shapely and numpy, requests, geopandas, pyarrow) are only
+imported by the code paths that need them. This script measures the wall time
+of importing the package and of `transitland --help`, and the total of
+`python -X importtime`:
+
+    python benchmarks/bench_startup.py
+
+With `--check`, it instead exits with an error if any heavy dependency is
+imported at startup, or on a crawl without a geometry, or if the import time
+exceeds `--budget-ms`. The same check for heavy imports runs with the tests,
+in tests/test_startup.py:
+
+    python benchmarks/bench_startup.py --check
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules that must not be imported at startup
+HEAVY_MODULES = [
+    'geopandas', 'numpy', 'pandas', 'pyarrow', 'requests', 'shapely',
+    'urllib3']
+
+SCENARIOS = {
+    'import': 'import transitland_wrapper',
+    'import cli': 'import transitland_wrapper.cli',
+    'cli --help': (
+        'import sys; from transitland_wrapper import cli; '
+        'sys.argv = ["transitland", "--help"]\n'
+        'try:\n    cli.main()\nexcept SystemExit:\n    pass'),
+    'stops --help': (
+        'import sys; from transitland_wrapper import cli; '
+        'sys.argv = ["transitland", "stops", "--help"]\n'
+        'try:\n    cli.main()\nexcept SystemExit:\n    pass'),
+}
+
+# Scenarios checked for heavy imports, with modules they may import
+CHECKS = {
+    'import cli': [],
+    'cli --help': [],
+    'stops --help': [],
+    # Preparing a crawl without a geometry needs no geometry code
+    'crawl without geometry': (
+        'from transitland_wrapper import transitland\n'
+        'transitland._build_params(per_page=100)\n'
+        'transitland._prepare_filter("stops", None)\n'
+        'transitland._prepare_reducer()', []),
+}
+
+N_RUNS = 10
+
+
+def run_python(code, *args):
+    return subprocess.run(
+        [sys.executable, *args, '-c', code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True)
+
+
+def wall_time(code, n=N_RUNS):
+    """Median seconds to run code in a fresh interpreter"""
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        run_python(code)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def import_time(code):
+    """Total seconds of `python -X importtime`, summed over modules"""
+    stderr = run_python(code, '-X', 'importtime').stderr
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split('|')
+        try:
+            total += int(fields[0].split(':')[1])
+        except ValueError:
+            # Header line
+            continue
+    return total / 1e6
+
+
+def imported_heavy_modules(code, allowed=()):
+    check = (
+        code + '\nimport sys\n'
+        f'print("heavy:" + ",".join(m for m in {HEAVY_MODULES!r} '
+        f'if m in sys.modules and m not in {list(allowed)!r}))')
+    # The modules are on the last line, after any output of code
+    last = run_python(check).stdout.rstrip('\n').rsplit('\n', 1)[-1]
+    return [m for m in last[len('heavy:'):].split(',') if m]
+
+
+def check(budget_ms=None):
+    errors = []
+    for name, value in CHECKS.items():
+        if isinstance(value, tuple):
+            code, allowed = value
+        else:
+            code, allowed = SCENARIOS[name], value
+        heavy = imported_heavy_modules(code, allowed)
+        if heavy:
+            errors.append(f'{name} imports {", ".join(heavy)}')
+
+    if budget_ms is not None:
+        seconds = import_time(SCENARIOS['import cli'])
+        if seconds * 1000 > budget_ms:
+            errors.append(
+                f'importing the CLI takes {seconds * 1000:.0f} ms, over the '
+                f'budget of {budget_ms:.0f} ms')
+
+    for error in errors:
+        print(f'error: {error}', file=sys.stderr)
+    if not errors:
+        print('ok: no heavy imports at startup')
+    return not errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--check', action='store_true',
+        help='fail if heavy dependencies are imported at startup')
+    parser.add_argument(
+        '--budget-ms', type=float, default=None,
+        help='with --check, also fail if importing the CLI takes longer')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        sys.exit(0 if check(args.budget_ms) else 1)
+
+    baseline = wall_time('pass')
+    print(f'{"scenario":>12} {"wall ms":>8} {"-python":>8} {"imports ms":>10}')
+    for name, code in SCENARIOS.items():
+        wall = wall_time(code)
+        print(f'{name:>12} {wall * 1000:>8.1f} '
+              f'{(wall - baseline) * 1000:>8.1f} '
+              f'{import_time(code) * 1000:>10.1f}')
+    print(f'bare python: {baseline * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
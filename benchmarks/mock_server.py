@@ -0,0 +1,420 @@
+"""Local stand-in for the transit.land API, for offline benchmarks
+
+Serves synthetic, or recorded, paginated responses for the `stops`, `routes`,
+`route_stop_patterns`, `schedule_stop_pairs` and `onestop_id` endpoints, in
+the same shape as the v1 API: GeoJSON feature collections or JSON objects
+with a `meta` that has the url of the `next` page. `offset`, `per_page`,
+`bbox` and `total` query parameters are supported.
+
+Each result is serialized once up front, and pages are assembled from the
+serialized results, so that the server spends as little time as possible per
+request. `MockServerProcess` runs it in a separate process, so that it
+neither competes with the client being measured for the GIL nor adds to its
+memory use.
+
+    with MockServerProcess(features=10000, latency=0.05) as server:
+        transitland.BASE_URL = server.url
+"""
+import json
+import math
+import multiprocessing
+import os
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+ENDPOINTS = [
+    'stops', 'routes', 'route_stop_patterns', 'schedule_stop_pairs',
+    'onestop_id']
+
+# Extent of synthetic results: roughly the San Francisco Bay Area
+BOUNDS = (-122.6, 37.2, -121.8, 38.0)
+
+DEFAULT_PER_PAGE = 50
+
+
+class MockServer:
+    """Threaded HTTP server with synthetic transit.land data
+
+    Args:
+        - features: number of results of each paged endpoint
+        - vertices: number of vertices of each route and route stop pattern
+        - latency: seconds to wait before answering each request
+        - latency_per_result: seconds to wait per result in the page
+        - fail_every: answer every nth request with a 429, or None
+        - retry_after: Retry-After header of 429 responses, in seconds
+        - max_per_page: largest page served, whatever `per_page` asks for
+        - fixtures: directory of recorded results, as `<endpoint>.json` files
+          with a list of results each. They replace the synthetic results of
+          their endpoint.
+        - seed: random seed of the synthetic results
+    """
+    def __init__(
+            self,
+            features=5000,
+            vertices=200,
+            latency=0,
+            latency_per_result=0,
+            fail_every=None,
+            retry_after=0,
+            max_per_page=1000,
+            fixtures=None,
+            seed=0):
+        self.latency = latency
+        self.latency_per_result = latency_per_result
+        self.fail_every = fail_every
+        self.retry_after = retry_after
+        self.max_per_page = max_per_page
+        self.stats = {'requests': 0, 'throttled': 0, 'bytes': 0}
+        self._lock = threading.Lock()
+        self._server = None
+
+        rng = random.Random(seed)
+        results = {
+            'stops': [_stop(i, rng) for i in range(features)],
+            'routes': [
+                _route(i, rng, vertices, multi=True) for i in range(features)],
+            'route_stop_patterns': [
+                _route(i, rng, vertices) for i in range(features)],
+            'schedule_stop_pairs': [
+                _stop_pair(i, rng) for i in range(features)],
+        }
+        if fixtures is not None:
+            results.update(load_fixtures(fixtures))
+
+        # Serialized results, with their bounds for bbox queries
+        self._pages = {
+            endpoint: [(json.dumps(r).encode(), _bounds(r)) for r in values]
+            for endpoint, values in results.items()}
+        self._by_id = {}
+        for values in results.values():
+            for result in values:
+                oid = _onestop_id(result)
+                if oid is not None:
+                    self._by_id[oid] = json.dumps(_as_entity(result)).encode()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def onestop_ids(self, endpoint='stops'):
+        """Onestop IDs of an endpoint's results, for onestop_id lookups"""
+        return [
+            oid for oid in map(_onestop_id, self._results(endpoint))
+            if oid is not None]
+
+    def start(self, port=0):
+        """Serve on a background thread
+
+        Args:
+            - port: port to listen on. By default any free port.
+        """
+        handler = type('Handler', (_Handler,), {'mock': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def respond(self, path, query, host):
+        """Build a response
+
+        Returns:
+            (status, headers, body, number of results)
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            n = self.stats['requests']
+            if self.fail_every and n % self.fail_every == 0:
+                self.stats['throttled'] += 1
+                headers = {'Retry-After': str(self.retry_after)}
+                return 429, headers, b'{"error": "Too Many Requests"}', 0
+
+        parts = path.strip('/').split('/')
+        if parts[:2] != ['api', 'v1'] or len(parts) < 3:
+            return 404, {}, b'{}', 0
+
+        if parts[2] == 'onestop_id' and len(parts) == 4:
+            body = self._by_id.get(parts[3])
+            if body is None:
+                return 404, {}, b'{"error": "not found"}', 0
+            return 200, {}, body, 1
+
+        endpoint, _, ext = parts[2].partition('.')
+        if endpoint not in self._pages:
+            return 404, {}, b'{}', 0
+        return self._page(endpoint, ext == 'geojson', path, query, host)
+
+    def _page(self, endpoint, geojson, path, query, host):
+        params = dict(parse_qsl(query))
+        offset = int(params.get('offset', 0))
+        per_page = min(
+            int(params.get('per_page', DEFAULT_PER_PAGE)), self.max_per_page)
+
+        results = self._pages[endpoint]
+        if 'bbox' in params:
+            bbox = tuple(map(float, params['bbox'].split(',')))
+            results = [r for r in results if _intersects(r[1], bbox)]
+
+        page = [body for body, _ in results[offset:offset + per_page]]
+        meta = {'offset': offset, 'per_page': per_page}
+        if params.get('total') == 'true':
+            meta['total'] = len(results)
+        if offset + per_page < len(results):
+            next_params = dict(params, offset=offset + per_page)
+            meta['next'] = f'http://{host}{path}?{urlencode(next_params)}'
+
+        items = b','.join(page)
+        meta = json.dumps(meta).encode()
+        if geojson:
+            body = b'{"type": "FeatureCollection", "features": [%s], ' \
+                b'"meta": %s}' % (items, meta)
+        else:
+            body = b'{"%s": [%s], "meta": %s}' % (
+                endpoint.encode(), items, meta)
+        return 200, {}, body, len(page)
+
+    def _results(self, endpoint):
+        return [json.loads(body) for body, _ in self._pages[endpoint]]
+
+
+class MockServerProcess:
+    """MockServer running in a child process
+
+    Args:
+        - kwargs: arguments of MockServer
+
+    Attributes:
+        - url: base url of the server, once started
+        - onestop_ids: Onestop IDs of the stops, once started
+        - stats: `MockServer.stats`, once stopped
+    """
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.url = None
+        self.onestop_ids = None
+        self.stats = None
+        self._conn = None
+        self._process = None
+
+    def start(self):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.kwargs, child_conn), daemon=True)
+        self._process.start()
+        self.url, self.onestop_ids = self._conn.recv()
+        return self
+
+    def stop(self):
+        if self._process is None:
+            return
+        self._conn.send('stop')
+        self.stats = self._conn.recv()
+        self._process.join()
+        self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def _serve(kwargs, conn):
+    with MockServer(**kwargs) as server:
+        conn.send((server.url, server.onestop_ids('stops')))
+        conn.recv()
+        conn.send(server.stats)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    mock = None
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, and keep-alive clients would
+    # otherwise wait out delayed ACKs between them
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        mock = self.mock
+        parts = urlsplit(self.path)
+        status, headers, body, n = mock.respond(
+            parts.path, parts.query, self.headers['Host'])
+
+        delay = mock.latency + mock.latency_per_result * n
+        if delay:
+            threading.Event().wait(delay)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with mock._lock:
+            mock.stats['bytes'] += len(body)
+
+
+def load_fixtures(path):
+    """Load recorded results from `<endpoint>.json` files in a directory"""
+    results = {}
+    for endpoint in ENDPOINTS:
+        fixture = os.path.join(path, f'{endpoint}.json')
+        if os.path.exists(fixture):
+            with open(fixture) as f:
+                results[endpoint] = json.load(f)
+    return results
+
+
+def _random_point(rng):
+    x0, y0, x1, y1 = BOUNDS
+    return [round(rng.uniform(x0, x1), 6), round(rng.uniform(y0, y1), 6)]
+
+
+def _stop(i, rng):
+    oid = f's-9q9-stop~{i}'
+    return {
+        'type': 'Feature',
+        'id': oid,
+        'geometry': {'type': 'Point', 'coordinates': _random_point(rng)},
+        'properties': {
+            'onestop_id': oid,
+            'name': f'Stop {i}',
+            'timezone': 'America/Los_Angeles',
+            'wheelchair_boarding': rng.choice([None, True, False]),
+            'tags': {'stop_desc': '', 'zone_id': str(i % 10)},
+            'served_by_vehicle_types': ['bus'],
+            'operators_serving_stop': [{
+                'operator_name': 'Agency',
+                'operator_onestop_id': 'o-9q9-agency'}],
+        },
+    }
+
+
+def _line(rng, vertices):
+    x, y = _random_point(rng)
+    coords = []
+    for _ in range(vertices):
+        x += rng.uniform(-0.002, 0.002)
+        y += rng.uniform(-0.002, 0.002)
+        coords.append([round(x, 6), round(y, 6)])
+    return coords
+
+
+def _route(i, rng, vertices, multi=False):
+    if multi:
+        oid = f'r-9q9-route~{i}'
+        geometry = {
+            'type': 'MultiLineString',
+            'coordinates': [_line(rng, vertices // 2) for _ in range(2)]}
+    else:
+        oid = f'r-9q9-route~{i}-{i:08x}-{i:08x}'
+        geometry = {'type': 'LineString', 'coordinates': _line(rng, vertices)}
+    return {
+        'type': 'Feature',
+        'id': oid,
+        'geometry': geometry,
+        'properties': {
+            'onestop_id': oid,
+            'name': f'Route {i}',
+            'vehicle_type': 'bus',
+            'color': f'{i % 0xffffff:06X}',
+            'tags': {'route_long_name': f'Route {i} Long Name'},
+            'operated_by_onestop_id': 'o-9q9-agency',
+        },
+    }
+
+
+def _stop_pair(i, rng):
+    departure = rng.randrange(4 * 3600, 24 * 3600)
+    arrival = departure + rng.randrange(60, 600)
+    return {
+        'origin_onestop_id': f's-9q9-stop~{i}',
+        'destination_onestop_id': f's-9q9-stop~{i + 1}',
+        'route_onestop_id': f'r-9q9-route~{i % 100}',
+        'trip': f'trip-{i}',
+        'origin_departure_time': _clock(departure),
+        'destination_arrival_time': _clock(arrival),
+        'service_start_date': '2020-01-01',
+        'service_end_date': '2020-12-31',
+        'service_days_of_week': [True] * 5 + [False] * 2,
+    }
+
+
+def _clock(seconds):
+    return '{:02d}:{:02d}:{:02d}'.format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _onestop_id(result):
+    if result.get('type') == 'Feature':
+        return result.get('id')
+    return result.get('onestop_id')
+
+
+def _as_entity(result):
+    """A result as the onestop_id endpoint returns it, without GeoJSON"""
+    if result.get('type') != 'Feature':
+        return result
+    return dict(
+        result.get('properties') or {},
+        onestop_id=result.get('id'),
+        geometry=result.get('geometry'))
+
+
+def _bounds(result):
+    geometry = result.get('geometry') if isinstance(result, dict) else None
+    if not geometry:
+        return None
+
+    xs, ys = [], []
+    stack = [geometry['coordinates']]
+    while stack:
+        coords = stack.pop()
+        if coords and isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            stack.extend(coords)
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _intersects(bounds, bbox):
+    if bounds is None:
+        return False
+    return not (
+        bounds[2] < bbox[0] or bounds[0] > bbox[2] or bounds[3] < bbox[1]
+        or bounds[1] > bbox[3])
+
+
+def circle(center=None, radius=0.15, resolution=64):
+    """GeoJSON Polygon of a circle in the middle of the synthetic results"""
+    if center is None:
+        x0, y0, x1, y1 = BOUNDS
+        center = ((x0 + x1) / 2, (y0 + y1) / 2)
+    coords = [[
+        center[0] + radius * math.cos(2 * math.pi * i / resolution),
+        center[1] + radius * math.sin(2 * math.pi * i / resolution)]
+        for i in range(resolution)]
+    coords.append(coords[0])
+    return {'type': 'Polygon', 'coordinates': [coords]}
@@ -42,6 +42,13 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require={
+        'arrow': ['pyarrow', 'pyogrio'],
+        'async': ['aiohttp'],
+        'orjson': ['orjson'],
+        'stream': ['ijson'],
+        'zstd': ['zstandard'],
+    },
     license="MIT license",
     long_description=readme + '\n\n' + history,
     long_description_content_type='text/markdown',
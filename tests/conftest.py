@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+from transitland_wrapper import (
+    cache, metrics, ratelimit, retry, tracing, transitland)
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks'))
+
+from mock_server import MockServer  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def defaults():
+    """Run each test without rate limiting, backoff, caches or metrics, and
+    restore the defaults afterwards
+    """
+    ratelimit.configure_rate_limiter(0)
+    retry.configure_retry(
+        backoff_factor=0, circuit_breaker=retry.CircuitBreaker())
+    yield
+    cache.disable_cache()
+    cache.disable_geometry_cache()
+    cache.configure_lookup_cache()
+    metrics.disable_metrics()
+    tracing.disable_tracing()
+    ratelimit.configure_rate_limiter()
+    retry.configure_retry(circuit_breaker=retry.CircuitBreaker())
+
+
+@pytest.fixture(scope='session')
+def mock_server():
+    with MockServer(features=250, vertices=10, max_per_page=100) as server:
+        yield server
+
+
+@pytest.fixture
+def server(mock_server, monkeypatch):
+    """The mock server, with the API requests sent to it"""
+    monkeypatch.setattr(transitland, 'BASE_URL', mock_server.url)
+    return mock_server
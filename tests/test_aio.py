@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import pytest
+
+from transitland_wrapper import cache
+
+aio = pytest.importorskip('transitland_wrapper.aio')
+pytest.importorskip('aiohttp')
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await aio.close_session()
+    return asyncio.run(main())
+
+
+def test_stopping_early_cancels_requests(server):
+    async def first_page():
+        pages = aio._request_transit_land(
+            'stops', params={'per_page': 10}, workers=4)
+        features = await pages.__anext__()
+        await pages.aclose()
+        # Let cancelled requests unwind
+        await asyncio.sleep(0)
+        others = asyncio.all_tasks() - {asyncio.current_task()}
+        return features, [task for task in others if not task.done()]
+
+    features, pending = run(first_page())
+    assert len(features) == 10
+    assert pending == []
+
+
+def test_cache_queries_leave_the_event_loop(server, tmp_path, monkeypatch):
+    response_cache = cache.configure_cache(str(tmp_path))
+    threads = []
+    for name in ('get', 'set'):
+        method = getattr(response_cache, name)
+
+        def record(*args, method=method, **kwargs):
+            threads.append(threading.current_thread())
+            return method(*args, **kwargs)
+        monkeypatch.setattr(response_cache, name, record)
+
+    async def crawl():
+        return [
+            features
+            async for features in aio.stops(page_all=False, per_page=10)]
+
+    assert len(run(crawl())[0]) == 10
+    assert len(run(crawl())[0]) == 10
+    assert response_cache.stats['hits'] == 1
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,54 @@
+from transitland_wrapper import transitland
+from transitland_wrapper.autotune import PageSizeTuner
+
+
+def tune(tuner, latency, pages=20, nbytes=None):
+    """Feed the tuner pages whose latency is a function of their size, and
+    return the page sizes it chose
+    """
+    sizes = []
+    for _ in range(pages):
+        per_page = tuner.per_page
+        tuner.record(
+            per_page, latency(per_page),
+            nbytes(per_page) if nbytes else None)
+        sizes.append(tuner.per_page)
+    return sizes
+
+
+def test_grows_while_larger_pages_pay_off():
+    tuner = PageSizeTuner(per_page=50, max_per_page=1000)
+    sizes = tune(tuner, lambda n: 0.5 + 0.001 * n)
+    assert sizes[:4] == [100, 200, 400, 800]
+    assert set(sizes[4:]) == {1000}
+
+
+def test_settles_on_best_size():
+    # Results per second peak at 400 results per page
+    tuner = PageSizeTuner(per_page=50)
+    sizes = tune(tuner, lambda n: 1 + (n / 400) ** 2)
+    assert set(sizes[-10:]) == {400}
+    assert tuner.pages == 20
+
+
+def test_shrinks_slow_pages_for_good():
+    tuner = PageSizeTuner(per_page=800, max_latency=5)
+    sizes = tune(tuner, lambda n: n / 100)
+    assert sizes[0] == 400
+    assert max(sizes) == 400
+
+
+def test_does_not_grow_past_max_bytes():
+    tuner = PageSizeTuner(per_page=100, max_bytes=50000)
+    sizes = tune(tuner, lambda n: 0.1, nbytes=lambda n: 200 * n)
+    assert max(sizes) == 250
+
+
+def test_auto_pages_every_result(server):
+    tuner = PageSizeTuner(per_page=10)
+    pages = list(transitland.stops(page_all=True, per_page=tuner))
+    ids = [feature['id'] for page in pages for feature in page]
+    assert len(ids) == len(set(ids)) == 250
+    # The page size changed during the crawl
+    assert len({len(page) for page in pages[:-1]}) > 1
+    assert tuner.pages > 0
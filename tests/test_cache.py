@@ -0,0 +1,160 @@
+import json
+import os
+import zlib
+
+import pytest
+
+from transitland_wrapper import cache, metrics, transitland
+from transitland_wrapper.cache import ResponseCache
+
+URL = 'https://transit.land/api/v1/stops'
+
+
+class Response:
+    def __init__(self, content, headers=None):
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeResponse(Response):
+    def __init__(self, status_code, content=b'', headers=None):
+        super().__init__(content, headers)
+        self.status_code = status_code
+        self.url = URL
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """Session that answers with each of responses in turn, and records the
+    headers of each request
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.headers = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.headers.append(headers)
+        return self.responses.pop(0)
+
+
+class Clock:
+    """Stand-in for the time module, advanced by hand"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+
+def test_crawl_is_answered_from_cache(server, tmp_path):
+    response_cache = cache.configure_cache(str(tmp_path))
+    first = list(transitland.stops(page_all=True, per_page=100))
+    before = server.stats['requests']
+    second = list(transitland.stops(page_all=True, per_page=100))
+
+    assert second == first
+    assert server.stats['requests'] == before
+    assert response_cache.stats['hits'] == 3
+
+
+def test_params_are_normalized(tmp_path):
+    response_cache = ResponseCache(str(tmp_path))
+    response_cache.set(URL, {'a': 1, 'b': 2}, Response(b'{}'))
+    assert response_cache.get(URL + '?b=2', {'a': 1}) is not None
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    response_cache = ResponseCache(str(tmp_path), ttl=60)
+    response_cache.set(URL, {'offset': 0}, Response(b'{}'))
+
+    clock.now += 60
+    assert response_cache.get(URL, {'offset': 0}).fresh
+
+    clock.now += 1
+    assert response_cache.get(URL, {'offset': 0}) is None
+    stale = response_cache.get(URL, {'offset': 0}, stale=True)
+    assert not stale.fresh
+    assert response_cache.stats == {
+        'hits': 1, 'misses': 1, 'revalidated': 0, 'redownloaded': 0}
+
+
+def test_endpoint_ttls(tmp_path, clock):
+    response_cache = ResponseCache(
+        str(tmp_path), ttl=60, ttls={'schedule_stop_pairs': 10})
+    pairs_url = 'https://transit.land/api/v1/schedule_stop_pairs'
+    response_cache.set(URL, None, Response(b'{}'))
+    response_cache.set(pairs_url, None, Response(b'{}'))
+
+    clock.now += 30
+    assert response_cache.get(URL) is not None
+    assert response_cache.get(pairs_url) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    bodies = [os.urandom(1000) for _ in range(4)]
+    size = max(len(zlib.compress(body)) for body in bodies)
+    response_cache = ResponseCache(str(tmp_path), max_size=3 * size)
+
+    for i, body in enumerate(bodies[:3]):
+        clock.now += 1
+        response_cache.set(URL, {'offset': i}, Response(body))
+    clock.now += 1
+    assert response_cache.get(URL, {'offset': 0}).content == bodies[0]
+
+    clock.now += 1
+    response_cache.set(URL, {'offset': 3}, Response(bodies[3]))
+    assert response_cache.get(URL, {'offset': 1}) is None
+    for i in (0, 2, 3):
+        assert response_cache.get(URL, {'offset': i}).content == bodies[i]
+
+
+@pytest.fixture
+def expired(tmp_path, clock):
+    """Shared cache with an expired entry that has validators"""
+    response_cache = cache.configure_cache(str(tmp_path), ttl=60)
+    response_cache.set(URL, {'offset': 0}, Response(b'{"old": 1}', {
+        'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Jan 2020 00:00:00 GMT'}))
+    clock.now += 61
+    return response_cache
+
+
+def test_not_modified_reuses_cached_body(expired):
+    collected = metrics.configure_metrics()
+    session = FakeSession(FakeResponse(304))
+    r = transitland._send_request(URL, {'offset': 0}, session=session)
+
+    assert r.json() == {'old': 1}
+    assert session.headers == [{
+        'If-None-Match': '"v1"',
+        'If-Modified-Since': 'Wed, 01 Jan 2020 00:00:00 GMT'}]
+    assert expired.stats['revalidated'] == 1
+    assert expired.stats['redownloaded'] == 0
+    assert collected.summary()['cache'] == {'revalidated': 1}
+    # The entry is fresh again
+    assert expired.get(URL, {'offset': 0}).fresh
+
+
+def test_modified_replaces_cached_body(expired):
+    collected = metrics.configure_metrics()
+    session = FakeSession(FakeResponse(200, b'{"new": 1}', {'ETag': '"v2"'}))
+    r = transitland._send_request(URL, {'offset': 0}, session=session)
+
+    assert r.json() == {'new': 1}
+    assert expired.stats['revalidated'] == 0
+    assert expired.stats['redownloaded'] == 1
+    assert collected.summary()['cache'] == {'miss': 1}
+    cached = expired.get(URL, {'offset': 0})
+    assert cached.json() == {'new': 1}
+    assert cached.etag == '"v2"'
@@ -0,0 +1,20 @@
+from click.testing import CliRunner
+
+from transitland_wrapper import cli
+
+
+def test_onestop_id_not_found(server):
+    result = CliRunner().invoke(
+        cli.main, ['--rate-limit', '0', 'onestop-id', '--oid', 's-unknown'])
+    assert result.exit_code == 1
+    assert 'onestop_id not found: s-unknown' in result.stderr
+    assert result.exception is None or isinstance(
+        result.exception, SystemExit)
+
+
+def test_onestop_id(server):
+    oid = server.onestop_ids()[0]
+    result = CliRunner().invoke(
+        cli.main, ['--rate-limit', '0', 'onestop-id', '--oid', oid])
+    assert result.exit_code == 0, result.output
+    assert oid in result.stdout
@@ -0,0 +1,73 @@
+import pytest
+
+from transitland_wrapper import frames, transitland
+
+gpd = pytest.importorskip('geopandas')
+
+
+def feature(i, **properties):
+    return {
+        'type': 'Feature',
+        'id': f's-{i}',
+        'geometry': {'type': 'Point', 'coordinates': [i, i]},
+        'properties': properties,
+    }
+
+
+def test_geodataframe_matches_from_features(server):
+    pages = list(transitland.stops(page_all=True, per_page=100))
+    gdf = frames.to_geodataframe(iter(pages))
+    expected = gpd.GeoDataFrame.from_features(
+        [f for page in pages for f in page], crs='EPSG:4326')
+
+    assert len(gdf) == 250
+    assert gdf.crs == expected.crs
+    assert gdf.geometry.geom_equals(expected.geometry).all()
+    for column in expected.columns.drop('geometry'):
+        assert gdf[column].tolist() == expected[column].tolist()
+
+
+def test_columns_appearing_later_are_filled_with_none():
+    builder = frames.FrameBuilder()
+    builder.add([feature(0, a=1)])
+    builder.add([feature(1, b='x'), feature(2, a=3)])
+    df = builder.to_dataframe()
+
+    assert len(builder) == 3
+    assert df['a'].tolist()[::2] == [1, 3]
+    assert df['a'].isna().tolist() == [False, True, False]
+    assert df['b'].isna().tolist() == [True, False, True]
+    assert df['b'][1] == 'x'
+    assert df['id'].tolist() == ['s-0', 's-1', 's-2']
+
+
+def test_columns_missing_within_a_page():
+    builder = frames.FrameBuilder()
+    builder.add([feature(0, a=1), feature(1), feature(2, a=3)])
+    assert builder.to_dataframe()['a'].tolist()[::2] == [1, 3]
+
+
+def test_columns_projection():
+    pages = [[feature(0, a=1, b=2, c=3)], [feature(1, a=4, b=5, c=6)]]
+    gdf = frames.to_geodataframe(pages, columns=['c', 'a'])
+    assert list(gdf.columns) == ['c', 'a', 'geometry']
+    assert gdf['c'].tolist() == [3, 6]
+
+
+def test_dataframe_of_json_results(server):
+    df = frames.to_dataframe(
+        'schedule_stop_pairs', columns=['origin_onestop_id'], per_page=100)
+    assert list(df.columns) == ['origin_onestop_id']
+    assert len(df) == 250
+
+
+def test_geodataframe_without_geometries_raises():
+    builder = frames.FrameBuilder()
+    builder.add([{'onestop_id': 'o-1'}])
+    with pytest.raises(ValueError):
+        builder.to_geodataframe()
+
+
+def test_no_results():
+    assert len(frames.to_geodataframe([[]])) == 0
+    assert len(frames.to_dataframe([])) == 0
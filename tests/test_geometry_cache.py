@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+from shapely.geometry import box, mapping, shape
+
+from transitland_wrapper import cache, cli
+
+GEOMETRY = box(-122.5, 37.7, -122.4, 37.8)
+
+
+def write_geojson(path, geometry=GEOMETRY):
+    with open(path, 'w') as f:
+        json.dump({
+            'type': 'FeatureCollection',
+            'features': [{
+                'type': 'Feature',
+                'geometry': mapping(geometry),
+                'properties': {},
+            }],
+        }, f)
+    return str(path)
+
+
+class Loader:
+    """Load the first geometry of a GeoJSON file, counting calls"""
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path) as f:
+            return shape(json.load(f)['features'][0]['geometry'])
+
+
+@pytest.fixture
+def geometry_cache(tmp_path):
+    return cache.GeometryCache(str(tmp_path / 'cache'))
+
+
+def test_unchanged_file_is_a_hit(tmp_path, geometry_cache):
+    path = write_geojson(tmp_path / 'area.geojson')
+    loader = Loader()
+    assert geometry_cache.load(path, loader).equals(GEOMETRY)
+    assert geometry_cache.load(path, loader).equals(GEOMETRY)
+    assert loader.calls == 1
+    assert geometry_cache.stats == {'hits': 1, 'misses': 1}
+
+
+def test_touched_file_is_a_hit(tmp_path, geometry_cache):
+    path = write_geojson(tmp_path / 'area.geojson')
+    loader = Loader()
+    geometry_cache.load(path, loader)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert geometry_cache.load(path, loader).equals(GEOMETRY)
+    assert loader.calls == 1
+
+
+def test_copied_file_is_a_hit(tmp_path, geometry_cache):
+    path = write_geojson(tmp_path / 'area.geojson')
+    loader = Loader()
+    geometry_cache.load(path, loader)
+    copy = str(tmp_path / 'copy.geojson')
+    shutil.copy(path, copy)
+
+    assert geometry_cache.load(copy, loader).equals(GEOMETRY)
+    assert loader.calls == 1
+
+
+def test_changed_file_is_a_miss(tmp_path, geometry_cache):
+    path = write_geojson(tmp_path / 'area.geojson')
+    loader = Loader()
+    geometry_cache.load(path, loader)
+    other = box(0, 0, 1, 1)
+    write_geojson(path, other)
+
+    assert geometry_cache.load(path, loader).equals(other)
+    assert loader.calls == 2
+
+
+def test_entries_persist(tmp_path):
+    path = write_geojson(tmp_path / 'area.geojson')
+    loader = Loader()
+    cache.GeometryCache(str(tmp_path / 'cache')).load(path, loader)
+    cache.GeometryCache(str(tmp_path / 'cache')).load(path, loader)
+    assert loader.calls == 1
+
+
+def test_cli_geometry_cache(server, tmp_path):
+    path = write_geojson(tmp_path / 'area.geojson')
+    args = [
+        '--rate-limit', '0', '--geometry-cache-dir', str(tmp_path / 'cache'),
+        'stops', '--geometry', path, '--per-page', '100']
+    first = CliRunner().invoke(cli.main, args)
+    second = CliRunner().invoke(cli.main, args)
+
+    assert first.exit_code == 0, first.output
+    assert second.exit_code == 0, second.output
+    assert 'geometry cache: 0 hits, 1 misses' in first.stderr
+    assert 'geometry cache: 1 hits, 0 misses' in second.stderr
+    assert second.stdout == first.stdout
+
+
+def test_bounds_are_stored(tmp_path, geometry_cache):
+    path = write_geojson(tmp_path / 'area.geojson')
+    geometry_cache.load(path, Loader())
+    geometry = geometry_cache.load(path, Loader())
+
+    assert cache._known_bounds[id(geometry)] == GEOMETRY.bounds
+    assert cache.geometry_bounds(geometry) == GEOMETRY.bounds
+    # Other geometries have their bounds computed
+    assert cache.geometry_bounds(box(0, 0, 1, 2)) == (0, 0, 1, 2)
+
+
+def test_bounds_of_entries_stored_without_them(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    path = write_geojson(tmp_path / 'area.geojson')
+    conn = sqlite3.connect(str(cache_dir / 'geometries.sqlite'))
+    conn.execute(
+        'CREATE TABLE geometries (path TEXT PRIMARY KEY, mtime INTEGER, '
+        'size INTEGER, digest TEXT, wkb BLOB, accessed REAL)')
+    conn.execute(
+        'INSERT INTO geometries VALUES (?, ?, ?, ?, ?, ?)', (
+            os.path.abspath(path), os.stat(path).st_mtime_ns,
+            os.stat(path).st_size, '', GEOMETRY.wkb, 0))
+    conn.commit()
+    conn.close()
+
+    loader = Loader()
+    geometry = cache.GeometryCache(str(cache_dir)).load(path, loader)
+    assert loader.calls == 0
+    assert id(geometry) not in cache._known_bounds
+    assert cache.geometry_bounds(geometry) == GEOMETRY.bounds
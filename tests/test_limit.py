@@ -0,0 +1,70 @@
+import pytest
+from shapely.geometry import Polygon
+
+from transitland_wrapper import transitland
+
+
+def flatten(pages):
+    return [feature for page in pages for feature in page]
+
+
+@pytest.fixture
+def requests(server):
+    """Number of requests the mock server got since the test started"""
+    before = server.stats['requests']
+    return lambda: server.stats['requests'] - before
+
+
+def test_small_limit_is_one_small_request(requests):
+    features = flatten(transitland.stops(page_all=True, limit=25))
+    assert len(features) == 25
+    assert requests() == 1
+
+
+# Options, and the most pages they may request ahead of the 3 pages needed
+@pytest.mark.parametrize('kwargs, ahead', [
+    ({}, 0),
+    ({'workers': 4}, 3),
+    ({'prefetch': 2}, 3),
+    ({'stream': True}, 0),
+])
+def test_limit_stops_paging(requests, kwargs, ahead):
+    everything = flatten(transitland.stops(page_all=True, per_page=50))
+    before = requests()
+    features = flatten(transitland.stops(
+        page_all=True, per_page=50, limit=120, **kwargs))
+
+    assert features == everything[:120]
+    assert requests() - before <= 3 + ahead
+
+
+def test_limit_counts_filtered_results(requests):
+    geometry = Polygon([(-122.6, 37.2), (-121.8, 37.2), (-122.6, 38.0)])
+    everything = flatten(transitland.stops(
+        geometry=geometry, page_all=True, per_page=20))
+    before = requests()
+    features = flatten(transitland.stops(
+        geometry=geometry, page_all=True, per_page=20, limit=30))
+
+    assert features == everything[:30]
+    assert requests() - before < before
+
+
+def test_zero_limit_sends_no_requests(requests):
+    assert flatten(transitland.stops(page_all=True, limit=0)) == []
+    assert requests() == 0
+
+
+def test_fields_projection(server):
+    features = flatten(transitland.stops(
+        page_all=False, fields=['name', 'onestop_id']))
+    assert features
+    for feature in features:
+        assert set(feature) == {'type', 'id', 'geometry', 'properties'}
+        assert set(feature['properties']) <= {'name', 'onestop_id'}
+        assert 'name' in feature['properties']
+
+    pairs = flatten(transitland.schedule_stop_pairs(
+        page_all=False, fields=['origin_onestop_id']))
+    assert pairs
+    assert all(set(pair) == {'origin_onestop_id'} for pair in pairs)
@@ -0,0 +1,36 @@
+import json
+
+from click.testing import CliRunner
+
+from transitland_wrapper import cli, metrics, transitland
+
+
+def test_stream_with_stats(server, tmp_path):
+    """Streamed pages are counted without breaking the crawl"""
+    stats_file = tmp_path / 'stats.json'
+    result = CliRunner().invoke(cli.main, [
+        '--rate-limit', '0', '--stats', '--stats-file', str(stats_file),
+        'stops', '--page-all', '--stream', '--per-page', '100'])
+    assert result.exit_code == 0, result.output
+    assert 'stats: 3 pages, 250 results, 250 kept' in result.stderr
+
+    summary = json.loads(stats_file.read_text())
+    assert summary['pages'] == 3
+    assert summary['results'] == summary['kept'] == 250
+
+
+def test_stream_with_steps_records_pages(server):
+    """Pages filtered while streamed still record their counts"""
+    from shapely.geometry import Polygon
+
+    collected = metrics.configure_metrics()
+    pages = transitland.stops(
+        geometry=Polygon([(-122.6, 37.2), (-121.8, 37.2), (-122.6, 38.0)]),
+        page_all=True,
+        stream=True, per_page=100)
+    features = [feature for page in pages for feature in page]
+
+    summary = collected.summary()
+    assert summary['pages'] > 0
+    assert summary['kept'] == len(features)
+    assert 0 < len(features) < summary['results']
@@ -0,0 +1,79 @@
+import gzip
+import json
+
+import pytest
+
+from transitland_wrapper import sinks
+
+
+def feature(i, **properties):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [i, i]},
+        'properties': properties,
+    }
+
+
+def read(path, compress):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if compress == 'gzip':
+        data = gzip.decompress(data)
+    elif compress == 'zstd':
+        zstandard = pytest.importorskip('zstandard')
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            data, read_across_frames=True)
+        data = reader.read()
+    return [json.loads(line) for line in data.splitlines()]
+
+
+@pytest.fixture(params=[None, 'gzip', 'zstd'])
+def compress(request):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    return request.param
+
+
+def test_round_trip(tmp_path, compress):
+    ext = {None: '', 'gzip': '.gz', 'zstd': '.zst'}[compress]
+    path = str(tmp_path / f'out.ndjson{ext}')
+    pages = [[feature(i, n=i, s='é')] for i in range(3)] + [[]]
+    # A small buffer, so that output is written in many parts
+    sink = sinks.open_sink(path)
+    sink.buffer_size = 10
+    assert sink.compress == compress
+    sinks.write_pages(pages, sink)
+
+    assert read(path, compress) == [f for page in pages for f in page]
+
+
+def test_resume_from_flush(tmp_path, compress):
+    path = str(tmp_path / 'out.ndjson')
+    sink = sinks.NDJSONSink(path, compress=compress)
+    sink.write([feature(0)])
+    offset = sink.flush()
+    # Output after the last flush is discarded when resuming
+    sink.write([feature(1)])
+    sink.close()
+
+    with sinks.NDJSONSink(path, compress=compress, offset=offset) as sink:
+        sink.write([feature(2)])
+    assert read(path, compress) == [feature(0), feature(2)]
+
+
+@pytest.mark.parametrize('encoder', ['json', 'orjson'])
+def test_encoders(tmp_path, encoder):
+    if encoder == 'orjson':
+        pytest.importorskip('orjson')
+    path = str(tmp_path / 'out.ndjson')
+    rows = [feature(0, a=[1, 2], b=None, c=1.5)]
+    sinks.write_pages([rows], sinks.NDJSONSink(path, encoder=encoder))
+    assert read(path, None) == rows
+
+
+def test_infer_format_and_compression():
+    assert sinks.infer_format('out.ndjson.gz') == 'ndjson'
+    assert sinks.infer_compression('out.ndjson.gz') == 'gzip'
+    assert sinks.infer_compression('out.ndjson.zst') == 'zstd'
+    assert sinks.infer_format('out.geoparquet') == 'parquet'
+    assert sinks.infer_compression(None) is None
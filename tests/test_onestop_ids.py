@@ -0,0 +1,54 @@
+from collections import Counter
+
+import pytest
+
+from transitland_wrapper import cache, transitland
+
+
+@pytest.fixture
+def oids(server):
+    known = server.onestop_ids()[:6]
+    return known + ['s-unknown'] + known[::2] + ['s-unknown']
+
+
+def test_results_in_input_order(server, oids):
+    before = server.stats['requests']
+    results = list(transitland.onestop_ids(oids, workers=3))
+
+    assert [oid for oid, _ in results] == oids
+    for oid, result in results:
+        if oid == 's-unknown':
+            assert result is None
+        else:
+            assert result['onestop_id'] == oid
+    # Each distinct ID is requested once
+    assert server.stats['requests'] - before == 7
+
+
+def test_unordered_results(server, oids):
+    before = server.stats['requests']
+    results = list(transitland.onestop_ids(oids, workers=3, ordered=False))
+
+    assert Counter(oid for oid, _ in results) == Counter(oids)
+    assert all(
+        (result is None) == (oid == 's-unknown') for oid, result in results)
+    assert server.stats['requests'] - before == 7
+
+
+def test_repeated_lookups_use_the_lru_cache(server, oids):
+    first = list(transitland.onestop_ids(oids))
+    before = server.stats['requests']
+    assert list(transitland.onestop_ids(oids)) == first
+    assert server.stats['requests'] == before
+    assert cache.get_lookup_cache().stats['hits'] > 0
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = cache.LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1
+    assert lru.get('c') == 3
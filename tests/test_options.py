@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from click.testing import CliRunner
+from shapely.geometry import box
+
+from transitland_wrapper import aio, cli, transitland
+
+
+def test_shard_requires_page_all():
+    with pytest.raises(ValueError, match='page_all'):
+        next(transitland.stops(
+            geometry=box(0, 0, 1, 1), shard=100, page_all=False))
+
+
+def test_cli_shard_requires_page_all():
+    result = CliRunner().invoke(
+        cli.main, ['stops', '--bbox', '0,0,1,1', '--shard', '100'])
+    assert result.exit_code == 2
+    assert '--shard requires --page-all' in result.output
+
+
+def test_cli_cover_requires_geometry():
+    result = CliRunner().invoke(cli.main, ['stops', '--cover', '4'])
+    assert result.exit_code == 2
+    assert '--cover requires --geometry or --bbox' in result.output
+
+
+@pytest.mark.parametrize('option', [
+    {'shard': 100},
+    {'cover': True},
+    {'stream': True},
+    {'resume_from': 'checkpoint.json'},
+    {'per_page': 'auto'},
+])
+def test_aio_unsupported_options_raise_value_error(option):
+    async def first_page():
+        return await aio.stops(
+            geometry=box(0, 0, 1, 1), **option).__anext__()
+
+    with pytest.raises(ValueError):
+        asyncio.run(first_page())
+
+
+def test_cli_checkpoint_requires_page_all(tmp_path):
+    result = CliRunner().invoke(cli.main, [
+        'stops', '--checkpoint', str(tmp_path / 'checkpoint.json'),
+        '--output', str(tmp_path / 'stops.ndjson')])
+    assert result.exit_code == 2
+    assert '--checkpoint requires --page-all' in result.output
+
+
+def test_cli_checkpoint_rejects_workers(tmp_path):
+    result = CliRunner().invoke(cli.main, [
+        'stops', '--page-all', '--workers', '4',
+        '--checkpoint', str(tmp_path / 'checkpoint.json'),
+        '--output', str(tmp_path / 'stops.ndjson')])
+    assert result.exit_code == 2
+    assert '--checkpoint cannot be used with --workers' in result.output
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from transitland_wrapper import transitland
+
+
+def onestop_ids(pages):
+    return [feature['id'] for page in pages for feature in page]
+
+
+@pytest.fixture
+def sequential(server):
+    return onestop_ids(transitland.stops(page_all=True, per_page=30))
+
+
+def test_sequential_pages_every_result(server, sequential):
+    assert len(sequential) == 250
+    assert len(set(sequential)) == 250
+
+
+def test_workers_match_sequential(server, sequential):
+    before = server.stats['requests']
+    pages = transitland.stops(page_all=True, per_page=30, workers=4)
+    assert onestop_ids(pages) == sequential
+    assert server.stats['requests'] - before == 9
+
+
+def test_unordered_workers_match_sequential(server, sequential):
+    pages = transitland.stops(
+        page_all=True, per_page=30, workers=4, ordered=False)
+    result = onestop_ids(pages)
+    assert len(result) == len(sequential)
+    assert set(result) == set(sequential)
+
+
+def test_aio_workers_match_sequential(server, sequential):
+    aio = pytest.importorskip('transitland_wrapper.aio')
+    pytest.importorskip('aiohttp')
+
+    async def crawl():
+        try:
+            return [
+                features async for features in aio.stops(
+                    page_all=True, per_page=30, workers=4)]
+        finally:
+            await aio.close_session()
+
+    assert onestop_ids(asyncio.run(crawl())) == sequential
+
+
+def test_prefetch_matches_sequential(server, sequential):
+    pages = transitland.stops(page_all=True, per_page=30, prefetch=2)
+    assert onestop_ids(pages) == sequential
+
+
+def test_prefetch_stops_when_closed(server):
+    before = server.stats['requests']
+    pages = transitland.stops(page_all=True, per_page=10, prefetch=2)
+    next(pages)
+    pages.close()
+    # The page being read, the pages queued, and at most one in flight
+    assert server.stats['requests'] - before <= 4
+
+
+def test_prefetch_raises_errors():
+    def pages():
+        yield [1]
+        raise RuntimeError('failed')
+
+    prefetched = transitland._prefetch(pages(), 2)
+    assert next(prefetched) == [1]
+    with pytest.raises(RuntimeError, match='failed'):
+        next(prefetched)
+
+
+def test_aio_prefetch_matches_sequential(server, sequential):
+    aio = pytest.importorskip('transitland_wrapper.aio')
+    pytest.importorskip('aiohttp')
+
+    async def crawl():
+        try:
+            return [
+                features async for features in aio.stops(
+                    page_all=True, per_page=30, prefetch=2)]
+        finally:
+            await aio.close_session()
+
+    assert onestop_ids(asyncio.run(crawl())) == sequential
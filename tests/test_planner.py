@@ -0,0 +1,37 @@
+import time
+
+from shapely.geometry import MultiPolygon, box
+
+from transitland_wrapper.planner import plan_cover
+
+
+def test_disjoint_parts_get_separate_boxes():
+    geometry = MultiPolygon([box(0, 0, 1, 1), box(10, 10, 11, 11)])
+    cover = plan_cover(geometry)
+    assert sorted(cover.boxes) == [(0, 0, 1, 1), (10, 10, 11, 11)]
+    assert cover.area_saved > 0.9
+
+
+def test_adjacent_parts_are_merged():
+    geometry = MultiPolygon([box(0, 0, 1, 1), box(1, 0, 2, 1)])
+    assert plan_cover(geometry).boxes == [(0, 0, 2, 1)]
+
+
+def test_many_parts_respect_max_boxes():
+    parts = [
+        box(x * 3, y * 3, x * 3 + 1, y * 3 + 1)
+        for x in range(40) for y in range(20)]
+    geometry = MultiPolygon(parts)
+
+    start = time.perf_counter()
+    cover = plan_cover(geometry, max_boxes=16)
+    assert time.perf_counter() - start < 2
+
+    assert len(cover.boxes) <= 16
+    for part in parts:
+        assert any(box(*b).contains(part) for b in cover.boxes)
+
+
+def test_max_boxes_of_one_is_the_envelope():
+    geometry = MultiPolygon([box(0, 0, 1, 1), box(10, 10, 11, 11)])
+    assert plan_cover(geometry, max_boxes=1).boxes == [(0, 0, 11, 11)]
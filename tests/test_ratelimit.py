@@ -0,0 +1,44 @@
+import pytest
+
+from transitland_wrapper.ratelimit import SQLiteTokenBucket, TokenBucket
+
+
+def test_burst_is_sent_at_once():
+    bucket = TokenBucket(requests_per_minute=60, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == pytest.approx(1, abs=0.05)
+
+
+def test_waits_queue_in_order():
+    bucket = TokenBucket(requests_per_minute=120, burst=1)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[0] == 0
+    assert waits[1:] == pytest.approx([0.5, 1, 1.5], abs=0.05)
+
+
+def test_no_rate_never_waits():
+    for requests_per_minute in (0, None):
+        bucket = TokenBucket(requests_per_minute=requests_per_minute)
+        assert all(bucket.reserve() == 0 for _ in range(100))
+
+
+def test_penalize_holds_off_requests():
+    bucket = TokenBucket(requests_per_minute=60, burst=5)
+    bucket.penalize(10)
+    assert bucket.reserve() == pytest.approx(11, abs=0.05)
+
+
+def test_burst_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenBucket(burst=0)
+
+
+def test_sqlite_bucket_is_shared(tmp_path):
+    path = str(tmp_path / 'ratelimit.sqlite')
+    first = SQLiteTokenBucket(path, requests_per_minute=60, burst=2)
+    second = SQLiteTokenBucket(path, requests_per_minute=60, burst=2)
+    assert first.reserve() == 0
+    assert second.reserve() == 0
+    assert first.reserve() == pytest.approx(1, abs=0.05)
+    first.close()
+    second.close()
@@ -0,0 +1,184 @@
+import pytest
+from requests.exceptions import ChunkedEncodingError
+
+from transitland_wrapper import cache, metrics, ratelimit, retry, transitland
+from transitland_wrapper.exceptions import CircuitOpenError, RetryError
+from transitland_wrapper.retry import (
+    CircuitBreaker, RetryPolicy, parse_retry_after)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = 'https://transit.land/api/v1/stops'
+        self.content = b'{}'
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """Session that answers with, or raises, each of outcomes in turn"""
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+
+    def get(self, url, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def breaker():
+    """Shared breaker that opens after one failure, with no reset timeout"""
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    retry.configure_retry(
+        max_attempts=2, backoff_factor=0, circuit_breaker=circuit_breaker)
+    ratelimit.configure_rate_limiter(0)
+    cache.disable_cache()
+    metrics.disable_metrics()
+    yield circuit_breaker
+    retry.configure_retry(circuit_breaker=CircuitBreaker())
+    ratelimit.configure_rate_limiter()
+
+
+def test_delay_backs_off_exponentially():
+    policy = RetryPolicy(backoff_factor=1, max_backoff=10, jitter=False)
+    assert [policy.get_delay(n) for n in range(1, 6)] == [1, 2, 4, 8, 10]
+
+
+def test_delay_jitter_is_bounded():
+    policy = RetryPolicy(backoff_factor=1, max_backoff=60)
+    for _ in range(100):
+        assert 0 <= policy.get_delay(3) <= 4
+
+
+def test_delay_respects_retry_after():
+    policy = RetryPolicy(max_backoff=60)
+    assert policy.get_delay(1, FakeResponse(429, {'Retry-After': '7'})) == 7
+    assert policy.get_delay(
+        1, FakeResponse(429, {'Retry-After': '3600'})) == 60
+
+    policy = RetryPolicy(
+        backoff_factor=1, jitter=False, respect_retry_after=False)
+    assert policy.get_delay(1, FakeResponse(429, {'Retry-After': '7'})) == 1
+
+
+def test_should_retry():
+    policy = RetryPolicy()
+    assert policy.should_retry(FakeResponse(429))
+    assert policy.should_retry(FakeResponse(503))
+    assert not policy.should_retry(FakeResponse(404))
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('5') == 5
+    assert parse_retry_after('-5') == 0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.before_request()
+    assert not breaker.is_open
+
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.before_request() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.before_request() is False
+
+
+def test_breaker_failed_trial_reopens():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=60)
+    for _ in range(5):
+        breaker.record_failure()
+    breaker.reset_timeout = 0
+    assert breaker.before_request()
+
+    breaker.reset_timeout = 60
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_breaker_released_trial_lets_next_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.before_request()
+    breaker.release_trial()
+    assert breaker.before_request()
+
+
+def test_breaker_disabled():
+    breaker = CircuitBreaker(failure_threshold=None)
+    for _ in range(100):
+        breaker.record_failure()
+    assert breaker.before_request() is False
+
+
+def test_trial_answered_with_429_closes_breaker(breaker):
+    breaker.record_failure()
+    session = FakeSession(
+        FakeResponse(429, {'Retry-After': '0'}), FakeResponse(200))
+    r = transitland._send_request(
+        'https://transit.land/api/v1/stops', session=session)
+    assert r.status_code == 200
+    assert not breaker.is_open
+
+
+def test_trial_raising_unexpected_error_is_released(breaker):
+    breaker.record_failure()
+    session = FakeSession(ChunkedEncodingError(), FakeResponse(200))
+    with pytest.raises(ChunkedEncodingError):
+        transitland._send_request(
+            'https://transit.land/api/v1/stops', session=session)
+
+    r = transitland._send_request(
+        'https://transit.land/api/v1/stops', session=session)
+    assert r.status_code == 200
+    assert not breaker.is_open
+
+
+def test_retries_until_max_attempts(breaker):
+    breaker.failure_threshold = None
+    session = FakeSession(FakeResponse(503), FakeResponse(503))
+    with pytest.raises(RetryError) as e:
+        transitland._send_request(
+            'https://transit.land/api/v1/stops', session=session)
+    assert e.value.attempts == 2
+
+
+def test_429_waits_without_rate_limit(breaker, monkeypatch):
+    delays = []
+    monkeypatch.setattr(transitland, 'sleep', delays.append)
+    session = FakeSession(
+        FakeResponse(429, {'Retry-After': '2'}), FakeResponse(200))
+    transitland._send_request(
+        'https://transit.land/api/v1/stops', session=session)
+    assert delays == [2]
@@ -0,0 +1,71 @@
+import math
+
+from shapely.geometry import LineString, Polygon, shape
+
+from transitland_wrapper import transitland
+from transitland_wrapper.simplify import GeometryReducer
+
+
+def line_feature(coords):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'LineString', 'coordinates': coords},
+        'properties': {},
+    }
+
+
+def wiggly_line(n=200):
+    return [[i / n, 0.001 * math.sin(i)] for i in range(n + 1)]
+
+
+def test_rounds_nested_coordinates():
+    feature = {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'MultiLineString',
+            'coordinates': [[[1.23456, 2.34567], [3.45678, 4.56789]]]},
+        'properties': {},
+    }
+    reducer = GeometryReducer(precision=2)
+    reduced, = reducer.reduce([feature])
+    assert reduced['geometry']['coordinates'] == [[[1.23, 2.35], [3.46, 4.57]]]
+
+
+def test_simplifies_within_tolerance():
+    coords = wiggly_line()
+    reducer = GeometryReducer(simplify_tolerance=0.01)
+    reduced, = reducer.reduce([line_feature(coords)])
+
+    simplified = shape(reduced['geometry'])
+    assert len(simplified.coords) < len(coords) / 10
+    assert simplified.hausdorff_distance(LineString(coords)) <= 0.01
+    assert reducer.stats['geometries'] == 1
+    assert reducer.stats['bytes_after'] < reducer.stats['bytes_before'] / 10
+    assert 'saved' in reducer.report()
+
+
+def test_features_without_geometry_are_kept():
+    features = [
+        {'type': 'Feature', 'geometry': None, 'properties': {'a': 1}},
+        line_feature([[0.123456, 0], [1, 1]]),
+    ]
+    reduced = GeometryReducer(precision=1).reduce(features)
+    assert reduced[0] == features[0]
+    assert reduced[1]['geometry']['coordinates'] == [[0.1, 0], [1, 1]]
+
+
+def test_filter_sees_full_geometries(server):
+    geometry = Polygon([(-122.6, 37.2), (-121.8, 37.2), (-122.6, 38.0)])
+    kwargs = {'geometry': geometry, 'page_all': True, 'per_page': 100}
+    full = [f for page in transitland.routes(**kwargs) for f in page]
+    reduced = [
+        f for page in transitland.routes(
+            precision=2, simplify_tolerance=0.05, **kwargs)
+        for f in page]
+
+    assert 0 < len(full) < 250
+    assert [f['id'] for f in reduced] == [f['id'] for f in full]
+    for f in reduced:
+        for line in f['geometry']['coordinates']:
+            for x, y in line:
+                assert round(x, 2) == x and round(y, 2) == y
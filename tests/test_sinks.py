@@ -0,0 +1,116 @@
+import pytest
+
+from transitland_wrapper import sinks
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+def feature(i, **properties):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [i, i]},
+        'properties': properties,
+    }
+
+
+def read(path, format):
+    if format == 'parquet':
+        return pq.read_table(path)
+    return pa.ipc.open_file(path).read_all()
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_sample_widens_schema(tmp_path, format):
+    path = str(tmp_path / f'out.{format}')
+    pages = [
+        [feature(0, wheelchair_boarding=None, n=1)],
+        [feature(1, wheelchair_boarding=True, n=1.5)],
+        [feature(2, wheelchair_boarding=False, n=2, extra='x')],
+    ]
+    sink = sinks.open_sink(path, format, row_group_size=1)
+    with sink:
+        for page in pages:
+            sink.write(page)
+        # Nothing is written until the schema is settled
+        assert sink.schema is None
+
+    table = read(path, format).to_pydict()
+    assert table['wheelchair_boarding'] == [None, True, False]
+    assert table['n'] == [1, 1.5, 2]
+    assert table['extra'] == [None, None, 'x']
+
+
+def test_results_after_sample_must_fit_schema(tmp_path):
+    path = str(tmp_path / 'out.parquet')
+    sink = sinks.open_sink(path, row_group_size=1, sample_size=2)
+    sink.write([feature(0, a=1, b=None), feature(1, a=2, b=None)])
+    assert sink.schema.field('b').type == pa.string()
+
+    # Columns that were all null in the sample hold strings
+    sink.write([feature(2, a=3, b=4)])
+    with pytest.raises(ValueError, match='sample_size'):
+        sink.write([feature(3, a=1.5)])
+    with pytest.raises(ValueError, match='sample_size'):
+        sink.write([feature(4, c='x')])
+    sink.close()
+
+    table = pq.read_table(path).to_pydict()
+    assert table['a'] == [1, 2, 3]
+    assert table['b'] == [None, None, '4']
+
+
+def test_declared_schema(tmp_path):
+    path = str(tmp_path / 'out.parquet')
+    schema = pa.schema([('a', pa.float64()), ('geometry', pa.binary())])
+    sinks.write_pages(
+        [[feature(0, a=1)], [feature(1)]],
+        sinks.open_sink(path, row_group_size=1, schema=schema))
+
+    table = pq.read_table(path)
+    assert table.schema.field('a').type == pa.float64()
+    assert table.column('a').to_pylist() == [1.0, None]
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow', 'flatgeobuf'])
+def test_no_results_write_empty_file(tmp_path, format):
+    if format == 'flatgeobuf':
+        pyogrio = pytest.importorskip('pyogrio')
+    path = str(tmp_path / 'out')
+    sinks.write_pages([[]], sinks.open_sink(path, format))
+
+    if format == 'flatgeobuf':
+        assert len(pyogrio.read_dataframe(path)) == 0
+    else:
+        assert read(path, format).num_rows == 0
+
+
+def test_flatgeobuf(tmp_path):
+    pyogrio = pytest.importorskip('pyogrio')
+    path = str(tmp_path / 'out.fgb')
+    sinks.write_pages(
+        [[feature(0, a=1)], [feature(1, a=2)]],
+        sinks.open_sink(path, row_group_size=1))
+
+    # Features are ordered by the spatial index
+    df = pyogrio.read_dataframe(path).sort_values('a')
+    assert df['a'].tolist() == [1, 2]
+    assert df.geometry.x.tolist() == [0, 1]
+
+
+def test_columns_after_first_record_are_kept():
+    batch = sinks.to_record_batch([feature(0, a=1), feature(1, b='x')])
+    assert batch.to_pydict()['b'] == [None, 'x']
+
+
+def test_incompatible_types_raise(tmp_path):
+    pages = [[feature(0, a=1)], [feature(1, a='x')]]
+    sink = sinks.open_sink(str(tmp_path / 'out.parquet'), row_group_size=1)
+    with pytest.raises(ValueError):
+        sinks.write_pages(pages, sink)
+
+
+def test_schema_does_not_truncate():
+    schema = pa.schema([('a', pa.int64()), ('geometry', pa.binary())])
+    with pytest.raises(ValueError):
+        sinks.to_record_batch([feature(0, a=1.5)], schema=schema)
@@ -0,0 +1,43 @@
+"""Guard against heavy imports at startup
+
+Each scenario runs in a fresh interpreter, since modules already imported by
+other tests would hide a regression.
+"""
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = [
+    'geopandas', 'numpy', 'pandas', 'pyarrow', 'requests', 'shapely',
+    'urllib3']
+
+SCENARIOS = {
+    'import cli': 'import transitland_wrapper.cli',
+    'cli --help': (
+        'from click.testing import CliRunner\n'
+        'from transitland_wrapper import cli\n'
+        'CliRunner().invoke(cli.main, ["--help"])\n'
+        'CliRunner().invoke(cli.main, ["stops", "--help"])'),
+    'crawl without geometry': (
+        'from transitland_wrapper import transitland\n'
+        'transitland._build_params(per_page=100)\n'
+        'transitland._prepare_filter("stops", None)\n'
+        'transitland._prepare_reducer()'),
+}
+
+
+def imported_modules(code):
+    code += '\nimport sys\nprint("\\n".join(sys.modules))'
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True)
+    return set(result.stdout.split())
+
+
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_no_heavy_imports(scenario):
+    modules = imported_modules(SCENARIOS[scenario])
+    assert [m for m in HEAVY_MODULES if m in modules] == []
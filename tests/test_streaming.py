@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from transitland_wrapper import streaming, transitland
+
+pytest.importorskip('ijson')
+
+
+class Response:
+    def __init__(self, data):
+        self.content = json.dumps(data).encode()
+
+
+def flatten(pages):
+    return [feature for page in pages for feature in page]
+
+
+@pytest.mark.parametrize('endpoint', ['stops', 'routes', 'schedule_stop_pairs'])
+def test_stream_matches_parsed_pages(server, endpoint):
+    func = getattr(transitland, endpoint)
+    parsed = flatten(func(page_all=True, per_page=100))
+    streamed = flatten(func(page_all=True, per_page=100, stream=True))
+    assert len(parsed) == 250
+    assert streamed == parsed
+
+
+def test_stream_with_steps_matches_parsed_pages(server):
+    kwargs = {'page_all': True, 'per_page': 100, 'precision': 3}
+    parsed = flatten(transitland.stops(**kwargs))
+    streamed = flatten(transitland.stops(stream=True, **kwargs))
+    assert streamed == parsed
+
+
+def test_iter_page_fills_meta_when_exhausted():
+    data = {
+        'type': 'FeatureCollection',
+        'features': [{'id': 1, 'properties': {'nested': {'id': 2}}}],
+        'meta': {'next': 'https://transit.land/api/v1/stops?offset=1'},
+    }
+    meta = {}
+    features = streaming.iter_page('stops', Response(data), meta)
+    assert next(features) == data['features'][0]
+    assert list(features) == []
+    assert meta == data['meta']
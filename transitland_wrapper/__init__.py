@@ -2,4 +2,11 @@ __author__ = """Kyle Barron"""
 __email__ = 'kylebarron2@gmail.com'
 __version__ = '0.5.0'
 
+from .exceptions import (
+    CircuitOpenError, DeadlineExceeded, HTTPStatusError, RetryError,
+    TransitlandError)
 from .transitland import operators, routes, stops
+
+__all__ = [
+    'CircuitOpenError', 'DeadlineExceeded', 'HTTPStatusError', 'RetryError',
+    'TransitlandError', 'operators', 'routes', 'stops']
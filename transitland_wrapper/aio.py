@@ -0,0 +1,505 @@
+"""asyncio versions of the endpoint functions
+
+Each function takes the same arguments as its counterpart in
+`transitland_wrapper.transitland`, but returns an _async_ generator of pages,
+so many independent queries can overlap on one event loop:
+
+```py
+from transitland_wrapper import aio
+
+async for features in aio.stops(geometry=geometry, page_all=True):
+    ...
+```
+
+Requests share the rate limiter, retry policy and circuit breaker of the
+synchronous API, and go through a pooled `aiohttp.ClientSession`. Requires
+aiohttp, which can be installed with `pip install transitland_wrapper[async]`.
+"""
+import asyncio
+import json
+import weakref
+from collections import deque
+from functools import partial
+from itertools import islice
+from time import monotonic
+
+from . import transitland
+from .cache import get_cache
+from .exceptions import TransitlandError
+from .metrics import RequestRecord, get_metrics, record_page
+from .ratelimit import get_rate_limiter
+from .retry import get_circuit_breaker, get_retry_policy
+from .session import DEFAULT_HEADERS, DEFAULT_POOL_MAXSIZE
+
+# One shared session per event loop, since aiohttp sessions can't be used
+# across loops
+_sessions = weakref.WeakKeyDictionary()
+
+
+def stops(**kwargs):
+    """Request stops info
+
+    See `transitland_wrapper.transitland.stops` for arguments.
+    """
+    transitland._check_keys(kwargs, transitland.ENDPOINT_KEYS['stops'])
+    return base(endpoint='stops', **kwargs)
+
+
+def operators(**kwargs):
+    """Request operators info
+
+    See `transitland_wrapper.transitland.operators` for arguments.
+    """
+    transitland._check_keys(kwargs, transitland.ENDPOINT_KEYS['operators'])
+    return base(endpoint='operators', **kwargs)
+
+
+def routes(**kwargs):
+    """Request routes info
+
+    See `transitland_wrapper.transitland.routes` for arguments.
+    """
+    transitland._check_keys(kwargs, transitland.ENDPOINT_KEYS['routes'])
+    return base(endpoint='routes', **kwargs)
+
+
+def route_stop_patterns(**kwargs):
+    """Request route_stop_pattern info
+
+    See `transitland_wrapper.transitland.route_stop_patterns` for arguments.
+    """
+    transitland._check_keys(
+        kwargs, transitland.ENDPOINT_KEYS['route_stop_patterns'])
+    return base(endpoint='route_stop_patterns', **kwargs)
+
+
+def schedule_stop_pairs(**kwargs):
+    """Request schedule_stop_pairs info
+
+    See `transitland_wrapper.transitland.schedule_stop_pairs` for arguments.
+    """
+    transitland._check_keys(
+        kwargs, transitland.ENDPOINT_KEYS['schedule_stop_pairs'])
+    transitland._validate_dates(kwargs)
+    return base(endpoint='schedule_stop_pairs', **kwargs)
+
+
+def onestop_id(oid, session=None):
+    """Request onestop_id info
+
+    Args:
+        - oid: a Onestop ID for any type of entity (for example, a stop or an
+          operator)
+        - session: aiohttp.ClientSession to use. By default the shared session
+          of the running event loop.
+    """
+    return _request_transit_land(
+        'onestop_id', params={'id': oid}, session=session)
+
+
+def feeds(**kwargs):
+    """Request feeds info
+
+    See `transitland_wrapper.transitland.feeds` for arguments.
+    """
+    transitland._check_keys(kwargs, transitland.ENDPOINT_KEYS['feeds'])
+    return base(endpoint='feeds', **kwargs)
+
+
+async def base(
+        endpoint,
+        geometry=None,
+        page_all=True,
+        session=None,
+        workers=1,
+        ordered=True,
+        prefetch=0,
+        shard=None,
+        cover=None,
+        stream=False,
+        precision=None,
+        simplify_tolerance=None,
+        fields=None,
+        limit=None,
+        resume_from=None,
+        **kwargs):
+    if shard or cover or stream or resume_from is not None:
+        msg = 'shard, cover, stream and resume_from cannot be used with the '
+        msg += 'asyncio API'
+        raise ValueError(msg)
+    if kwargs.get('per_page') == 'auto':
+        msg = "per_page='auto' cannot be used with the asyncio API"
+        raise ValueError(msg)
+
+    geometry_filter = transitland._prepare_filter(endpoint, geometry)
+    if limit is not None and geometry_filter is None:
+        # Every result counts toward the limit, so don't request more
+        kwargs['per_page'] = max(1, min(kwargs.get('per_page', 50), limit))
+
+    params = transitland._build_params(geometry=geometry, **kwargs)
+    reducer = transitland._prepare_reducer(precision, simplify_tolerance)
+
+    features_iter = _request_transit_land(
+        endpoint,
+        params=params,
+        page_all=page_all,
+        session=session,
+        workers=workers,
+        ordered=ordered)
+    if prefetch:
+        features_iter = _prefetch(features_iter, prefetch)
+
+    # Functions applied to each page, in order
+    steps = []
+    if fields is not None:
+        steps.append(partial(transitland._project_features, fields=set(fields)))
+    if geometry_filter is not None:
+        steps.append(geometry_filter.filter)
+    if reducer is not None:
+        steps.append(reducer.reduce)
+    if get_metrics() is not None:
+        steps = [partial(record_page, endpoint=endpoint, steps=steps)]
+
+    counter = transitland._LimitCounter(limit)
+    if counter.done:
+        return
+
+    try:
+        async for features in features_iter:
+            for step in steps:
+                features = step(features)
+            yield counter.take(features)
+            if counter.done:
+                break
+    finally:
+        await features_iter.aclose()
+
+
+async def _request_transit_land(
+        endpoint,
+        params=None,
+        page_all=True,
+        session=None,
+        workers=1,
+        ordered=True):
+    """Async wrapper to transit.land API to page over all results
+
+    Args:
+        - endpoint: endpoint to send requests to
+        - params: None or dict of params for sending requests
+        - page_all: page over all responses
+        - session: aiohttp.ClientSession to use. By default the shared session.
+        - workers: number of pages to fetch at once when paging over all
+          responses
+        - ordered: if False, yield concurrently fetched pages as they complete
+          instead of in order
+    """
+    url = transitland._endpoint_url(endpoint, params)
+
+    if page_all and workers > 1 and endpoint != 'onestop_id':
+        features_iter = _request_pages_concurrently(
+            endpoint,
+            url,
+            params=params,
+            session=session,
+            workers=workers,
+            ordered=ordered)
+    else:
+        features_iter = _follow_next(
+            endpoint, url, params=params, page_all=page_all, session=session)
+
+    try:
+        async for features in features_iter:
+            yield features
+    finally:
+        # Cancel requests in flight when the caller stops early
+        await features_iter.aclose()
+
+
+async def _follow_next(endpoint, url, params=None, page_all=True, session=None):
+    """Request pages one after another by following meta['next']
+    """
+    while True:
+        r = await _send_request(url, params=params, session=session)
+        d = r.json()
+        yield transitland._parse_page(endpoint, d)
+
+        if endpoint == 'onestop_id' or not page_all:
+            break
+
+        if d['meta'].get('next') is None:
+            break
+
+        url = d['meta']['next']
+        params = None
+
+
+async def _request_pages_concurrently(
+        endpoint, url, params=None, session=None, workers=4, ordered=True):
+    """Request all pages with up to `workers` requests in flight
+
+    Async counterpart of `transitland._request_pages_concurrently`.
+    """
+    params = dict(params or {}, total='true')
+    r = await _send_request(url, params=params, session=session)
+    d = r.json()
+    yield transitland._parse_page(endpoint, d)
+
+    meta = d['meta']
+    if meta.get('next') is None:
+        return
+
+    page_params = transitland._remaining_page_params(meta, params)
+    if page_params is None:
+        features_iter = _follow_next(
+            endpoint, meta['next'], page_all=True, session=session)
+        try:
+            async for features in features_iter:
+                yield features
+        finally:
+            await features_iter.aclose()
+        return
+
+    async def fetch(page_params):
+        r = await _send_request(url, params=page_params, session=session)
+        return transitland._parse_page(endpoint, r.json())
+
+    pending = deque()
+    page_params = iter(page_params)
+    try:
+        for p in islice(page_params, workers):
+            pending.append(asyncio.ensure_future(fetch(p)))
+
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                future = done.pop()
+                pending.remove(future)
+
+            features = await future
+            for p in islice(page_params, 1):
+                pending.append(asyncio.ensure_future(fetch(p)))
+
+            yield features
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def _prefetch(pages, depth):
+    """Fetch up to `depth` pages ahead in a background task
+
+    Async counterpart of `transitland._prefetch`. The task is cancelled when
+    the caller stops iterating early.
+    """
+    q = asyncio.Queue(maxsize=depth)
+
+    async def produce():
+        try:
+            async for page in pages:
+                await q.put((page, None))
+        except Exception as e:
+            await q.put((transitland._DONE, e))
+        else:
+            await q.put((transitland._DONE, None))
+        finally:
+            await pages.aclose()
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            page, error = await q.get()
+            if page is transitland._DONE:
+                if error is not None:
+                    raise error
+                return
+
+            yield page
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def _send_request(url, params=None, session=None):
+    """Make request to transit.land API
+
+    Async counterpart of `transitland._send_request`, with the same rate
+    limiting, retries and exceptions. Waits happen on the event loop, and the
+    SQLite queries of the cache and rate limiter in the default executor,
+    instead of blocking it.
+    """
+    record = RequestRecord(url)
+    cache = get_cache()
+    cached, headers = None, None
+    if cache is not None:
+        record.cache = 'miss'
+        cached = await _run_blocking(
+            cache.get, url, _encode_params(params), stale=True)
+        if cached is not None:
+            if cached.fresh:
+                record.cache = 'hit'
+                record.finish(cached)
+                return cached
+            headers = cached.conditional_headers()
+
+    aiohttp = _import_aiohttp()
+    if session is None:
+        session = get_session()
+    rate_limiter = get_rate_limiter()
+    policy = get_retry_policy()
+    circuit_breaker = get_circuit_breaker()
+    timeout = aiohttp.ClientTimeout(total=policy.timeout)
+
+    start = monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        record.attempts = attempt
+        try:
+            trial = circuit_breaker.before_request()
+        except TransitlandError as e:
+            record.finish(error=e)
+            raise
+        try:
+            wait = await _run_blocking(rate_limiter.reserve)
+            if wait > 0:
+                record.rate_limit_wait += wait
+                await asyncio.sleep(wait)
+
+            r, error = None, None
+            try:
+                async with session.get(
+                        url, params=_encode_params(params), headers=headers,
+                        timeout=timeout) as resp:
+                    r = _Response(resp, await resp.read())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            else:
+                if r.status_code == 304 and cached is not None:
+                    circuit_breaker.record_success()
+                    await _run_blocking(
+                        cache.revalidate, url, _encode_params(params))
+                    record.cache = 'revalidated'
+                    record.finish(cached)
+                    return cached
+
+                if r.status_code == 200:
+                    circuit_breaker.record_success()
+                    if cache is not None:
+                        await _run_blocking(
+                            cache.set, url, _encode_params(params), r,
+                            stale=cached)
+                    record.finish(r)
+                    return r
+
+            try:
+                delay = transitland._handle_failure(
+                    url, params, attempt, start, response=r, error=error)
+            except TransitlandError as e:
+                record.finish(r, error=e)
+                raise
+        finally:
+            if trial:
+                circuit_breaker.release_trial()
+        if r is not None and r.status_code == 429 and rate_limiter.rate:
+            await _run_blocking(rate_limiter.penalize, delay)
+        else:
+            await asyncio.sleep(delay)
+
+
+def _run_blocking(func, *args, **kwargs):
+    """Run a blocking call in the default executor
+
+    Returns:
+        awaitable of its result
+    """
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+class _Response:
+    """Fully read aiohttp response, with the attributes of a requests.Response
+    that the retry logic needs
+    """
+    def __init__(self, resp, content):
+        self.status_code = resp.status
+        self.headers = resp.headers
+        self.url = str(resp.url)
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _encode_params(params):
+    """Encode params the way requests does
+
+    aiohttp only accepts str, int and float values.
+    """
+    if params is None:
+        return None
+
+    return {
+        key: str(value) if isinstance(value, bool) else value
+        for key, value in params.items()}
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        msg = 'aiohttp is required for the asyncio API. Install it with:\n'
+        msg += 'pip install transitland_wrapper[async]'
+        raise ImportError(msg)
+
+    return aiohttp
+
+
+def create_session(
+        limit=DEFAULT_POOL_MAXSIZE, limit_per_host=DEFAULT_POOL_MAXSIZE,
+        headers=None):
+    """Create a new pooled aiohttp session
+
+    Must be called from within a running event loop.
+
+    Args:
+        - limit: maximum number of open connections
+        - limit_per_host: maximum number of open connections per host
+        - headers: dict of extra headers to send with every request
+
+    Returns:
+        aiohttp.ClientSession
+    """
+    aiohttp = _import_aiohttp()
+    session_headers = dict(DEFAULT_HEADERS)
+    if headers:
+        session_headers.update(headers)
+
+    connector = aiohttp.TCPConnector(
+        limit=limit, limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(connector=connector, headers=session_headers)
+
+
+def get_session():
+    """Get the shared session of the running event loop
+
+    Creates it with defaults if necessary.
+    """
+    loop = asyncio.get_event_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = create_session()
+        _sessions[loop] = session
+
+    return session
+
+
+async def close_session():
+    """Close the shared session of the running event loop
+    """
+    session = _sessions.pop(asyncio.get_event_loop(), None)
+    if session is not None:
+        await session.close()
@@ -0,0 +1,121 @@
+"""Tune the page size during a crawl
+
+Under a fixed request budget, crawl throughput depends mostly on how many
+results each request returns. Very large pages, however, get slow or time out
+on geometry-heavy endpoints like routes and route stop patterns.
+
+`PageSizeTuner` measures the latency and size of every full page and chooses
+the size of the next one: it doubles the page size for as long as results per
+second keep improving, halves it when a page is too slow or too large, and
+then settles on the best size seen. A request can't take less time than the
+rate limiter's interval between requests, so pages that come back faster than
+that are credited with the interval instead.
+"""
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from .ratelimit import get_rate_limiter
+
+DEFAULT_PER_PAGE = 50
+MIN_PER_PAGE = 10
+MAX_PER_PAGE = 1000
+
+# Pages slower than this many seconds are shrunk, to stay clear of timeouts
+DEFAULT_MAX_LATENCY = 10
+DEFAULT_MAX_BYTES = 16 * 1024 ** 2
+
+# Keep growing while results per second are at least this fraction of the
+# best so far, so that noise in latency doesn't stop growth too early
+TOLERANCE = 0.9
+
+
+class PageSizeTuner:
+    """Choose page sizes that maximize results per second
+
+    Args:
+        - per_page: size of the first page
+        - min_per_page, max_per_page: bounds of the page size
+        - max_latency: shrink pages that take longer than this many seconds
+        - max_bytes: shrink pages whose body is larger than this many bytes
+
+    Attributes:
+        - per_page: size to request the next page with
+        - best_rate: highest results per second measured
+        - pages: number of pages measured
+    """
+    def __init__(
+            self,
+            per_page=DEFAULT_PER_PAGE,
+            min_per_page=MIN_PER_PAGE,
+            max_per_page=MAX_PER_PAGE,
+            max_latency=DEFAULT_MAX_LATENCY,
+            max_bytes=DEFAULT_MAX_BYTES):
+        self.per_page = per_page
+        self.min_per_page = min_per_page
+        self.max_per_page = max_per_page
+        self.max_latency = max_latency
+        self.max_bytes = max_bytes
+        self.best_rate = 0
+        self.pages = 0
+        self._best_per_page = per_page
+        self._settled = False
+
+    def record(self, results, seconds, nbytes=None):
+        """Measure a full page and choose the size of the next one
+
+        Args:
+            - results: number of results in the page
+            - seconds: time taken to request and parse the page
+            - nbytes: size of the response body, if known
+
+        Returns:
+            page size for the next request
+        """
+        self.pages += 1
+        interval = get_rate_limiter().rate
+        interval = 1 / interval if interval else 0
+        rate = results / max(seconds, interval, 1e-9)
+        if rate > self.best_rate:
+            self.best_rate = rate
+            self._best_per_page = self.per_page
+
+        too_slow = seconds > self.max_latency
+        too_big = nbytes is not None and nbytes > self.max_bytes
+        if too_slow or too_big:
+            # Never grow back to a size that was too slow or too large
+            self.max_per_page = max(self.min_per_page, self.per_page // 2)
+            self.per_page = self.max_per_page
+            self._best_per_page = min(self._best_per_page, self.per_page)
+            self._settled = True
+        elif self._settled:
+            pass
+        elif rate >= TOLERANCE * self.best_rate:
+            per_page = self.per_page * 2
+            if nbytes:
+                # Don't grow into a page that would be too large
+                per_page = min(
+                    per_page, int(results * self.max_bytes / nbytes))
+            self.per_page = max(
+                self.min_per_page, min(per_page, self.max_per_page))
+        else:
+            # Bigger pages stopped paying off
+            self.per_page = self._best_per_page
+            self._settled = True
+
+        return self.per_page
+
+    def report(self):
+        """One-line summary of the chosen page size"""
+        msg = f'{self.per_page} results per page'
+        if self.pages:
+            msg += f', up to {self.best_rate:.1f} results/s over '
+            msg += f'{self.pages} pages'
+        return msg
+
+
+def with_per_page(url, per_page):
+    """Replace the per_page query parameter of a url"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k != 'per_page']
+    query.append(('per_page', str(per_page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
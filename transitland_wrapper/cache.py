@@ -0,0 +1,596 @@
+"""Persistent on-disk cache of transit.land responses
+
+Responses are stored zlib-compressed in a SQLite database inside the cache
+directory, keyed by the normalized url and params of the request. A cache hit
+costs neither network time nor rate-limit budget.
+
+Entries expire after a time-to-live that can be set per endpoint. The ETag
+and Last-Modified validators of each response are stored with it, so that an
+expired entry can be revalidated with a conditional request: on a 304 Not
+Modified the stored body is reused, and only headers cross the network.
+
+When the total size of stored responses goes over `max_size`, the least
+recently used entries are evicted.
+
+The cache is off by default; turn it on with `configure_cache`.
+
+Separately, `LRUCache` keeps decoded results of bulk Onestop ID lookups in
+memory, so that repeated IDs are answered without a request. It is always on,
+and bounded by a number of entries.
+
+`GeometryCache` stores geometry files loaded by the CLI, after reprojection
+and union, as WKB in a SQLite database, so that later runs skip reading them
+with geopandas. Entries are keyed by file path, modification time and size,
+and by a hash of the file contents, so a file that is touched or copied
+without changes is still a hit. The bounds of each geometry are stored with
+it, and `geometry_bounds` returns them for geometries loaded from the cache,
+so that the bounding box query, intersection filter and planners don't scan
+every coordinate for the envelope. It is off by default; turn it on with
+`configure_geometry_cache`.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_SIZE = 1024 ** 3
+DEFAULT_LOOKUP_CACHE_SIZE = 10000
+DEFAULT_GEOMETRY_MAX_SIZE = 256 * 1024 ** 2
+
+BOUNDS_COLUMNS = ['minx', 'miny', 'maxx', 'maxy']
+
+# Files read along with a shapefile
+SHAPEFILE_EXTENSIONS = {'.shp', '.shx', '.dbf', '.prj', '.cpg'}
+
+# Schedules change more often than the stops and routes they run on
+DEFAULT_ENDPOINT_TTLS = {
+    'schedule_stop_pairs': 6 * 60 * 60,
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+_lookup_cache = None
+_geometry_cache = None
+# Stored bounds of geometries loaded from the geometry cache, by id
+_known_bounds = {}
+
+
+class CachedResponse:
+    """Response read from the cache
+
+    Has the attributes of a requests.Response used by this package.
+
+    Attributes:
+        - fresh: False if the entry expired and must be revalidated before use
+        - etag, last_modified: validators for a conditional request
+    """
+    status_code = 200
+    from_cache = True
+
+    def __init__(self, url, content, fresh=True, etag=None, last_modified=None):
+        self.url = url
+        self.content = content
+        self.fresh = fresh
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def conditional_headers(self):
+        """Headers to revalidate this entry with a conditional request
+
+        Returns:
+            dict, or None if the entry has no validators
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers or None
+
+
+class ResponseCache:
+    """SQLite-backed response cache
+
+    Args:
+        - cache_dir: directory to store the cache in. Created if necessary.
+        - ttl: seconds until an entry expires, for endpoints not in `ttls`
+        - ttls: dict of endpoint name to seconds until entries expire
+        - max_size: maximum total size in bytes of compressed responses
+    """
+    def __init__(
+            self,
+            cache_dir,
+            ttl=DEFAULT_TTL,
+            ttls=None,
+            max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.ttl = ttl
+        self.ttls = dict(DEFAULT_ENDPOINT_TTLS, **(ttls or {}))
+        self.max_size = max_size
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'revalidated': 0,
+            'redownloaded': 0,
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, 'responses.sqlite')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, url TEXT, endpoint TEXT, body BLOB, '
+            'size INTEGER, created REAL, accessed REAL, etag TEXT, '
+            'last_modified TEXT)')
+
+        # Caches created before validators were stored lack these columns
+        columns = {
+            row[1]
+            for row in self._conn.execute('PRAGMA table_info(responses)')}
+        for column in ['etag', 'last_modified']:
+            if column not in columns:
+                self._conn.execute(
+                    f'ALTER TABLE responses ADD COLUMN {column} TEXT')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed '
+            'ON responses (accessed)')
+
+    def get(self, url, params=None, stale=False):
+        """Look up a cached response
+
+        Counts a hit or a miss in `stats`, unless an expired entry is
+        returned; its outcome is counted by `revalidate` or `set`.
+
+        Args:
+            - stale: also return expired entries, with `fresh` set to False
+
+        Returns:
+            CachedResponse, or None on a miss
+        """
+        key, full_url = cache_key(url, params)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body, endpoint, created, etag, last_modified '
+                'FROM responses WHERE key = ?', (key, )).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            body, endpoint, created, etag, last_modified = row
+            now = time.time()
+            fresh = now - created <= self.ttl_for(endpoint)
+            if not fresh and not stale:
+                self.stats['misses'] += 1
+                return None
+
+            if fresh:
+                self.stats['hits'] += 1
+            self._conn.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+
+        return CachedResponse(
+            full_url,
+            zlib.decompress(body),
+            fresh=fresh,
+            etag=etag,
+            last_modified=last_modified)
+
+    def set(self, url, params, response, stale=None):
+        """Store a successful response
+
+        Args:
+            - stale: the expired CachedResponse this response replaces, if any
+        """
+        key, full_url = cache_key(url, params)
+        body = zlib.compress(response.content)
+        headers = response.headers
+        now = time.time()
+        with self._lock:
+            if stale is not None:
+                self.stats['redownloaded'] += 1
+
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(key, url, endpoint, body, size, created, accessed, etag, '
+                'last_modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                    key, full_url, url_endpoint(full_url), body, len(body),
+                    now, now, headers.get('ETag'),
+                    headers.get('Last-Modified')))
+            self._evict()
+
+    def revalidate(self, url, params=None):
+        """Mark an expired entry as fresh after a 304 Not Modified"""
+        key, _ = cache_key(url, params)
+        with self._lock:
+            self.stats['revalidated'] += 1
+            self._conn.execute(
+                'UPDATE responses SET created = ? WHERE key = ?',
+                (time.time(), key))
+
+    def report(self):
+        """One-line summary of this run's cache usage"""
+        return ', '.join(f'{value} {key}' for key, value in self.stats.items())
+
+    def ttl_for(self, endpoint):
+        return self.ttls.get(endpoint, self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        """Delete least recently used entries until under max_size"""
+        total, = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if total <= self.max_size:
+            return
+
+        rows = self._conn.execute(
+            'SELECT key, size FROM responses ORDER BY accessed')
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            evicted.append((key, ))
+            total -= size
+
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+
+class LRUCache:
+    """Thread-safe in-memory cache of the most recently used entries
+
+    Args:
+        - maxsize: maximum number of entries
+    """
+    def __init__(self, maxsize=DEFAULT_LOOKUP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.stats = {'hits': 0, 'misses': 0}
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Look up key, counting a hit or a miss in `stats`"""
+        with self._lock:
+            if key not in self._data:
+                self.stats['misses'] += 1
+                return default
+
+            self.stats['hits'] += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class GeometryCache:
+    """SQLite-backed cache of geometries loaded from files
+
+    Args:
+        - cache_dir: directory to store the cache in. Created if necessary.
+        - max_size: maximum total size in bytes of stored geometries
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_GEOMETRY_MAX_SIZE):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        self.stats = {'hits': 0, 'misses': 0}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, 'geometries.sqlite')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS geometries ('
+            'path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, '
+            'digest TEXT, wkb BLOB, accessed REAL, minx REAL, miny REAL, '
+            'maxx REAL, maxy REAL)')
+
+        # Caches created before bounds were stored lack these columns
+        columns = {
+            row[1]
+            for row in self._conn.execute('PRAGMA table_info(geometries)')}
+        for column in BOUNDS_COLUMNS:
+            if column not in columns:
+                self._conn.execute(
+                    f'ALTER TABLE geometries ADD COLUMN {column} REAL')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS geometries_digest '
+            'ON geometries (digest)')
+
+    def load(self, path, loader):
+        """Load the geometry of a file, from the cache if it is unchanged
+
+        The modification time and size of the file are checked first. If
+        either changed, the file is hashed, and only if its contents changed
+        is it loaded again. For a shapefile, its sidecar files are included.
+
+        Args:
+            - path: path of the file
+            - loader: function that loads the geometry from path, on a miss
+
+        Returns:
+            shapely geometry
+        """
+        path = os.path.abspath(path)
+        files = _source_files(path)
+        mtime = max(os.stat(f).st_mtime_ns for f in files)
+        size = sum(os.stat(f).st_size for f in files)
+
+        columns = ', '.join(['wkb'] + BOUNDS_COLUMNS)
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {columns} FROM geometries WHERE path = ? '
+                'AND mtime = ? AND size = ?', (path, mtime, size)).fetchone()
+        if row is not None:
+            return self._hit(path, row[0], row[1:])
+
+        digest = _file_digest(files)
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {columns} FROM geometries WHERE digest = ?',
+                (digest, )).fetchone()
+        if row is not None:
+            # Same contents, under a new path or modification time
+            self._store(path, mtime, size, digest, row[0], row[1:])
+            return self._hit(path, row[0], row[1:])
+
+        geometry = loader(path)
+        self.stats['misses'] += 1
+        bounds = geometry.bounds
+        self._store(path, mtime, size, digest, geometry.wkb, bounds)
+        _remember_bounds(geometry, bounds)
+        return geometry
+
+    def report(self):
+        """One-line summary of this run's cache usage"""
+        return ', '.join(f'{value} {key}' for key, value in self.stats.items())
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM geometries')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _hit(self, path, wkb, bounds):
+        from shapely import wkb as shapely_wkb
+
+        with self._lock:
+            self.stats['hits'] += 1
+            self._conn.execute(
+                'UPDATE geometries SET accessed = ? WHERE path = ?',
+                (time.time(), path))
+        geometry = shapely_wkb.loads(bytes(wkb))
+        _remember_bounds(geometry, bounds)
+        return geometry
+
+    def _store(self, path, mtime, size, digest, wkb, bounds):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO geometries '
+                '(path, mtime, size, digest, wkb, accessed, minx, miny, maxx, '
+                'maxy) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, mtime, size, digest, wkb, time.time(), *bounds))
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until under max_size"""
+        total, = self._conn.execute(
+            'SELECT COALESCE(SUM(LENGTH(wkb)), 0) FROM geometries').fetchone()
+        if total <= self.max_size:
+            return
+
+        rows = self._conn.execute(
+            'SELECT path, LENGTH(wkb) FROM geometries ORDER BY accessed')
+        evicted = []
+        for path, size in rows:
+            if total <= self.max_size:
+                break
+            evicted.append((path, ))
+            total -= size
+
+        self._conn.executemany('DELETE FROM geometries WHERE path = ?', evicted)
+
+
+def geometry_bounds(geometry):
+    """Bounds of a geometry, as (minx, miny, maxx, maxy)
+
+    For geometries loaded from the geometry cache, these are the bounds
+    stored with them, so that their coordinates aren't scanned again.
+    """
+    bounds = _known_bounds.get(id(geometry))
+    if bounds is None:
+        return geometry.bounds
+    return bounds
+
+
+def _remember_bounds(geometry, bounds):
+    """Record the bounds of a geometry for `geometry_bounds`, for as long as
+    the geometry exists
+
+    Bounds with missing values, of empty geometries or of entries stored
+    before bounds were, are not recorded.
+    """
+    if any(value is None or value != value for value in bounds):
+        return
+    key = id(geometry)
+    _known_bounds[key] = tuple(bounds)
+    weakref.finalize(geometry, _known_bounds.pop, key, None)
+
+
+def _source_files(path):
+    """Files whose contents make up the geometry of path, sorted"""
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if os.path.isfile(os.path.join(path, name)))
+
+    stem, ext = os.path.splitext(path)
+    if ext.lower() != '.shp':
+        return [path]
+
+    directory = os.path.dirname(path)
+    name = os.path.basename(stem)
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if os.path.splitext(f)[0] == name
+        and os.path.splitext(f)[1].lower() in SHAPEFILE_EXTENSIONS)
+
+
+def _file_digest(files):
+    digest = hashlib.sha256()
+    for path in files:
+        # Extensions tell sidecars apart, and don't change with a copy
+        digest.update(os.path.splitext(path)[1].lower().encode() + b'\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(url, params=None):
+    """Normalize a request into a cache key
+
+    Params are merged into the url's query string and sorted, so that
+    equivalent requests share a key.
+
+    Returns:
+        (key, normalized url)
+    """
+    from requests.models import PreparedRequest
+
+    prepared = PreparedRequest()
+    prepared.prepare_url(url, params)
+    parts = urlsplit(prepared.url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    full_url = urlunsplit(
+        (parts.scheme, parts.netloc.lower(), parts.path, query, ''))
+    return hashlib.sha256(full_url.encode()).hexdigest(), full_url
+
+
+def url_endpoint(url):
+    """Name of the API endpoint of a url
+
+    For example, `stops` for `https://transit.land/api/v1/stops.geojson`.
+    """
+    path = urlsplit(url).path
+    parts = path.split('/api/v1/', 1)[-1].split('/')
+    return parts[0].split('.', 1)[0]
+
+
+def configure_cache(cache_dir, **kwargs):
+    """Turn on the shared response cache
+
+    Takes the same arguments as `ResponseCache`.
+
+    Returns:
+        the new shared ResponseCache
+    """
+    global _cache
+    cache = ResponseCache(cache_dir, **kwargs)
+    with _cache_lock:
+        old_cache, _cache = _cache, cache
+
+    if old_cache is not None:
+        old_cache.close()
+    return cache
+
+
+def disable_cache():
+    """Turn off the shared response cache"""
+    global _cache
+    with _cache_lock:
+        old_cache, _cache = _cache, None
+
+    if old_cache is not None:
+        old_cache.close()
+
+
+def get_cache():
+    """Get the shared response cache, or None if caching is off"""
+    return _cache
+
+
+def configure_lookup_cache(maxsize=DEFAULT_LOOKUP_CACHE_SIZE):
+    """Replace the shared in-memory cache of Onestop ID lookups
+
+    Returns:
+        the new shared LRUCache
+    """
+    global _lookup_cache
+    with _cache_lock:
+        _lookup_cache = LRUCache(maxsize)
+        return _lookup_cache
+
+
+def get_lookup_cache():
+    """Get the shared in-memory cache of Onestop ID lookups"""
+    global _lookup_cache
+    with _cache_lock:
+        if _lookup_cache is None:
+            _lookup_cache = LRUCache()
+        return _lookup_cache
+
+
+def configure_geometry_cache(cache_dir, **kwargs):
+    """Turn on the shared geometry cache
+
+    Takes the same arguments as `GeometryCache`.
+
+    Returns:
+        the new shared GeometryCache
+    """
+    global _geometry_cache
+    geometry_cache = GeometryCache(cache_dir, **kwargs)
+    with _cache_lock:
+        old_cache, _geometry_cache = _geometry_cache, geometry_cache
+
+    if old_cache is not None:
+        old_cache.close()
+    return geometry_cache
+
+
+def disable_geometry_cache():
+    """Turn off the shared geometry cache"""
+    global _geometry_cache
+    with _cache_lock:
+        old_cache, _geometry_cache = _geometry_cache, None
+
+    if old_cache is not None:
+        old_cache.close()
+
+
+def get_geometry_cache():
+    """Get the shared geometry cache, or None if it is off"""
+    return _geometry_cache
@@ -0,0 +1,98 @@
+"""Resume interrupted crawls from on-disk checkpoints
+
+While paging over all responses, the only state of a crawl is the url of the
+next page, from `meta['next']`. A `Checkpoint` saves that url to a JSON file
+each time a page has been handled, along with the size of the output written
+so far. A crawl that is restarted with the same checkpoint continues from the
+next page, and its writer truncates any output written after the last
+checkpoint, so that no result is written twice.
+
+The file is replaced atomically, so an interruption at any time leaves either
+the previous checkpoint or the new one.
+"""
+import json
+import os
+
+# Format of the checkpoint file, bumped on incompatible changes
+VERSION = 1
+
+
+class Checkpoint:
+    """Progress of a crawl, persisted to a file after each page
+
+    If the file exists, the checkpoint is loaded from it.
+
+    Args:
+        - path: JSON file to persist the checkpoint to
+
+    Attributes:
+        - query: normalized url of the crawl's first page, so that a
+          checkpoint isn't resumed with a different query
+        - next_url: url of the next page to request, or None
+        - pages: number of pages handled
+        - output_offset: size in bytes of the output written by handled
+          pages, set by the writer, or None
+        - complete: True once the last page has been handled
+    """
+    def __init__(self, path):
+        self.path = path
+        state = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('version') != VERSION:
+                raise ValueError(f'Unsupported checkpoint file: {path}')
+
+        self.query = state.get('query')
+        self.next_url = state.get('next_url')
+        self.pages = state.get('pages', 0)
+        self.output_offset = state.get('output_offset')
+        self.complete = state.get('complete', False)
+
+    def start(self, query):
+        """Check that the checkpoint is for query, and record it if new
+
+        Raises:
+            ValueError: the checkpoint was saved by a different query
+        """
+        if self.query is not None and self.query != query:
+            msg = f'Checkpoint {self.path} is for a different query:\n'
+            msg += self.query
+            raise ValueError(msg)
+        self.query = query
+
+    def advance(self, next_url):
+        """Record that a page was handled, and the url of the next one"""
+        self.next_url = next_url
+        self.pages += 1
+        self.save()
+
+    def finish(self):
+        """Record that the last page was handled"""
+        self.next_url = None
+        self.pages += 1
+        self.complete = True
+        self.save()
+
+    def save(self):
+        """Write the checkpoint to its file atomically"""
+        state = {
+            'version': VERSION,
+            'query': self.query,
+            'next_url': self.next_url,
+            'pages': self.pages,
+            'output_offset': self.output_offset,
+            'complete': self.complete,
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def report(self):
+        """One-line summary of the checkpoint"""
+        if self.complete:
+            return f'complete after {self.pages} pages'
+        return f'{self.pages} pages handled, next: {self.next_url}'
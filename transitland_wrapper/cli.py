@@ -1,14 +1,301 @@
 import json
 
 import click
-from shapely.geometry import box
 
-from . import transitland
+from . import (
+    autotune, cache, checkpoint, metrics, ratelimit, retry, session, sinks,
+    tracing, transitland)
+from .exceptions import HTTPStatusError
+
+
+class PerPage(click.ParamType):
+    """Page size: a number of results, or 'auto'"""
+    name = 'integer|auto'
+
+    def convert(self, value, param, ctx):
+        if value == 'auto' or isinstance(value, int):
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            self.fail(f'{value!r} is not an integer or auto', param, ctx)
+
+
+PER_PAGE = PerPage()
+
+
+def crawl_options(f):
+    """Add options shared by every paged subcommand"""
+    options = [
+        click.option(
+            '-w',
+            '--workers',
+            required=False,
+            default=1,
+            show_default=True,
+            type=int,
+            help='Number of pages to fetch at once with --page-all'),
+        click.option(
+            '--ordered/--unordered',
+            is_flag=True,
+            default=True,
+            show_default=True,
+            help='Write concurrently fetched pages in order'),
+        click.option(
+            '--prefetch',
+            required=False,
+            default=0,
+            show_default=True,
+            type=int,
+            help='Number of pages to fetch ahead while writing output'),
+        click.option(
+            '--shard',
+            required=False,
+            default=None,
+            type=int,
+            help=(
+                'Split the geometry into tiles of at most this many results '
+                'each, and request tiles concurrently with --workers')),
+        click.option(
+            '--cover',
+            required=False,
+            default=None,
+            type=int,
+            help=(
+                'Query the geometry with up to this many tight bounding '
+                'boxes instead of its envelope')),
+        click.option(
+            '--stream',
+            is_flag=True,
+            default=False,
+            help=(
+                'Parse large pages incrementally to bound memory use. Requires '
+                'ijson')),
+        click.option(
+            '--precision',
+            required=False,
+            default=None,
+            type=int,
+            help='Round output coordinates to this many decimal places'),
+        click.option(
+            '--simplify-tolerance',
+            required=False,
+            default=None,
+            type=float,
+            help='Simplify output geometries to within this many degrees'),
+        click.option(
+            '--fields',
+            required=False,
+            default=None,
+            type=str,
+            help=(
+                'Comma-separated properties to keep. GeoJSON features always '
+                'keep their id and geometry')),
+        click.option(
+            '--limit',
+            required=False,
+            default=None,
+            type=int,
+            help='Stop after this many results'),
+        click.option(
+            '--checkpoint',
+            'checkpoint_path',
+            required=False,
+            default=None,
+            type=click.Path(dir_okay=False, writable=True),
+            help=(
+                'Save progress to this file after each page, and resume from '
+                'it if it exists. Requires ndjson --output')),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def output_options(f):
+    """Add options choosing where and how to write results"""
+    options = [
+        click.option(
+            '-o',
+            '--output',
+            required=False,
+            default=None,
+            type=click.Path(dir_okay=False, writable=True),
+            help='File to write results to. By default stdout'),
+        click.option(
+            '--format',
+            'output_format',
+            required=False,
+            default=None,
+            type=click.Choice(sinks.FORMATS),
+            help=(
+                'Output format. By default inferred from the --output '
+                'extension, or ndjson')),
+        click.option(
+            '--row-group-size',
+            required=False,
+            default=sinks.DEFAULT_ROW_GROUP_SIZE,
+            show_default=True,
+            type=int,
+            help='Number of results per row group of binary formats'),
+        click.option(
+            '--compress',
+            required=False,
+            default=None,
+            type=click.Choice(['gzip', 'zstd']),
+            help=(
+                'Compress ndjson output. By default inferred from the '
+                '--output extension (.gz or .zst)')),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
 
 
 @click.group()
-def main():
-    pass
+@click.option(
+    '--pool-connections',
+    required=False,
+    default=session.DEFAULT_POOL_CONNECTIONS,
+    show_default=True,
+    type=int,
+    help='Number of connection pools to cache')
+@click.option(
+    '--pool-maxsize',
+    required=False,
+    default=session.DEFAULT_POOL_MAXSIZE,
+    show_default=True,
+    type=int,
+    help='Maximum number of keep-alive connections per host')
+@click.option(
+    '--rate-limit',
+    required=False,
+    default=ratelimit.DEFAULT_REQUESTS_PER_MINUTE,
+    show_default=True,
+    type=int,
+    help='Maximum requests per minute. 0 disables client-side rate limiting')
+@click.option(
+    '--burst',
+    required=False,
+    default=ratelimit.DEFAULT_BURST,
+    show_default=True,
+    type=int,
+    help='Maximum number of requests to send at once')
+@click.option(
+    '--rate-limit-file',
+    required=False,
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help='SQLite file to share the rate limit with other processes')
+@click.option(
+    '--max-attempts',
+    required=False,
+    default=5,
+    show_default=True,
+    type=int,
+    help='Maximum attempts per request. 0 retries without limit')
+@click.option(
+    '--deadline',
+    required=False,
+    default=None,
+    type=float,
+    help='Maximum seconds to spend retrying a single request')
+@click.option(
+    '--cache-dir',
+    required=False,
+    default=None,
+    type=click.Path(file_okay=False, writable=True),
+    help='Directory to cache responses in. Caching is off if not given')
+@click.option(
+    '--cache-ttl',
+    required=False,
+    default=None,
+    type=int,
+    help=(
+        'Seconds until cached responses expire. By default one day, or six '
+        'hours for schedule stop pairs'))
+@click.option(
+    '--cache-max-size',
+    required=False,
+    default=cache.DEFAULT_MAX_SIZE // 1024 ** 2,
+    show_default=True,
+    type=int,
+    help='Maximum size of the response cache in MB')
+@click.option(
+    '--geometry-cache-dir',
+    required=False,
+    default=None,
+    type=click.Path(file_okay=False, writable=True),
+    help=(
+        'Directory to cache geometry files in after reprojection, so that '
+        'later runs with the same --geometry skip reading them. Off if not '
+        'given'))
+@click.option(
+    '--stats',
+    is_flag=True,
+    default=False,
+    help=(
+        'Print request latency, retries, rate limit waits, cache hits and '
+        'results kept by the geometry filter to stderr at the end'))
+@click.option(
+    '--stats-file',
+    required=False,
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help='Write the --stats summary to this file as JSON')
+@click.option(
+    '--profile',
+    is_flag=True,
+    default=False,
+    help=(
+        'Print the time spent loading geometries, fetching, parsing, '
+        'filtering and serializing, and the hottest functions, to stderr at '
+        'the end'))
+@click.option(
+    '--profile-file',
+    required=False,
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        'Write a trace of the --profile phases to this file, for '
+        'chrome://tracing or ui.perfetto.dev'))
+def main(
+        pool_connections, pool_maxsize, rate_limit, burst, rate_limit_file,
+        max_attempts, deadline, cache_dir, cache_ttl, cache_max_size,
+        geometry_cache_dir, stats, stats_file, profile, profile_file):
+    session.set_session_options(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    ratelimit.configure_rate_limiter(
+        requests_per_minute=rate_limit, burst=burst, path=rate_limit_file)
+    retry.configure_retry(max_attempts=max_attempts or None, deadline=deadline)
+    if cache_dir is not None:
+        cache_kwargs = {'max_size': cache_max_size * 1024 ** 2}
+        if cache_ttl is not None:
+            # An explicit TTL applies to every endpoint
+            cache_kwargs['ttl'] = cache_ttl
+            cache_kwargs['ttls'] = {
+                endpoint: cache_ttl
+                for endpoint in cache.DEFAULT_ENDPOINT_TTLS}
+        response_cache = cache.configure_cache(cache_dir, **cache_kwargs)
+        click.get_current_context().call_on_close(
+            lambda: click.echo(f'cache: {response_cache.report()}', err=True))
+
+    if geometry_cache_dir is not None:
+        geometry_cache = cache.configure_geometry_cache(geometry_cache_dir)
+        click.get_current_context().call_on_close(
+            lambda: click.echo(
+                f'geometry cache: {geometry_cache.report()}', err=True))
+
+    if stats or stats_file is not None:
+        collected = metrics.configure_metrics()
+        click.get_current_context().call_on_close(
+            lambda: report_stats(collected, stats, stats_file))
+
+    if profile or profile_file is not None:
+        tracer = tracing.configure_tracing()
+        sampler = tracing.Sampler().start() if profile else None
+        click.get_current_context().call_on_close(
+            lambda: report_profile(tracer, sampler, profile_file))
 
 
 @click.command()
@@ -32,9 +319,9 @@ def main():
     required=False,
     default=None,
     type=float,
-    help=
-    'radius in meters to search around, default 100m for Point geometries. Used only for Point geometries.'
-)
+    help=(
+        'radius in meters to search around, default 100m for Point '
+        'geometries. Used only for Point geometries.'))
 @click.option(
     '--served-by',
     required=False,
@@ -54,19 +341,22 @@ def main():
     required=False,
     default=50,
     show_default=True,
-    type=int,
-    help='Number of results per page')
+    type=PER_PAGE,
+    help="Number of results per page, or 'auto' to tune it while paging")
 @click.option(
     '--page-all/--no-page-all',
     is_flag=True,
     default=False,
     show_default=True,
     help='Page over all responses')
+@crawl_options
+@output_options
 def stops(**kwargs):
     """Request stops info"""
+    output = pop_output_options(kwargs)
     kwargs = handle_geometry(**kwargs)
     features_iter = transitland.stops(**kwargs)
-    write_to_stdout(features_iter)
+    write_output(features_iter, **output)
 
 
 @click.command()
@@ -90,9 +380,9 @@ def stops(**kwargs):
     required=False,
     default=None,
     type=float,
-    help=
-    'radius in meters to search around, default 100m for Point geometries. Used only for Point geometries.'
-)
+    help=(
+        'radius in meters to search around, default 100m for Point '
+        'geometries. Used only for Point geometries.'))
 @click.option(
     '--gtfs-id',
     required=False,
@@ -105,19 +395,22 @@ def stops(**kwargs):
     required=False,
     default=50,
     show_default=True,
-    type=int,
-    help='Number of results per page')
+    type=PER_PAGE,
+    help="Number of results per page, or 'auto' to tune it while paging")
 @click.option(
     '--page-all/--no-page-all',
     is_flag=True,
     default=False,
     show_default=True,
     help='Page over all responses')
+@crawl_options
+@output_options
 def operators(**kwargs):
     """Request operators info"""
+    output = pop_output_options(kwargs)
     kwargs = handle_geometry(**kwargs)
     features_iter = transitland.operators(**kwargs)
-    write_to_stdout(features_iter)
+    write_output(features_iter, **output)
 
 
 @click.command()
@@ -141,9 +434,9 @@ def operators(**kwargs):
     required=False,
     default=None,
     type=float,
-    help=
-    'radius in meters to search around, default 100m for Point geometries. Used only for Point geometries.'
-)
+    help=(
+        'radius in meters to search around, default 100m for Point '
+        'geometries. Used only for Point geometries.'))
 @click.option(
     '--operated-by',
     required=False,
@@ -156,9 +449,10 @@ def operators(**kwargs):
     default=None,
     multiple=True,
     type=str,
-    help=
-    'find all routes with vehicle type(s) by integer or string. Possible values defined by the GTFS spec for the route_type column and the Extended GTFS Route Types'
-)
+    help=(
+        'find all routes with vehicle type(s) by integer or string. Possible '
+        'values defined by the GTFS spec for the route_type column and the '
+        'Extended GTFS Route Types'))
 @click.option(
     '--gtfs-id',
     required=False,
@@ -177,19 +471,22 @@ def operators(**kwargs):
     required=False,
     default=50,
     show_default=True,
-    type=int,
-    help='Number of results per page')
+    type=PER_PAGE,
+    help="Number of results per page, or 'auto' to tune it while paging")
 @click.option(
     '--page-all/--no-page-all',
     is_flag=True,
     default=False,
     show_default=True,
     help='Page over all responses')
+@crawl_options
+@output_options
 def routes(**kwargs):
     """Request routes info"""
+    output = pop_output_options(kwargs)
     kwargs = handle_geometry(**kwargs)
     features_iter = transitland.routes(**kwargs)
-    write_to_stdout(features_iter)
+    write_output(features_iter, **output)
 
 
 @click.command()
@@ -219,37 +516,40 @@ def routes(**kwargs):
     default=None,
     multiple=True,
     type=str,
-    help=
-    'any one or more stop Onestop IDs, separated by comma. Finds Route Stop Patterns with stops_visited in stop_pattern'
-)
+    help=(
+        'any one or more stop Onestop IDs, separated by comma. Finds Route '
+        'Stop Patterns with stops_visited in stop_pattern'))
 @click.option(
     '--trips',
     required=False,
     default=None,
     multiple=True,
     type=str,
-    help=
-    'any one or more trip ids, separated by comma. Finds Route Stop Patterns with specified trips in trips'
-)
+    help=(
+        'any one or more trip ids, separated by comma. Finds Route Stop '
+        'Patterns with specified trips in trips'))
 @click.option(
     '-p',
     '--per-page',
     required=False,
     default=50,
     show_default=True,
-    type=int,
-    help='Number of results per page')
+    type=PER_PAGE,
+    help="Number of results per page, or 'auto' to tune it while paging")
 @click.option(
     '--page-all/--no-page-all',
     is_flag=True,
     default=False,
     show_default=True,
     help='Page over all responses')
+@crawl_options
+@output_options
 def route_stop_patterns(**kwargs):
     """Request routes info"""
+    output = pop_output_options(kwargs)
     kwargs = handle_geometry(**kwargs)
     features_iter = transitland.route_stop_patterns(**kwargs)
-    write_to_stdout(features_iter)
+    write_output(features_iter, **output)
 
 
 @click.command()
@@ -337,19 +637,22 @@ def route_stop_patterns(**kwargs):
     required=False,
     default=50,
     show_default=True,
-    type=int,
-    help='Number of results per page')
+    type=PER_PAGE,
+    help="Number of results per page, or 'auto' to tune it while paging")
 @click.option(
     '--page-all/--no-page-all',
     is_flag=True,
     default=False,
     show_default=True,
     help='Page over all responses')
+@crawl_options
+@output_options
 def schedule_stop_pairs(**kwargs):
     """Request schedule stop pairs info"""
+    output = pop_output_options(kwargs)
     kwargs = handle_geometry(**kwargs)
     features_iter = transitland.schedule_stop_pairs(**kwargs)
-    write_to_stdout(features_iter)
+    write_output(features_iter, **output)
 
 
 @click.command()
@@ -358,8 +661,9 @@ def schedule_stop_pairs(**kwargs):
     required=False,
     default=None,
     type=str,
-    help='a Onestop ID for any type of entity (for example, a stop or an operator)'
-)
+    help=(
+        'a Onestop ID for any type of entity (for example, a stop or an '
+        'operator)'))
 @click.option(
     '-f',
     '--file',
@@ -367,23 +671,51 @@ def schedule_stop_pairs(**kwargs):
     default=None,
     type=click.Path(exists=True, file_okay=True, readable=True),
     help='a file with one or more Onestop IDs, with each on their own line.')
-def onestop_id(oid, file):
+@click.option(
+    '-w',
+    '--workers',
+    required=False,
+    default=4,
+    show_default=True,
+    type=int,
+    help='Number of Onestop IDs from --file to request at once')
+@click.option(
+    '--ordered/--unordered',
+    is_flag=True,
+    default=True,
+    show_default=True,
+    help='Write results for --file in input order')
+@output_options
+def onestop_id(oid, file, workers, ordered, **output):
     """Request onestop_id info"""
     if sum(list(map(bool, [oid, file]))) != 1:
         raise ValueError('must provide either oid or file')
 
-    if oid:
-        r_iter = transitland.onestop_id(oid)
-        for res in r_iter:
-            click.echo(json.dumps(res, separators=(',', ':')))
+    def results_from_file():
+        with open(file) as f:
+            oids = (line.strip() for line in f if line.strip())
+            results = transitland.onestop_ids(
+                oids, workers=workers, ordered=ordered)
+            for _id, res in results:
+                # Skip unknown IDs instead of failing the whole file
+                if res is None:
+                    click.echo(f'onestop_id not found: {_id}', err=True)
+                    continue
+                yield [res]
 
+    if oid:
+        try:
+            results = list(transitland.onestop_id(oid))
+        except HTTPStatusError as e:
+            if e.status_code != 404:
+                raise
+            click.echo(f'onestop_id not found: {oid}', err=True)
+            click.get_current_context().exit(1)
+        pages = ([res] for res in results)
     else:
-        with open(file) as f:
-            for line in f:
-                _id = line.strip()
-                r_iter = transitland.onestop_id(oid=_id)
-                for res in r_iter:
-                    click.echo(json.dumps(res, separators=(',', ':')))
+        pages = results_from_file()
+
+    write_output(pages, **output)
 
 
 @click.command()
@@ -407,22 +739,53 @@ def onestop_id(oid, file):
     required=False,
     default=50,
     show_default=True,
-    type=int,
-    help='Number of results per page')
+    type=PER_PAGE,
+    help="Number of results per page, or 'auto' to tune it while paging")
 @click.option(
     '--page-all/--no-page-all',
     is_flag=True,
     default=False,
     show_default=True,
     help='Page over all responses')
+@crawl_options
+@output_options
 def feeds(**kwargs):
     """Request feeds info"""
+    output = pop_output_options(kwargs)
     kwargs = handle_geometry(**kwargs)
     features_iter = transitland.feeds(**kwargs)
-    write_to_stdout(features_iter)
+    write_output(features_iter, **output)
+
+
+def report_stats(collected, echo=True, path=None):
+    """Print and/or write the summary of metrics collected during a command
+    """
+    if echo:
+        for line in collected.report().splitlines():
+            click.echo(f'stats: {line}', err=True)
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(collected.summary(), f, indent=2)
+
+
+def report_profile(tracer, sampler=None, path=None):
+    """Print the time spent in each phase and the hottest functions, and/or
+    write the trace
+    """
+    if sampler is not None:
+        sampler.stop()
+        click.echo(f'profile:\n{tracer.report()}', err=True)
+        click.echo(f'profile:\n{sampler.report()}', err=True)
+    if path is not None:
+        tracer.write_chrome_trace(path)
 
 
 def handle_geometry(**kwargs):
+    if kwargs.get('shard') and not kwargs.get('page_all'):
+        raise click.UsageError('--shard requires --page-all')
+    if kwargs.get('cover') and not (kwargs['bbox'] or kwargs['geometry']):
+        raise click.UsageError('--cover requires --geometry or --bbox')
+
     bbox = kwargs.pop('bbox')
     geometry_file = kwargs.pop('geometry')
 
@@ -432,16 +795,52 @@ def handle_geometry(**kwargs):
     geometry = None
     if bbox:
         bbox = list(map(float, bbox.split(',')))
+        from shapely.geometry import box
         geometry = box(*bbox)
     elif geometry_file:
-        geometry = load_file(geometry_file)
+        with tracing.span('load_geometry', file=geometry_file):
+            geometry = load_file(geometry_file)
 
     kwargs['geometry'] = geometry
+
+    if kwargs.get('cover') and geometry is not None:
+        from .planner import plan_cover
+        cover = plan_cover(geometry, max_boxes=kwargs['cover'])
+        click.echo(f'cover: {cover.report()}', err=True)
+        kwargs['cover'] = cover
+
+    if kwargs.get('per_page') == 'auto':
+        tuner = autotune.PageSizeTuner()
+        click.get_current_context().call_on_close(
+            lambda: click.echo(f'per_page: {tuner.report()}', err=True))
+        kwargs['per_page'] = tuner
+
+    if kwargs.get('fields'):
+        kwargs['fields'] = kwargs['fields'].split(',')
+
+    if kwargs.get('precision') is not None or kwargs.get('simplify_tolerance'):
+        from .simplify import GeometryReducer
+        reducer = GeometryReducer(
+            precision=kwargs['precision'],
+            simplify_tolerance=kwargs.pop('simplify_tolerance'))
+        click.get_current_context().call_on_close(
+            lambda: click.echo(f'geometry: {reducer.report()}', err=True))
+        kwargs['precision'] = reducer
+
     return kwargs
 
 
 def load_file(file):
-    """Load file into GeoDataFrame
+    """Load file into a single geometry, from the geometry cache if it is on
+    """
+    geometry_cache = cache.get_geometry_cache()
+    if geometry_cache is not None:
+        return geometry_cache.load(file, read_file)
+    return read_file(file)
+
+
+def read_file(file):
+    """Read file with GeoPandas into a single geometry in EPSG 4326
     """
     import geopandas as gpd
 
@@ -452,12 +851,75 @@ def load_file(file):
     return gdf.unary_union
 
 
-def write_to_stdout(features_iter):
-    """Write features to stdout
+def pop_output_options(kwargs):
+    """Remove the options added by `output_options` from kwargs
+
+    A --checkpoint is loaded, and passed both to the crawl, as `resume_from`,
+    and to the writer.
+    """
+    output = {
+        'output': kwargs.pop('output'),
+        'output_format': kwargs.pop('output_format'),
+        'row_group_size': kwargs.pop('row_group_size'),
+        'compress': kwargs.pop('compress'),
+    }
+    checkpoint_path = kwargs.pop('checkpoint_path', None)
+    if checkpoint_path is not None:
+        if not kwargs.get('page_all'):
+            raise click.UsageError('--checkpoint requires --page-all')
+        if (kwargs.get('workers', 1) > 1 or kwargs.get('prefetch')
+                or kwargs.get('shard') or kwargs.get('cover')
+                or kwargs.get('limit') is not None):
+            msg = '--checkpoint cannot be used with --workers, --prefetch, '
+            msg += '--shard, --cover or --limit'
+            raise click.UsageError(msg)
+        try:
+            resume = checkpoint.Checkpoint(checkpoint_path)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        kwargs['resume_from'] = output['checkpoint'] = resume
+    return output
+
+
+def write_output(
+        features_iter,
+        output=None,
+        output_format=None,
+        row_group_size=sinks.DEFAULT_ROW_GROUP_SIZE,
+        compress=None,
+        checkpoint=None):
+    """Write features to stdout or to an output file
+
+    With a checkpoint, output is resumed at the size it had at the last
+    checkpoint.
     """
-    for features in features_iter:
-        for feature in features:
-            click.echo(json.dumps(feature, separators=(',', ':')))
+    offset = None
+    if checkpoint is not None:
+        if output is None:
+            raise click.UsageError('--checkpoint requires --output')
+        if (output_format or sinks.infer_format(output)) != 'ndjson':
+            raise click.UsageError('--checkpoint requires ndjson output')
+        if checkpoint.complete:
+            click.echo(f'checkpoint: {checkpoint.report()}', err=True)
+            return
+        if checkpoint.pages:
+            click.echo(f'checkpoint: resuming, {checkpoint.report()}', err=True)
+            offset = checkpoint.output_offset
+
+    try:
+        sink = sinks.open_sink(
+            output,
+            format=output_format,
+            row_group_size=row_group_size,
+            compress=compress,
+            offset=offset)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    sinks.write_pages(features_iter, sink, checkpoint=checkpoint)
+
+    if checkpoint is not None:
+        click.echo(f'checkpoint: {checkpoint.report()}', err=True)
 
 
 main.add_command(stops)
@@ -0,0 +1,61 @@
+"""Exceptions raised when requests to transit.land fail"""
+
+
+class TransitlandError(Exception):
+    """Base class for errors from this package"""
+
+
+class HTTPStatusError(TransitlandError):
+    """The API responded with a status code that is not retried
+
+    Attributes:
+        - response: the requests.Response
+        - status_code: HTTP status code of the response
+        - url: requested url
+    """
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.url = response.url
+        super().__init__(
+            f'returned with status code: {self.status_code}\nurl: {self.url}')
+
+
+class RetryError(TransitlandError):
+    """A request still failed after the maximum number of attempts
+
+    Attributes:
+        - url: requested url
+        - attempts: number of attempts made
+        - response: the last requests.Response, or None if the last attempt
+          raised a connection error
+        - error: the last connection error, or None
+    """
+    def __init__(self, url, attempts, response=None, error=None, msg=None):
+        self.url = url
+        self.attempts = attempts
+        self.response = response
+        self.error = error
+        if msg is None:
+            msg = f'request failed after {attempts} attempts'
+        if response is not None:
+            msg += f'; last status code: {response.status_code}'
+        elif error is not None:
+            msg += f'; last error: {error!r}'
+        super().__init__(f'{msg}\nurl: {url}')
+
+
+class DeadlineExceeded(RetryError):
+    """Retrying a request would run past the retry policy's deadline"""
+
+
+class CircuitOpenError(TransitlandError):
+    """Requests are failing fast because the API appears to be down
+
+    Attributes:
+        - retry_at: `time.monotonic()` value after which a trial request will
+          be let through
+    """
+    def __init__(self, retry_at, msg='circuit breaker is open'):
+        self.retry_at = retry_at
+        super().__init__(msg)
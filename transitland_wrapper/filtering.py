@@ -0,0 +1,150 @@
+"""Batched intersection filtering of GeoJSON features
+
+`base` keeps only the features of each page that intersect the query
+geometry. Rather than testing features one at a time, a whole page is tested
+at once:
+
+1. Features whose bounding box doesn't overlap the geometry's bounding box are
+   dropped without building a shapely geometry for the exact test.
+2. The remaining candidates are tested with a single vectorized predicate.
+
+With shapely 2, points are tested straight from a coordinate array with
+`shapely.intersects_xy`, and other geometries with `shapely.intersects` over a
+geometry array. LineStrings and MultiLineStrings, which make up most of the
+parsing time of routes and route stop patterns, are built in bulk from one
+flat coordinate array. With shapely 1, the exact test falls back to a
+prepared geometry in a loop, after the same bounding box prefilter.
+"""
+from itertools import chain
+
+import shapely
+from shapely.geometry import shape
+from shapely.prepared import prep
+
+from .cache import geometry_bounds
+
+SHAPELY_2 = int(shapely.__version__.split('.')[0]) >= 2
+
+if SHAPELY_2:
+    import numpy as np
+
+
+class IntersectionFilter:
+    """Keep features that intersect a geometry
+
+    Args:
+        - geometry: shapely geometry to test features against
+    """
+    def __init__(self, geometry):
+        self.geometry = geometry
+        self.bounds = geometry_bounds(geometry)
+        if SHAPELY_2:
+            shapely.prepare(geometry)
+        else:
+            self._prepared = prep(geometry)
+
+    def filter(self, features):
+        """Filter a page of GeoJSON features
+
+        Features without a geometry are dropped.
+
+        Returns:
+            list of the features that intersect the geometry, in their
+            original order
+        """
+        features = [f for f in features if f.get('geometry')]
+        if not features:
+            return []
+
+        if SHAPELY_2:
+            if all(f['geometry']['type'] == 'Point' for f in features):
+                keep = self._intersects_points(features)
+            else:
+                keep = self._intersects_geometries(features)
+            return [f for f, k in zip(features, keep) if k]
+
+        return self._filter_loop(features)
+
+    def _intersects_points(self, features):
+        xy = np.array(
+            [f['geometry']['coordinates'][:2] for f in features],
+            dtype=float)
+        x, y = xy[:, 0], xy[:, 1]
+        keep = self._bbox_overlaps(x, y, x, y)
+        candidates = np.flatnonzero(keep)
+        keep[candidates] = shapely.intersects_xy(
+            self.geometry, x[candidates], y[candidates])
+        return keep
+
+    def _intersects_geometries(self, features):
+        geoms = _geometry_array([f['geometry'] for f in features])
+        minx, miny, maxx, maxy = shapely.bounds(geoms).T
+        keep = self._bbox_overlaps(minx, miny, maxx, maxy)
+        candidates = np.flatnonzero(keep)
+        keep[candidates] = shapely.intersects(
+            self.geometry, geoms[candidates])
+        return keep
+
+    def _bbox_overlaps(self, minx, miny, maxx, maxy):
+        qminx, qminy, qmaxx, qmaxy = self.bounds
+        return ((maxx >= qminx) & (minx <= qmaxx) & (maxy >= qminy)
+                & (miny <= qmaxy))
+
+    def _filter_loop(self, features):
+        qminx, qminy, qmaxx, qmaxy = self.bounds
+        kept_features = []
+        for feature in features:
+            geom = shape(feature['geometry'])
+            if geom.is_empty:
+                continue
+
+            minx, miny, maxx, maxy = geom.bounds
+            if maxx < qminx or minx > qmaxx or maxy < qminy or miny > qmaxy:
+                continue
+            if self._prepared.intersects(geom):
+                kept_features.append(feature)
+
+        return kept_features
+
+
+def _geometry_array(geometries):
+    """Convert GeoJSON geometries to a shapely 2 geometry array
+    """
+    types = {g['type'] for g in geometries}
+    coords = [g['coordinates'] for g in geometries]
+    geoms = None
+    if types == {'LineString'}:
+        geoms = _linestrings(coords)
+    elif types == {'MultiLineString'}:
+        lines = _linestrings(list(chain.from_iterable(coords)))
+        if lines is not None:
+            geoms = shapely.multilinestrings(
+                lines, indices=_indices([len(c) for c in coords]))
+            # Geometries with no parts don't appear in the output
+            if len(geoms) != len(coords):
+                geoms = None
+
+    if geoms is None:
+        geoms = np.array([shape(g) for g in geometries])
+    return geoms
+
+
+def _linestrings(coords):
+    """Build LineStrings from lists of 2D coordinates in one call
+
+    Returns:
+        geometry array, or None if any coordinate is not 2D
+    """
+    lengths = [len(c) for c in coords]
+    n_coords = sum(lengths)
+    flat = np.fromiter(
+        chain.from_iterable(chain.from_iterable(coords)), dtype=float)
+    if flat.size != 2 * n_coords or min(lengths, default=0) < 2:
+        return None
+
+    return shapely.linestrings(flat.reshape(-1, 2), indices=_indices(lengths))
+
+
+def _indices(lengths):
+    """Index of the part each element belongs to"""
+    return np.repeat(np.arange(len(lengths)), lengths)
@@ -0,0 +1,184 @@
+"""Build DataFrames and GeoDataFrames from pages of results
+
+Collecting every page into one list of GeoJSON dicts and then building a
+frame holds each result twice, and dicts are several times larger than the
+values they hold. `FrameBuilder` instead appends each page to one list per
+column, and converts each page's geometries to shapely geometries right away,
+so the dicts of a page can be freed as soon as the next one is requested. The
+frame is built once, at the end. With `columns`, other properties are never
+stored at all.
+
+pandas and geopandas are imported only when a frame is built.
+"""
+from shapely.geometry import shape
+
+from . import transitland
+from .filtering import SHAPELY_2
+
+if SHAPELY_2:
+    import numpy as np
+
+    from .filtering import _geometry_array
+
+GEOMETRY_COLUMN = 'geometry'
+
+
+class FrameBuilder:
+    """Accumulate pages of results into columns
+
+    GeoJSON features are flattened, with their properties as columns and
+    their geometry in a `geometry` column.
+
+    Args:
+        - columns: names of the columns to keep. By default all columns.
+    """
+    def __init__(self, columns=None):
+        self.columns = list(columns) if columns is not None else None
+        self._keep = set(self.columns) if columns is not None else None
+        self._data = {}
+        self._geometries = []
+        self._has_geometry = False
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def add(self, features):
+        """Append a page of results"""
+        features = list(features)
+        if not features:
+            return
+
+        geojson = features[0].get('type') == 'Feature'
+        if geojson:
+            self._add_geometries([f.get('geometry') for f in features])
+
+        for i, feature in enumerate(features, start=self._n):
+            if geojson:
+                values = {
+                    k: v
+                    for k, v in feature.items()
+                    if k not in ('type', 'geometry', 'properties')}
+                values.update(feature.get('properties') or {})
+            else:
+                values = feature
+
+            for key, value in values.items():
+                if self._keep is not None and key not in self._keep:
+                    continue
+
+                column = self._data.get(key)
+                if column is None:
+                    # Column first seen in this result
+                    column = self._data[key] = []
+                if len(column) < i:
+                    # Column missing from the results since its last value
+                    column.extend([None] * (i - len(column)))
+                column.append(value)
+
+        self._n += len(features)
+        for column in self._data.values():
+            if len(column) < self._n:
+                column.extend([None] * (self._n - len(column)))
+
+    def to_dataframe(self):
+        """Build a pandas DataFrame
+
+        Geometries, if any, are in a `geometry` column of shapely
+        geometries.
+        """
+        import pandas as pd
+        data = self._column_data()
+        if self._has_geometry:
+            data[GEOMETRY_COLUMN] = self._geometry_values()
+        return pd.DataFrame(data, columns=self._column_order(data))
+
+    def to_geodataframe(self):
+        """Build a GeoDataFrame in EPSG:4326"""
+        import geopandas as gpd
+        if not self._has_geometry and self._n:
+            raise ValueError('Results have no geometries')
+
+        data = self._column_data()
+        geometry = gpd.GeoSeries(self._geometry_values(), crs='EPSG:4326')
+        data[GEOMETRY_COLUMN] = geometry
+        return gpd.GeoDataFrame(
+            data,
+            columns=self._column_order(data),
+            geometry=GEOMETRY_COLUMN,
+            crs='EPSG:4326')
+
+    def _add_geometries(self, geometries):
+        present = [i for i, g in enumerate(geometries) if g]
+        if present:
+            self._has_geometry = True
+
+        if SHAPELY_2:
+            values = np.full(len(geometries), None, dtype=object)
+            if present:
+                values[present] = _geometry_array(
+                    [geometries[i] for i in present])
+        else:
+            values = [shape(g) if g else None for g in geometries]
+        self._geometries.append(values)
+
+    def _geometry_values(self):
+        if len(self._geometries) < 1:
+            return []
+        if SHAPELY_2:
+            return np.concatenate(self._geometries)
+        return [g for values in self._geometries for g in values]
+
+    def _column_data(self):
+        return {k: v for k, v in self._data.items() if k != GEOMETRY_COLUMN}
+
+    def _column_order(self, data):
+        """Requested columns in the requested order, then the geometry"""
+        if self.columns is None:
+            return list(data)
+
+        order = [c for c in self.columns if c in data]
+        if GEOMETRY_COLUMN in data and GEOMETRY_COLUMN not in order:
+            order.append(GEOMETRY_COLUMN)
+        return order
+
+
+def to_dataframe(pages, columns=None, **kwargs):
+    """Build a DataFrame from pages of results
+
+    Args:
+        - pages: iterable of pages, as returned by any endpoint function, or
+          the name of an endpoint function to call with kwargs
+        - columns: names of the columns to keep. By default all columns.
+
+    Returns:
+        pandas.DataFrame
+    """
+    return _build(pages, columns, kwargs).to_dataframe()
+
+
+def to_geodataframe(pages, columns=None, **kwargs):
+    """Build a GeoDataFrame from pages of GeoJSON features
+
+    Args:
+        - pages: iterable of pages, as returned by any endpoint function with
+          GeoJSON results, or the name of such a function to call with kwargs
+        - columns: names of the columns to keep, besides `geometry`. By
+          default all columns.
+
+    Returns:
+        geopandas.GeoDataFrame
+    """
+    return _build(pages, columns, kwargs).to_geodataframe()
+
+
+def _build(pages, columns, kwargs):
+    if isinstance(pages, str):
+        pages = getattr(transitland, pages)(**kwargs)
+    elif kwargs:
+        raise TypeError('kwargs are only used with an endpoint name')
+
+    builder = FrameBuilder(columns)
+    for features in pages:
+        builder.add(features)
+    return builder
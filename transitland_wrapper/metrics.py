@@ -0,0 +1,327 @@
+"""Metrics of requests and pages
+
+When metrics are turned on with `configure_metrics()`, every request sent by
+this package, including cached ones, records an event with its latency, size,
+status, retries, time spent waiting on the rate limiter and whether it was
+answered from the cache. `base()` records an event for each page with the
+number of results before and after filtering by geometry.
+
+Events are dicts, which `Metrics` aggregates into a summary, and passes to any
+hooks, for example to export them:
+
+    metrics.configure_metrics(hooks=[print])
+
+Metrics are off by default, and then cost nothing.
+"""
+import threading
+from collections import Counter
+from time import monotonic
+
+from .cache import url_endpoint
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class Metrics:
+    """Aggregate request and page events
+
+    Request events have:
+        - type: `request`
+        - url, endpoint
+        - status: status code of the last response, or None if there was
+          none
+        - error: name of the exception raised, or None
+        - seconds: time from the first attempt to the last response,
+          including retries and waits
+        - bytes: size of the body, or None if unknown, as for streamed
+          responses without a Content-Length
+        - attempts: number of requests sent, 0 for a fresh cache hit
+        - retries: number of attempts after the first
+        - rate_limit_wait: seconds spent waiting on the rate limiter
+        - cache: `hit`, `revalidated`, `miss`, or None if the cache is off
+
+    Page events have:
+        - type: `page`
+        - endpoint
+        - results: number of results in the page
+        - kept: number of results left after filtering by geometry
+        - seconds: time spent filtering and transforming the page, and for
+          streamed pages also parsing it
+
+    Args:
+        - hooks: callables, each called with every event. Hooks are called on
+          the thread that sent the request.
+    """
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.started = monotonic()
+        self._lock = threading.Lock()
+        self._latencies = []
+        self._statuses = Counter()
+        self._cache = Counter()
+        self._totals = Counter()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record(self, event):
+        """Add an event to the summary and pass it to the hooks"""
+        with self._lock:
+            if event['type'] == 'request':
+                self._record_request(event)
+            elif event['type'] == 'page':
+                self._totals['pages'] += 1
+                self._totals['results'] += event['results']
+                self._totals['kept'] += event['kept']
+                self._totals['page_seconds'] += event['seconds']
+
+        for hook in self.hooks:
+            hook(event)
+
+    def _record_request(self, event):
+        totals = self._totals
+        totals['requests'] += 1
+        totals['attempts'] += event['attempts']
+        totals['retries'] += event['retries']
+        totals['bytes'] += event['bytes'] or 0
+        totals['rate_limit_wait'] += event['rate_limit_wait']
+        if event['error'] is not None:
+            totals['errors'] += 1
+        if event['status'] is not None:
+            self._statuses[str(event['status'])] += 1
+        if event['cache'] is not None:
+            self._cache[event['cache']] += 1
+        if event['attempts']:
+            self._latencies.append(event['seconds'])
+
+    def summary(self):
+        """Summary of all events so far
+
+        Returns:
+            dict of totals, latencies of requests sent in seconds, and rates
+            per second since the metrics were created
+        """
+        with self._lock:
+            totals = dict(self._totals)
+            latencies = sorted(self._latencies)
+            statuses = dict(self._statuses)
+            cache = dict(self._cache)
+
+        seconds = monotonic() - self.started
+        summary = {
+            'seconds': seconds,
+            'requests': totals.get('requests', 0),
+            'attempts': totals.get('attempts', 0),
+            'retries': totals.get('retries', 0),
+            'errors': totals.get('errors', 0),
+            'statuses': statuses,
+            'bytes': totals.get('bytes', 0),
+            'rate_limit_wait': totals.get('rate_limit_wait', 0),
+            'cache': cache,
+            'latency': {
+                'mean': sum(latencies) / len(latencies) if latencies else None,
+                'p50': _percentile(latencies, 0.5),
+                'p95': _percentile(latencies, 0.95),
+                'max': latencies[-1] if latencies else None,
+            },
+            'pages': totals.get('pages', 0),
+            'results': totals.get('results', 0),
+            'kept': totals.get('kept', 0),
+            'page_seconds': totals.get('page_seconds', 0),
+        }
+        summary['requests_per_second'] = summary['requests'] / seconds
+        summary['results_per_second'] = summary['kept'] / seconds
+        return summary
+
+    def report(self):
+        """Multi-line summary of all events so far"""
+        s = self.summary()
+        latency = s['latency']
+        lines = [
+            f'{s["requests"]} requests in {s["seconds"]:.1f}s '
+            f'({s["requests_per_second"]:.2f}/s), {s["retries"]} retries, '
+            f'{s["errors"]} errors, {s["bytes"] / 1024 ** 2:.1f} MB',
+        ]
+        if latency['mean'] is not None:
+            lines.append(
+                f'latency: mean {latency["mean"]:.3f}s, '
+                f'p50 {latency["p50"]:.3f}s, p95 {latency["p95"]:.3f}s, '
+                f'max {latency["max"]:.3f}s')
+        lines.append(
+            f'rate limit wait: {s["rate_limit_wait"]:.1f}s, statuses: '
+            + (', '.join(f'{k}: {v}' for k, v in sorted(s['statuses'].items()))
+               or 'none'))
+        if s['cache']:
+            lines.append('cache: ' + ', '.join(
+                f'{k}: {v}' for k, v in sorted(s['cache'].items())))
+        if s['pages']:
+            lines.append(
+                f'{s["pages"]} pages, {s["results"]} results, {s["kept"]} '
+                f'kept after filtering ({s["results_per_second"]:.1f}/s)')
+        return '\n'.join(lines)
+
+
+class RequestRecord:
+    """Measurements of one request, across its attempts
+
+    Attributes:
+        - attempts: number of requests sent
+        - rate_limit_wait: seconds spent waiting on the rate limiter
+        - cache: `hit`, `revalidated`, `miss`, or None if the cache is off
+    """
+    def __init__(self, url):
+        self.url = url
+        self.start = monotonic()
+        self.attempts = 0
+        self.rate_limit_wait = 0.0
+        self.cache = None
+
+    def finish(self, response=None, error=None, stream=False):
+        """Record the request in the shared metrics, if they are on
+
+        Args:
+            - response: the last response, if any
+            - error: the exception raised, if any
+            - stream: whether the body of response is still to be read
+        """
+        metrics = get_metrics()
+        if metrics is None:
+            return
+
+        metrics.record({
+            'type': 'request',
+            'url': self.url,
+            'endpoint': url_endpoint(self.url),
+            'status': getattr(response, 'status_code', None),
+            'error': type(error).__name__ if error is not None else None,
+            'seconds': monotonic() - self.start,
+            'bytes': _response_size(response, stream),
+            'attempts': self.attempts,
+            'retries': max(self.attempts - 1, 0),
+            'rate_limit_wait': self.rate_limit_wait,
+            'cache': self.cache,
+        })
+
+
+def record_page(features, endpoint, steps):
+    """Apply steps to a page, and record the page in the shared metrics
+
+    Args:
+        - features: list of results
+        - steps: functions applied to the page in order, the geometry filter
+          among them
+
+    Returns:
+        the page after all steps
+    """
+    start = monotonic()
+    results = len(features)
+    for step in steps:
+        features = step(features)
+
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.record({
+            'type': 'page',
+            'endpoint': endpoint,
+            'results': results,
+            'kept': len(features),
+            'seconds': monotonic() - start,
+        })
+    return features
+
+
+def record_stream_page(features, endpoint, steps):
+    """Apply steps to a streamed page, and record the page in the shared
+    metrics once it has been consumed
+
+    Lazy counterpart of `record_page`, for pages that are iterators. Results
+    are counted as they pass through, and `seconds` also includes the time
+    spent parsing them.
+
+    Args:
+        - features: iterator of results
+        - steps: functions taking and returning iterators of results, applied
+          in order
+
+    Yields:
+        results left after all steps
+    """
+    results = 0
+
+    def counted(features):
+        nonlocal results
+        for feature in features:
+            results += 1
+            yield feature
+
+    features = counted(features)
+    for step in steps:
+        features = step(features)
+
+    kept = 0
+    seconds = 0.0
+    try:
+        while True:
+            start = monotonic()
+            try:
+                feature = next(features)
+            except StopIteration:
+                return
+            finally:
+                seconds += monotonic() - start
+            kept += 1
+            yield feature
+    finally:
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.record({
+                'type': 'page',
+                'endpoint': endpoint,
+                'results': results,
+                'kept': kept,
+                'seconds': seconds,
+            })
+
+
+def _response_size(response, stream=False):
+    if response is None:
+        return None
+    if stream:
+        length = response.headers.get('Content-Length')
+        return int(length) if length is not None else None
+    return len(response.content)
+
+
+def _percentile(values, q):
+    """Percentile of sorted values, or None if there are none"""
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def configure_metrics(**kwargs):
+    """Turn on shared metrics
+
+    Takes the same arguments as `Metrics`.
+
+    Returns:
+        the new shared Metrics
+    """
+    global _metrics
+    with _metrics_lock:
+        _metrics = Metrics(**kwargs)
+        return _metrics
+
+
+def disable_metrics():
+    """Turn off shared metrics"""
+    global _metrics
+    with _metrics_lock:
+        _metrics = None
+
+
+def get_metrics():
+    """Get the shared metrics, or None if metrics are off"""
+    return _metrics
@@ -0,0 +1,196 @@
+"""Cover sparse geometries with a few tight bounding boxes
+
+The transit.land API can only search within a bounding box. For a geometry
+made of several disjoint parts, such as a few counties, or for a long
+diagonal corridor, the envelope of the whole geometry is mostly empty, and
+most of the downloaded results are discarded by the intersection filter.
+
+`plan_cover` starts from the envelope of each part of the geometry, and
+merges envelopes whose union is no larger than their sum. If more envelopes
+than `max_boxes` are left, as for a geometry of many small parts, the pairs
+whose union adds the least area are merged until few enough are. It then
+repeatedly splits the box with the most empty area in two, shrinking each half
+to the part of the geometry it contains. Each box of the resulting cover is
+queried separately, and results are deduplicated by Onestop ID.
+"""
+from collections import namedtuple
+
+import numpy as np
+from shapely.geometry import box
+
+from .cache import geometry_bounds
+
+DEFAULT_MAX_BOXES = 16
+
+# A split is kept only if it shrinks the box's area by at least this fraction
+MIN_SPLIT_GAIN = 0.1
+
+
+class Cover(namedtuple('Cover', ['boxes', 'envelope_area', 'cover_area'])):
+    """Bounding boxes covering a geometry
+
+    Attributes:
+        - boxes: list of (minx, miny, maxx, maxy) tuples
+        - envelope_area: area of the geometry's single envelope
+        - cover_area: total area of boxes
+    """
+    __slots__ = ()
+
+    @property
+    def area_saved(self):
+        """Fraction of the envelope's area not covered by boxes"""
+        if not self.envelope_area:
+            return 0
+        return max(0, 1 - self.cover_area / self.envelope_area)
+
+    def report(self):
+        """One-line summary of the cover"""
+        msg = f'{len(self.boxes)} bounding boxes, covering '
+        msg += f'{self.area_saved:.0%} less area than the envelope'
+        return msg
+
+
+def plan_cover(geometry, max_boxes=DEFAULT_MAX_BOXES):
+    """Cover geometry with at most max_boxes tight bounding boxes
+
+    Args:
+        - geometry: shapely geometry
+        - max_boxes: maximum number of boxes, i.e. of separate queries
+
+    Returns:
+        Cover
+    """
+    boxes = [
+        geometry_bounds(part) for part in _parts(geometry)
+        if not part.is_empty]
+    boxes = _merge(boxes, max_boxes)
+
+    # Split the box with the most empty area, as long as splitting pays off
+    candidates = list(boxes)
+    boxes = []
+    while candidates and len(boxes) + len(candidates) < max_boxes:
+        candidates.sort(key=lambda b: _empty_area(geometry, b))
+        bounds = candidates.pop()
+        if not _area(bounds):
+            boxes.append(bounds)
+            continue
+
+        halves = _split(geometry, bounds)
+        split_area = sum(_area(b) for b in halves)
+        if split_area > (1 - MIN_SPLIT_GAIN) * _area(bounds):
+            boxes.append(bounds)
+            continue
+
+        candidates.extend(halves)
+
+    boxes.extend(candidates)
+    return Cover(
+        boxes=boxes,
+        envelope_area=_area(geometry_bounds(geometry)),
+        cover_area=sum(_area(b) for b in boxes))
+
+
+def _parts(geometry):
+    """Components of a multi-part geometry, or the geometry itself"""
+    if hasattr(geometry, 'geoms'):
+        return list(geometry.geoms)
+    return [geometry]
+
+
+def _merge(boxes, max_boxes):
+    """Merge pairs of boxes, those whose union adds the least area first
+
+    Pairs are merged as long as their union box is no larger than their sum,
+    or there are more than max_boxes boxes. Each box keeps track of the
+    partner it would grow least with, so that a merge only rescans the boxes
+    whose partner was merged.
+    """
+    if len(boxes) < 2:
+        return list(boxes)
+
+    bounds = np.array(boxes, dtype=float)
+    active = np.ones(len(boxes), dtype=bool)
+    best = np.empty(len(boxes))
+    partner = np.empty(len(boxes), dtype=int)
+    for i in range(len(boxes)):
+        best[i], partner[i] = _best_partner(bounds, active, i)
+
+    count = len(boxes)
+    while count > 1:
+        i = int(np.argmin(np.where(active, best, np.inf)))
+        if best[i] > 0 and count <= max(max_boxes, 1):
+            break
+
+        j = partner[i]
+        bounds[i] = _union(bounds[i], bounds[j])
+        active[j] = False
+        best[j] = np.inf
+        count -= 1
+
+        best[i], partner[i] = _best_partner(bounds, active, i)
+        # Boxes may now grow least with the merged box
+        growth = _growths(bounds, bounds[i])
+        closer = active & (growth < best)
+        closer[i] = False
+        best[closer] = growth[closer]
+        partner[closer] = i
+        # Boxes whose partner was merged away or changed look again
+        for k in np.flatnonzero(active & ((partner == i) | (partner == j))):
+            if k != i and not closer[k]:
+                best[k], partner[k] = _best_partner(bounds, active, k)
+
+    return [tuple(b) for b in bounds[active].tolist()]
+
+
+def _best_partner(bounds, active, i):
+    """Smallest growth of box i merged with another active box, and that box
+    """
+    growth = np.where(active, _growths(bounds, bounds[i]), np.inf)
+    growth[i] = np.inf
+    j = int(np.argmin(growth))
+    return growth[j], j
+
+
+def _growths(bounds, b):
+    """Area the union box of b with each of bounds adds to their sum"""
+    union = (
+        (np.maximum(bounds[:, 2], b[2]) - np.minimum(bounds[:, 0], b[0]))
+        * (np.maximum(bounds[:, 3], b[3]) - np.minimum(bounds[:, 1], b[1])))
+    areas = (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+    return union - areas - _area(b)
+
+
+def _split(geometry, bounds):
+    """Split bounds in two along its longer side, and shrink each half to the
+    envelope of the geometry within it
+
+    Halves that don't intersect the geometry are dropped.
+    """
+    minx, miny, maxx, maxy = bounds
+    if maxx - minx >= maxy - miny:
+        midx = (minx + maxx) / 2
+        halves = [(minx, miny, midx, maxy), (midx, miny, maxx, maxy)]
+    else:
+        midy = (miny + maxy) / 2
+        halves = [(minx, miny, maxx, midy), (minx, midy, maxx, maxy)]
+
+    tight = []
+    for half in halves:
+        part = geometry.intersection(box(*half))
+        if not part.is_empty:
+            tight.append(part.bounds)
+
+    return tight
+
+
+def _empty_area(geometry, bounds):
+    return _area(bounds) - geometry.intersection(box(*bounds)).area
+
+
+def _union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _area(bounds):
+    minx, miny, maxx, maxy = bounds
+    return (maxx - minx) * (maxy - miny)
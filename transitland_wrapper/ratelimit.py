@@ -0,0 +1,231 @@
+"""Client-side rate limiting for the transit.land API
+
+transit.land allows 60 requests per minute. Rather than sending requests until
+the API answers with a 429, every request first takes a token from a token
+bucket, which spaces requests out so that the whole budget is used without
+going over it.
+
+The default budget of 60 requests per minute with a burst of 1 sends at most
+one request per second, which never exceeds the API's limit. Raising `burst`
+lets short queries go out at once, at the risk of a 429 on long crawls.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_BURST = 1
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Thread-safe token bucket
+
+    Args:
+        - requests_per_minute: sustained request budget. If 0 or None, requests
+          are never delayed.
+        - burst: maximum number of requests that can be sent at once after the
+          bucket has been idle
+    """
+    def __init__(
+            self,
+            requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+            burst=DEFAULT_BURST):
+        if burst < 1:
+            raise ValueError('burst must be at least 1')
+
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self):
+        """Tokens added per second"""
+        return (self.requests_per_minute or 0) / 60
+
+    def acquire(self, tokens=1):
+        """Take tokens from the bucket, blocking until they are available
+
+        Each caller reserves its tokens immediately, so concurrent callers are
+        served in the order they arrived.
+
+        Returns:
+            seconds spent waiting
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, seconds):
+        """Hold off all requests for at least `seconds`
+
+        Used when the API responds with a 429 despite the limiter, for example
+        because another client is sharing the same budget. Does nothing when
+        the bucket has no rate, so callers must then wait themselves.
+        """
+        if not self.rate:
+            return
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+    def reserve(self, tokens=1):
+        """Take tokens from the bucket without blocking
+
+        Returns:
+            seconds the caller must wait before sending its request
+        """
+        if not self.rate:
+            return 0
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """Token bucket shared across processes through a SQLite file
+
+    Every process pointing at the same `path` draws from the same budget,
+    which makes it possible to run several crawls at once without exceeding
+    the API's rate limit.
+
+    Args:
+        - path: path to the SQLite database file. Created if it doesn't exist.
+        - requests_per_minute: sustained request budget
+        - burst: maximum number of requests that can be sent at once
+        - name: name of the bucket within the database
+    """
+    def __init__(
+            self,
+            path,
+            requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+            burst=DEFAULT_BURST,
+            name='transit.land'):
+        super().__init__(requests_per_minute=requests_per_minute, burst=burst)
+        self.path = os.path.expanduser(path)
+        self.name = name
+
+        # isolation_level=None so that transactions are managed explicitly
+        self._conn = sqlite3.connect(
+            self.path, timeout=60, isolation_level=None,
+            check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets '
+            '(name TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def penalize(self, seconds):
+        if not self.rate:
+            return
+
+        with self._transaction() as (tokens, now):
+            tokens = min(tokens, 0) - seconds * self.rate
+            self._write(tokens, now)
+
+    def reserve(self, tokens=1):
+        if not self.rate:
+            return 0
+
+        with self._transaction() as (available, now):
+            available -= tokens
+            self._write(available, now)
+
+        if available >= 0:
+            return 0
+        return -available / self.rate
+
+    @contextmanager
+    def _transaction(self):
+        """Read and refill this bucket's row while holding the write lock
+
+        Yields:
+            (tokens, now), where tokens is the refilled token count
+        """
+        with self._lock:
+            # Take the write lock up front so that no other process can read
+            # the row between our read and write
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT tokens, updated FROM buckets WHERE name = ?',
+                    (self.name, )).fetchone()
+
+                # Wall-clock time, since monotonic clocks aren't comparable
+                # across processes
+                now = time.time()
+                if row is None:
+                    tokens = float(self.burst)
+                else:
+                    tokens, updated = row
+                    elapsed = max(0, now - updated)
+                    tokens = min(self.burst, tokens + elapsed * self.rate)
+
+                yield tokens, now
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            else:
+                self._conn.execute('COMMIT')
+
+    def _write(self, tokens, now):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO buckets (name, tokens, updated) '
+            'VALUES (?, ?, ?)', (self.name, tokens, now))
+
+    def close(self):
+        self._conn.close()
+
+
+def configure_rate_limiter(
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        burst=DEFAULT_BURST,
+        path=None):
+    """Replace the shared rate limiter
+
+    Args:
+        - requests_per_minute: sustained request budget. Pass 0 or None to
+          disable client-side rate limiting.
+        - burst: maximum number of requests that can be sent at once
+        - path: if given, share the budget with other processes through a
+          SQLite database at this path
+
+    Returns:
+        the new shared TokenBucket
+    """
+    global _rate_limiter
+    if path is not None:
+        limiter = SQLiteTokenBucket(
+            path, requests_per_minute=requests_per_minute, burst=burst)
+    else:
+        limiter = TokenBucket(
+            requests_per_minute=requests_per_minute, burst=burst)
+
+    with _rate_limiter_lock:
+        _rate_limiter = limiter
+    return limiter
+
+
+def get_rate_limiter():
+    """Get the shared rate limiter, creating it with defaults if necessary
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = TokenBucket()
+        return _rate_limiter
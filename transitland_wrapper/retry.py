@@ -0,0 +1,229 @@
+"""Retry policy and circuit breaker for requests to the transit.land API
+
+A failed request is retried only if its status code is in the policy's
+`retry_statuses`, or if it raised a connection error. Between attempts the
+policy waits with exponential backoff and full jitter, so that many clients
+failing at once don't retry in lockstep, unless the response has a
+`Retry-After` header, which takes precedence.
+
+The circuit breaker counts consecutive server failures across all requests.
+Once `failure_threshold` is reached, it opens and every request fails fast
+with `CircuitOpenError` for `reset_timeout` seconds. After that, one trial
+request is let through; if the API answers it the breaker closes again, and
+if it fails the breaker stays open for another `reset_timeout`. A trial that
+ends any other way, such as with an unexpected exception, is released so that
+the next request becomes the trial.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from .exceptions import CircuitOpenError
+
+DEFAULT_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_retry_policy = None
+_circuit_breaker = None
+_retry_lock = threading.Lock()
+
+
+class RetryPolicy:
+    """Which requests to retry, and how long to wait between attempts
+
+    Args:
+        - retry_statuses: status codes to retry. Other non-200 statuses raise
+          HTTPStatusError immediately.
+        - max_attempts: maximum number of attempts per request, including the
+          first. None to retry without limit.
+        - deadline: maximum number of seconds to spend on a request, including
+          waits between attempts. None for no deadline.
+        - backoff_factor: base delay in seconds. The delay before attempt `n+1`
+          is drawn uniformly from `[0, backoff_factor * 2 ** (n - 1)]`.
+        - max_backoff: upper bound on the delay between attempts
+        - jitter: if False, always wait the full exponential delay
+        - respect_retry_after: wait as long as the Retry-After header says,
+          when present
+        - timeout: seconds to wait for the server on each attempt
+    """
+    def __init__(
+            self,
+            retry_statuses=DEFAULT_RETRY_STATUSES,
+            max_attempts=5,
+            deadline=None,
+            backoff_factor=1,
+            max_backoff=60,
+            jitter=True,
+            respect_retry_after=True,
+            timeout=60):
+        self.retry_statuses = frozenset(retry_statuses)
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.respect_retry_after = respect_retry_after
+        self.timeout = timeout
+
+    def should_retry(self, response):
+        """Whether a response's status code is retryable"""
+        return response.status_code in self.retry_statuses
+
+    def get_delay(self, attempt, response=None):
+        """Seconds to wait after a failed attempt
+
+        Args:
+            - attempt: number of the attempt that just failed, starting at 1
+            - response: the failed requests.Response, or None after a
+              connection error
+        """
+        if self.respect_retry_after and response is not None:
+            retry_after = parse_retry_after(
+                response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+
+        delay = min(
+            self.max_backoff, self.backoff_factor * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class CircuitBreaker:
+    """Fail fast after repeated server failures
+
+    Thread-safe; a single breaker is shared by all requests.
+
+    Args:
+        - failure_threshold: consecutive failures after which the breaker
+          opens. None to disable the breaker.
+        - reset_timeout: seconds to stay open before letting a trial request
+          through
+    """
+    def __init__(self, failure_threshold=10, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_request(self):
+        """Raise CircuitOpenError if requests should not be sent right now
+
+        Returns:
+            True if the request is the trial of a half-open breaker. Its
+            caller must then call `release_trial()` once the request is over,
+            whatever its outcome.
+        """
+        if self.failure_threshold is None:
+            return False
+
+        with self._lock:
+            if self._opened_at is None:
+                return False
+
+            retry_at = self._opened_at + self.reset_timeout
+            if time.monotonic() < retry_at or self._trial_in_flight:
+                raise CircuitOpenError(retry_at)
+
+            # Half-open: let a single trial request through
+            self._trial_in_flight = True
+            return True
+
+    def release_trial(self):
+        """Let another trial request through, if the last one recorded
+        neither a success nor a failure
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        if self.failure_threshold is None:
+            return
+
+        with self._lock:
+            self._failures += 1
+            if (self._trial_in_flight
+                    or self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header into seconds
+
+    The header is either a number of seconds or an HTTP date.
+
+    Returns:
+        float seconds, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def configure_retry(policy=None, circuit_breaker=None, **kwargs):
+    """Replace the shared retry policy and circuit breaker
+
+    Args:
+        - policy: a RetryPolicy. If None, one is created from kwargs.
+        - circuit_breaker: a CircuitBreaker. If None, the existing breaker is
+          kept.
+        - kwargs: passed to RetryPolicy when policy is None
+    """
+    global _retry_policy, _circuit_breaker
+    if policy is None:
+        policy = RetryPolicy(**kwargs)
+
+    with _retry_lock:
+        _retry_policy = policy
+        if circuit_breaker is not None:
+            _circuit_breaker = circuit_breaker
+    return policy
+
+
+def get_retry_policy():
+    """Get the shared retry policy, creating it with defaults if necessary
+    """
+    global _retry_policy
+    with _retry_lock:
+        if _retry_policy is None:
+            _retry_policy = RetryPolicy()
+        return _retry_policy
+
+
+def get_circuit_breaker():
+    """Get the shared circuit breaker, creating it with defaults if necessary
+    """
+    global _circuit_breaker
+    with _retry_lock:
+        if _circuit_breaker is None:
+            _circuit_breaker = CircuitBreaker()
+        return _circuit_breaker
@@ -0,0 +1,114 @@
+"""Shared HTTP session for the transit.land API
+
+Every request to transit.land goes through a single `requests.Session`, so a
+crawl that pages over many responses reuses a few warm keep-alive connections
+instead of opening a new TCP and TLS connection for each page.
+"""
+import threading
+
+from . import __version__
+
+BASE_URL = 'https://transit.land'
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+
+DEFAULT_HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'User-Agent': f'transitland_wrapper/{__version__}',
+}
+
+_session = None
+_session_options = {}
+_session_lock = threading.Lock()
+
+
+def create_session(
+        pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        headers=None):
+    """Create a new pooled session
+
+    Args:
+        - pool_connections: number of distinct hosts to keep connection pools
+          for
+        - pool_maxsize: maximum number of connections to keep open per host.
+          Should be at least the number of threads making requests at once.
+        - headers: dict of extra headers to send with every request
+
+    Returns:
+        requests.Session
+    """
+    # requests is only imported once a request is made, for fast startup
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    if headers:
+        session.headers.update(headers)
+
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def configure_session(**kwargs):
+    """Replace the shared session
+
+    Takes the same arguments as `create_session`. The previous shared session,
+    if any, is closed.
+
+    Returns:
+        the new shared requests.Session
+    """
+    global _session
+    session = create_session(**kwargs)
+    with _session_lock:
+        old_session, _session = _session, session
+
+    if old_session is not None:
+        old_session.close()
+
+    return session
+
+
+def set_session_options(**kwargs):
+    """Set the arguments of the shared session, without creating it
+
+    Takes the same arguments as `create_session`. Unlike `configure_session`,
+    the session, and requests with it, is only created once a request is
+    made. A shared session already created is closed.
+    """
+    global _session, _session_options
+    with _session_lock:
+        old_session, _session = _session, None
+        _session_options = kwargs
+
+    if old_session is not None:
+        old_session.close()
+
+
+def get_session():
+    """Get the shared session, creating it if necessary with the options of
+    `set_session_options`, or defaults
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session(**_session_options)
+        return _session
+
+
+def close_session():
+    """Close the shared session and its pooled connections
+    """
+    global _session
+    with _session_lock:
+        old_session, _session = _session, None
+
+    if old_session is not None:
+        old_session.close()
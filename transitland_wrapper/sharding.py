@@ -0,0 +1,151 @@
+"""Split large-area queries into adaptively sized tiles
+
+A state- or country-sized geometry sent as a single `bbox` becomes one huge
+paginated query, whose pages can only be fetched one after another. Instead,
+the geometry's bounding box is treated as the root of a quadtree. Each tile is
+probed with a first page that includes the total number of results; tiles
+with more than `max_features` results are split into four, and the others are
+paged over in full. Tiles are handled concurrently by a pool of worker
+threads, and tiles that don't intersect the geometry are skipped.
+
+Features that cross tile borders are returned by more than one tile, so
+results are deduplicated by Onestop ID.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from shapely.geometry import box
+from shapely.prepared import prep
+
+from .cache import geometry_bounds
+from .transitland import (
+    ALL_ENDPOINT_TYPES, _endpoint_url, _follow_next, _get_json, _parse_page)
+
+DEFAULT_MAX_DEPTH = 10
+
+
+def request_sharded(
+        endpoint,
+        geometry,
+        params=None,
+        max_features=1000,
+        max_depth=DEFAULT_MAX_DEPTH,
+        workers=4,
+        session=None):
+    """Request all results within geometry, tile by tile
+
+    Args:
+        - endpoint: a GeoJSON endpoint
+        - geometry: shapely geometry to cover
+        - params: dict of params for sending requests. Any `bbox` is replaced
+          by each tile's bounds.
+        - max_features: split tiles with more results than this
+        - max_depth: never split tiles more than this many times
+        - workers: number of tiles to request at once
+        - session: requests.Session to use. By default the shared session.
+
+    Returns:
+        generator of lists of features, with each feature appearing once
+    """
+    if ALL_ENDPOINT_TYPES.get(endpoint) != '.geojson':
+        raise ValueError(f'Cannot shard requests to endpoint {endpoint}')
+
+    url = _endpoint_url(endpoint)
+    prepared_geometry = prep(geometry)
+
+    def crawl_tile(bounds, depth):
+        tile_params = dict(params or {}, total='true')
+        tile_params['bbox'] = ','.join(map(str, bounds))
+        d = _get_json(url, params=tile_params, session=session)
+
+        meta = d['meta']
+        total = meta.get('total')
+        if total is not None and total > max_features and depth < max_depth:
+            return bounds, depth, None
+
+        pages = [_parse_page(endpoint, d)]
+        if meta.get('next') is not None:
+            pages.extend(
+                _follow_next(endpoint, meta['next'], session=session))
+        return bounds, depth, pages
+
+    seen = set()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = {executor.submit(crawl_tile, geometry_bounds(geometry), 0)}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                bounds, depth, pages = future.result()
+                if pages is None:
+                    for child in split_bounds(bounds):
+                        if prepared_geometry.intersects(box(*child)):
+                            pending.add(
+                                executor.submit(crawl_tile, child, depth + 1))
+                    continue
+
+                for features in pages:
+                    yield _deduplicate(features, seen)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def split_bounds(bounds):
+    """Split bounds into four quadrants
+
+    Args:
+        - bounds: (minx, miny, maxx, maxy)
+
+    Returns:
+        list of four bounds tuples
+    """
+    minx, miny, maxx, maxy = bounds
+    midx = (minx + maxx) / 2
+    midy = (miny + maxy) / 2
+    return [
+        (minx, miny, midx, midy),
+        (midx, miny, maxx, midy),
+        (minx, midy, midx, maxy),
+        (midx, midy, maxx, maxy),
+    ]
+
+
+def feature_id(feature):
+    """Onestop ID of a GeoJSON feature, or None if it doesn't have one
+    """
+    oid = feature.get('onestop_id') or feature.get('id')
+    if oid is None:
+        oid = (feature.get('properties') or {}).get('onestop_id')
+    return oid
+
+
+def deduplicate_pages(pages):
+    """Drop features whose Onestop ID appeared in an earlier page
+
+    Args:
+        - pages: iterable of lists of features
+
+    Returns:
+        generator of lists of features
+    """
+    seen = set()
+    for features in pages:
+        yield _deduplicate(features, seen)
+
+
+def _deduplicate(features, seen):
+    """Keep features whose Onestop ID is not in seen, and add them to it
+
+    Features without an Onestop ID are always kept.
+    """
+    kept_features = []
+    for feature in features:
+        oid = feature_id(feature)
+        if oid is not None:
+            if oid in seen:
+                continue
+            seen.add(oid)
+        kept_features.append(feature)
+
+    return kept_features
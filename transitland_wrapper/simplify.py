@@ -0,0 +1,125 @@
+"""Reduce the size of geometries in results
+
+Route and route stop pattern geometries are returned at full double precision
+with every vertex, which is far more detail than most maps need. Each
+coordinate takes about 18 characters of JSON, but five decimal places,
+roughly one meter, take about 9.
+
+`GeometryReducer` simplifies the geometries of each page with the
+Douglas-Peucker algorithm, preserving topology, and then rounds coordinates to
+a number of decimal places. It runs after results are filtered by
+intersection, so that filtering sees the full geometries, and before they are
+written out.
+"""
+from shapely.geometry import mapping, shape
+
+from .filtering import SHAPELY_2
+
+if SHAPELY_2:
+    import shapely
+
+    from .filtering import _geometry_array
+
+
+class GeometryReducer:
+    """Simplify geometries and round their coordinates
+
+    Args:
+        - precision: number of decimal places to round coordinates to, or
+          None to keep full precision
+        - simplify_tolerance: maximum distance in degrees between a simplified
+          geometry and the original, or None to not simplify
+        - measure: count the size of geometries as JSON before and after, for
+          `report()`. This serializes every geometry twice.
+
+    Attributes:
+        - stats: dict with the number of geometries reduced, and their total
+          size in bytes as JSON before and after
+    """
+    def __init__(self, precision=None, simplify_tolerance=None, measure=True):
+        self.precision = precision
+        self.simplify_tolerance = simplify_tolerance
+        self.measure = measure
+        self.stats = {
+            'geometries': 0,
+            'bytes_before': 0,
+            'bytes_after': 0,
+        }
+        self._dumps = None
+        if measure:
+            from .sinks import _json_encoder
+            self._dumps = _json_encoder()
+
+    def reduce(self, features):
+        """Reduce the geometries of a page of GeoJSON features
+
+        Features are modified in place. Features without a geometry are
+        left as they are.
+
+        Returns:
+            list of the features
+        """
+        features = list(features)
+        reduced = [f for f in features if f.get('geometry')]
+        if not reduced:
+            return features
+
+        geometries = [f['geometry'] for f in reduced]
+        if self.measure:
+            self.stats['bytes_before'] += sum(
+                len(self._dumps(g)) for g in geometries)
+
+        if self.simplify_tolerance:
+            geometries = self._simplify(geometries)
+        if self.precision is not None:
+            geometries = [
+                dict(g, coordinates=_round(g['coordinates'], self.precision))
+                for g in geometries]
+
+        for feature, geometry in zip(reduced, geometries):
+            feature['geometry'] = geometry
+
+        self.stats['geometries'] += len(reduced)
+        if self.measure:
+            self.stats['bytes_after'] += sum(
+                len(self._dumps(g)) for g in geometries)
+        return features
+
+    def report(self):
+        """One-line summary of the bytes saved"""
+        before = self.stats['bytes_before']
+        after = self.stats['bytes_after']
+        msg = f'{self.stats["geometries"]} geometries'
+        if before:
+            msg += f', {_megabytes(before)} -> {_megabytes(after)} as JSON '
+            msg += f'({1 - after / before:.0%} saved)'
+        return msg
+
+    def _simplify(self, geometries):
+        # Points can't be simplified
+        if all(g['type'] == 'Point' for g in geometries):
+            return geometries
+
+        if SHAPELY_2:
+            geoms = shapely.simplify(
+                _geometry_array(geometries),
+                self.simplify_tolerance,
+                preserve_topology=True)
+        else:
+            geoms = [
+                shape(g).simplify(
+                    self.simplify_tolerance, preserve_topology=True)
+                for g in geometries]
+
+        return [mapping(g) for g in geoms]
+
+
+def _round(coords, ndigits):
+    """Round nested GeoJSON coordinates"""
+    if coords and isinstance(coords[0], (int, float)):
+        return [round(c, ndigits) for c in coords]
+    return [_round(c, ndigits) for c in coords]
+
+
+def _megabytes(n):
+    return f'{n / 1024 ** 2:.1f} MB'
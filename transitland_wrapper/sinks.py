@@ -0,0 +1,770 @@
+"""Write pages of results to files as they arrive
+
+Sinks take one page of results at a time, so a crawl can be written out while
+it runs. Newline-delimited JSON is written on a background thread, through a
+large buffer and optionally gzip or zstd compression. Results can also be
+written to columnar binary formats that are much smaller and faster to load:
+
+- `parquet`: GeoParquet
+- `arrow`: Arrow IPC file, also known as Feather
+- `flatgeobuf`: FlatGeobuf
+
+For these, each result becomes a row. Properties of GeoJSON features become
+typed columns, values that are objects or arrays are stored as JSON text, and
+the geometry is stored as WKB in a `geometry` column. Results are buffered
+until `row_group_size` of them have arrived, and then written as one row
+group, so memory is bounded by the row group size rather than by the size of
+the crawl.
+
+The columns and their types are settled before anything is written, so that
+the output is written once, in a single pass. They are either declared with
+`schema`, or inferred from the first `sample_size` results, which are held
+as row groups until then. Within the sample, a column that later results add,
+or values of a wider type, such as floats in a column of integers or booleans
+in a column that was all null, widen the schema. After it, results must fit
+the settled schema: columns that were all null in the sample are strings, and
+values that no column type can hold without loss, or columns the sample
+lacked, raise ValueError rather than being lost. Parquet and Arrow output
+require pyarrow, and FlatGeobuf output also requires pyogrio.
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import zlib
+from concurrent.futures import Future
+from itertools import islice
+
+from .tracing import span
+
+FORMATS = ['ndjson', 'parquet', 'arrow', 'flatgeobuf']
+
+# Format to use for each output file extension
+FORMAT_EXTENSIONS = {
+    '.parquet': 'parquet',
+    '.geoparquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+    '.fgb': 'flatgeobuf',
+}
+
+DEFAULT_ROW_GROUP_SIZE = 10000
+# Results the schema of binary output is inferred from before writing
+DEFAULT_SAMPLE_SIZE = 50000
+
+COMPRESSIONS = [None, 'gzip', 'zstd']
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.zst': 'zstd',
+}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# NDJSON output is written in writes of about this many bytes
+DEFAULT_BUFFER_SIZE = 1024 ** 2
+# Results handed to the NDJSON writer thread at once, and chunks queued
+WRITER_CHUNK_SIZE = 1000
+WRITER_QUEUE_SIZE = 8
+
+GEOMETRY_COLUMN = 'geometry'
+
+
+class Sink:
+    """Base class of output sinks
+
+    Sinks are context managers, which close the sink on exit.
+    """
+    def write(self, features):
+        """Write a page of results
+
+        Args:
+            - features: iterable of results
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """Write out all results so far
+
+        Returns:
+            size in bytes of the complete output so far, or None if the
+            output can't be resumed from that point
+        """
+        return None
+
+    def close(self):
+        """Write any buffered results and close the output"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class NDJSONSink(Sink):
+    """Write each result as a line of JSON
+
+    Results are serialized, compressed and written on a background thread, so
+    that writing doesn't hold up fetching. Lines are collected into buffers of
+    about `buffer_size` bytes, each written to the file in a single call.
+
+    Args:
+        - path: file to write to. If None, stdout.
+        - compress: None, `gzip` or `zstd`. By default inferred from the
+          extension of path. zstd requires zstandard.
+        - encoder: `json`, or `orjson` for a faster encoder. By default orjson
+          if it is installed.
+        - buffer_size: bytes of output to collect before each write
+        - offset: resume writing to an existing file at this byte offset,
+          as returned by `flush()`, truncating anything after it
+
+    Compressed output is a sequence of gzip members or zstd frames, one per
+    `flush()`, which standard tools read as a single stream. Each one ends
+    where the output can be resumed.
+    """
+    def __init__(
+            self,
+            path=None,
+            compress=None,
+            encoder=None,
+            buffer_size=DEFAULT_BUFFER_SIZE,
+            offset=None):
+        if compress is None:
+            compress = infer_compression(path)
+        if compress not in COMPRESSIONS:
+            raise ValueError(f'compress must be one of {COMPRESSIONS}')
+        if offset is not None and path is None:
+            raise ValueError('offset requires a path')
+
+        self.path = path
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self._dumps = _json_encoder(encoder)
+        self._compressor = _compressor(compress)
+        if path is None:
+            # Keep output already written through the text layer in order
+            sys.stdout.flush()
+            self._file = sys.stdout.buffer
+        elif offset is not None:
+            self._file = open(path, 'r+b')
+            size = self._file.seek(0, os.SEEK_END)
+            if size < offset:
+                self._file.close()
+                msg = f'{path} has {size} bytes, fewer than the offset '
+                msg += f'{offset} to resume from'
+                raise ValueError(msg)
+            self._file.seek(offset)
+            self._file.truncate()
+        else:
+            self._file = open(path, 'wb')
+        self._written = offset or 0
+
+        self._queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, features):
+        features = iter(features)
+        while True:
+            # Hand pages over in chunks, so that streamed pages stay bounded
+            chunk = list(islice(features, WRITER_CHUNK_SIZE))
+            if not chunk:
+                return
+            self._put(chunk)
+
+    def flush(self):
+        future = Future()
+        self._put(future)
+        return future.result()
+
+    def close(self):
+        if self._thread is None:
+            return
+
+        self._put(None)
+        self._thread.join()
+        self._thread = None
+        if self.path is not None:
+            self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def _put(self, chunk):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(chunk)
+
+    def _run(self):
+        buffer, size, chunk = [], 0, None
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Future):
+                    self._flush(buffer)
+                    buffer, size = [], 0
+                    chunk.set_result(self._written)
+                    continue
+
+                with span('serialize', results=len(chunk)):
+                    data = b'\n'.join(map(self._dumps, chunk)) + b'\n'
+                    if self._compressor is not None:
+                        data = self._compressor.compress(data)
+                    buffer.append(data)
+                    size += len(data)
+                    if size >= self.buffer_size:
+                        self._write(buffer)
+                        buffer, size = [], 0
+
+            self._flush(buffer)
+        except Exception as e:
+            self._error = e
+            if isinstance(chunk, Future):
+                chunk.set_exception(e)
+            # Unblock the producer
+            while chunk is not None:
+                chunk = self._queue.get()
+                if isinstance(chunk, Future):
+                    chunk.set_exception(e)
+
+    def _write(self, buffer):
+        data = b''.join(buffer)
+        self._file.write(data)
+        self._written += len(data)
+
+    def _flush(self, buffer):
+        """Write the buffer, ending the current gzip member or zstd frame"""
+        if self._compressor is not None:
+            buffer.append(self._compressor.flush())
+            self._compressor = _compressor(self.compress)
+        self._write(buffer)
+        self._file.flush()
+
+
+class ArrowSink(Sink):
+    """Write results to GeoParquet or an Arrow IPC file in row groups
+
+    Args:
+        - path: file to write to
+        - format: `parquet` or `arrow`
+        - row_group_size: number of results per row group
+        - schema: pyarrow.Schema of the output. By default inferred from the
+          first sample_size results.
+        - sample_size: number of results to infer the schema from, held in
+          memory as row groups until the schema is settled
+
+    Attributes:
+        - schema: schema of the output, or None until it is settled
+    """
+    def __init__(
+            self,
+            path,
+            format='parquet',
+            row_group_size=DEFAULT_ROW_GROUP_SIZE,
+            schema=None,
+            sample_size=DEFAULT_SAMPLE_SIZE):
+        if format not in ('parquet', 'arrow'):
+            raise ValueError(f'Invalid format for ArrowSink: {format}')
+
+        self.path = path
+        self.format = format
+        self.row_group_size = row_group_size
+        self.schema = schema
+        self.sample_size = sample_size
+        self._declared = schema is not None
+        # Row groups of the sample, and their schema with all-null columns
+        # still untyped
+        self._sample = []
+        self._sampled = 0
+        self._inferred = None
+        self._rows = []
+        self._row_groups = 0
+        self._writer = None
+        self._closed = False
+
+    def write(self, features):
+        self._rows.extend(features)
+        while len(self._rows) >= self.row_group_size:
+            rows = self._rows[:self.row_group_size]
+            del self._rows[:self.row_group_size]
+            self._add_rows(rows)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self._add_rows(rows)
+        if self.schema is None:
+            self._settle()
+        if not self._row_groups:
+            # Nothing was written; still leave a valid, empty file
+            pa = _import_pyarrow()
+            self._write_batch(pa.RecordBatch.from_pylist([], self.schema))
+        self._finish()
+
+    def _add_rows(self, rows):
+        if self.schema is None:
+            self._add_sample(rows)
+            return
+
+        with span('serialize', results=len(rows)):
+            batch = self._conform(_infer_record_batch(rows))
+        self._write_batch(batch)
+
+    def _add_sample(self, rows):
+        """Hold rows until the schema is settled, widening it to fit them"""
+        with span('serialize', results=len(rows)):
+            batch = _infer_record_batch(rows)
+            inferred = batch.schema
+            if self._inferred is not None:
+                inferred = _unify_schemas(self._inferred, inferred)
+        self._sample.append(batch)
+        self._sampled += len(rows)
+        self._inferred = inferred
+        if self._sampled >= self.sample_size:
+            self._settle()
+
+    def _settle(self):
+        """Settle the schema inferred from the sample, and write the sample"""
+        if self._inferred is None:
+            # No results
+            self._inferred = _infer_record_batch([]).schema
+        self.schema = _output_schema(self._inferred)
+        sample, self._sample = self._sample, []
+        for batch in sample:
+            with span('serialize', results=batch.num_rows):
+                batch = self._conform(batch)
+            self._write_batch(batch)
+
+    def _conform(self, batch):
+        try:
+            return _conform(batch, self.schema)
+        except ValueError as e:
+            if self._declared:
+                raise
+            raise ValueError(
+                f'{e}. The schema was inferred from the first '
+                f'{self._sampled} results; pass a schema, or a larger '
+                'sample_size')
+
+    def _write_batch(self, batch):
+        if self._writer is None:
+            self._writer = self._open_writer(batch.schema)
+        self._writer.write_batch(batch)
+        self._row_groups += 1
+
+    def _finish(self):
+        self._writer.close()
+        self._writer = None
+
+    def _open_writer(self, schema):
+        pa = _import_pyarrow()
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetWriter(self.path, _geoparquet_schema(schema))
+
+        return pa.ipc.new_file(self.path, schema)
+
+
+class FlatGeobufSink(ArrowSink):
+    """Write GeoJSON features to a FlatGeobuf file
+
+    Row groups are handed to pyogrio on a background thread as they fill up,
+    so that the file is written in a single pass.
+
+    Args:
+        - path: file to write to
+        - row_group_size: number of features buffered before writing
+        - schema, sample_size: schema of the output, or number of features to
+          infer it from. See `ArrowSink`.
+    """
+    def __init__(
+            self,
+            path,
+            row_group_size=DEFAULT_ROW_GROUP_SIZE,
+            schema=None,
+            sample_size=DEFAULT_SAMPLE_SIZE):
+        super().__init__(
+            path,
+            row_group_size=row_group_size,
+            schema=schema,
+            sample_size=sample_size)
+        self.format = 'flatgeobuf'
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = None
+        self._error = None
+
+    def _write_batch(self, batch):
+        if GEOMETRY_COLUMN not in batch.schema.names:
+            raise ValueError('FlatGeobuf output requires GeoJSON features')
+        if self._thread is None:
+            self._start(batch)
+        self._put(batch)
+        self._row_groups += 1
+
+    def _finish(self):
+        self._put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _start(self, batch):
+        pa = _import_pyarrow()
+        pyogrio = _import_pyogrio()
+        types = {t for t in _geometry_types(batch) if t}
+        geometry_type = types.pop() if len(types) == 1 else 'Unknown'
+
+        def batches():
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    return
+                yield batch
+
+        reader = pa.RecordBatchReader.from_batches(batch.schema, batches())
+
+        def run():
+            try:
+                pyogrio.write_arrow(
+                    reader,
+                    self.path,
+                    driver='FlatGeobuf',
+                    geometry_name=GEOMETRY_COLUMN,
+                    geometry_type=geometry_type,
+                    crs='EPSG:4326')
+            except Exception as e:
+                self._error = e
+                # Unblock the producer
+                while self._queue.get() is not None:
+                    pass
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def _put(self, batch):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(batch)
+
+
+def open_sink(
+        path=None,
+        format=None,
+        row_group_size=DEFAULT_ROW_GROUP_SIZE,
+        compress=None,
+        encoder=None,
+        offset=None,
+        schema=None,
+        sample_size=DEFAULT_SAMPLE_SIZE):
+    """Create a sink for an output path
+
+    Args:
+        - path: file to write to. If None, NDJSON is written to stdout.
+        - format: one of FORMATS. By default inferred from the extension of
+          path, or NDJSON.
+        - row_group_size: number of results per row group, for binary formats
+        - compress, encoder: compression and JSON encoder of NDJSON output.
+          See `NDJSONSink`.
+        - offset: resume writing an existing NDJSON file at this offset. See
+          `NDJSONSink`.
+        - schema, sample_size: schema of binary output, or number of results
+          to infer it from. See `ArrowSink`.
+
+    Returns:
+        Sink
+    """
+    if format is None:
+        format = infer_format(path)
+    if format not in FORMATS:
+        raise ValueError(f'format must be one of {FORMATS}')
+
+    if format == 'ndjson':
+        return NDJSONSink(
+            path, compress=compress, encoder=encoder, offset=offset)
+
+    if offset is not None:
+        raise ValueError('Only ndjson output can be resumed')
+
+    if compress is not None:
+        raise ValueError('compress is only supported for ndjson output')
+    if path is None:
+        raise ValueError(f'{format} output must be written to a file')
+    if format == 'flatgeobuf':
+        return FlatGeobufSink(
+            path,
+            row_group_size=row_group_size,
+            schema=schema,
+            sample_size=sample_size)
+    return ArrowSink(
+        path,
+        format=format,
+        row_group_size=row_group_size,
+        schema=schema,
+        sample_size=sample_size)
+
+
+def infer_format(path):
+    """Output format for a path's extension, by default NDJSON"""
+    if path is None:
+        return 'ndjson'
+    ext = os.path.splitext(path)[1].lower()
+    return FORMAT_EXTENSIONS.get(ext, 'ndjson')
+
+
+def infer_compression(path):
+    """Compression for a path's extension, or None"""
+    if path is None:
+        return None
+    ext = os.path.splitext(path)[1].lower()
+    return COMPRESSION_EXTENSIONS.get(ext)
+
+
+def write_pages(pages, sink, checkpoint=None):
+    """Write pages of results to a sink, and close it
+
+    Args:
+        - checkpoint: Checkpoint of the crawl producing pages. The sink is
+          flushed after each page, and the size of its output recorded in the
+          checkpoint before the next page is requested.
+    """
+    with sink:
+        for features in pages:
+            sink.write(features)
+            if checkpoint is not None:
+                checkpoint.output_offset = sink.flush()
+
+
+def to_record_batch(rows, schema=None):
+    """Convert results to an Arrow record batch
+
+    GeoJSON features are flattened, with their properties as columns and
+    their geometry as WKB. Values that are objects or arrays are converted to
+    JSON text.
+
+    Args:
+        - rows: list of results
+        - schema: schema to convert to. Its columns missing from rows are
+          null. By default inferred from rows, with columns that are entirely
+          null typed as strings.
+
+    Returns:
+        pyarrow.RecordBatch
+
+    Raises:
+        ValueError: rows have columns not in schema, or values its types can't
+        hold without loss
+    """
+    batch = _infer_record_batch(rows)
+    if schema is None:
+        schema = _output_schema(batch.schema)
+    return _conform(batch, schema)
+
+
+def _infer_record_batch(rows):
+    """Convert results to a record batch, leaving all-null columns untyped"""
+    pa = _import_pyarrow()
+    records = _flatten(rows)
+    # from_pylist only takes the columns of the first record
+    names = list(dict.fromkeys(key for record in records for key in record))
+    columns = {name: [r.get(name) for r in records] for name in names}
+    batch = pa.RecordBatch.from_pydict(columns)
+    fields = []
+    for field in batch.schema:
+        if field.name == GEOMETRY_COLUMN:
+            field = field.with_type(pa.binary()).with_metadata({
+                'ARROW:extension:name': 'geoarrow.wkb',
+                'ARROW:extension:metadata': '{}'})
+        fields.append(field)
+
+    if not fields and not records:
+        fields = [pa.field(GEOMETRY_COLUMN, pa.binary())]
+        columns = {GEOMETRY_COLUMN: []}
+    return pa.RecordBatch.from_pydict(columns, schema=pa.schema(fields))
+
+
+def _output_schema(schema):
+    """Schema to write, with untyped all-null columns typed as strings"""
+    pa = _import_pyarrow()
+    return pa.schema([
+        field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+        for field in schema], metadata=schema.metadata)
+
+
+def _unify_schemas(schema, other):
+    """Widen schema to also hold the columns and types of other"""
+    pa = _import_pyarrow()
+    try:
+        return pa.unify_schemas([schema, other], promote_options='permissive')
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise ValueError(
+            f'results have values of incompatible types in one column: {e}')
+
+
+def _conform(batch, schema):
+    """Cast a record batch to schema
+
+    Columns of schema missing from batch are filled with nulls. Casts are
+    safe, so values that would be truncated raise instead.
+    """
+    pa = _import_pyarrow()
+    extra = set(batch.schema.names) - set(schema.names)
+    if extra:
+        raise ValueError(
+            f'results have columns not in the schema: {sorted(extra)}')
+
+    columns = []
+    for field in schema:
+        i = batch.schema.get_field_index(field.name)
+        if i < 0 or batch.column(i).null_count == batch.num_rows:
+            columns.append(pa.nulls(batch.num_rows, field.type))
+            continue
+
+        try:
+            columns.append(batch.column(i).cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(
+                f'column {field.name!r} cannot be stored as {field.type}: {e}')
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _flatten(rows):
+    """Convert results to flat dicts of scalar values"""
+    geojson = bool(rows) and rows[0].get('type') == 'Feature'
+    if geojson:
+        wkbs = _to_wkb([row.get('geometry') for row in rows])
+
+    records = []
+    for i, row in enumerate(rows):
+        if geojson:
+            record = {
+                k: v
+                for k, v in row.items()
+                if k not in ('type', 'geometry', 'properties')}
+            record.update(row.get('properties') or {})
+            record[GEOMETRY_COLUMN] = wkbs[i]
+        else:
+            record = dict(row)
+
+        for key, value in record.items():
+            if isinstance(value, (dict, list)):
+                record[key] = json.dumps(value, separators=(',', ':'))
+        records.append(record)
+
+    return records
+
+
+def _to_wkb(geometries):
+    """Convert GeoJSON geometries to WKB, keeping None for missing ones"""
+    present = [i for i, g in enumerate(geometries) if g]
+    wkbs = [None] * len(geometries)
+    if not present:
+        return wkbs
+
+    from .filtering import SHAPELY_2
+    if SHAPELY_2:
+        import shapely
+
+        from .filtering import _geometry_array
+        geoms = _geometry_array([geometries[i] for i in present])
+        values = shapely.to_wkb(geoms)
+    else:
+        from shapely.geometry import shape
+        values = [shape(geometries[i]).wkb for i in present]
+
+    for i, value in zip(present, values):
+        wkbs[i] = value
+    return wkbs
+
+
+def _geometry_types(batch):
+    from .filtering import SHAPELY_2
+    if SHAPELY_2:
+        import shapely
+        geoms = shapely.from_wkb(batch.column(GEOMETRY_COLUMN).to_pylist())
+        return [g.geom_type if g is not None else None for g in geoms]
+
+    from shapely import wkb
+    return [
+        wkb.loads(v).geom_type if v is not None else None
+        for v in batch.column(GEOMETRY_COLUMN).to_pylist()]
+
+
+def _geoparquet_schema(schema):
+    """Add GeoParquet metadata to a schema with a WKB geometry column"""
+    if GEOMETRY_COLUMN not in schema.names:
+        return schema
+
+    geo = {
+        'version': '1.0.0',
+        'primary_column': GEOMETRY_COLUMN,
+        'columns': {
+            GEOMETRY_COLUMN: {
+                'encoding': 'WKB',
+                'geometry_types': [],
+            },
+        },
+    }
+    metadata = dict(schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geo).encode()
+    return schema.with_metadata(metadata)
+
+
+def _json_encoder(encoder=None):
+    """Function serializing a result to compact JSON bytes"""
+    if encoder in (None, 'orjson'):
+        try:
+            import orjson
+            return orjson.dumps
+        except ImportError:
+            if encoder == 'orjson':
+                raise
+    if encoder in (None, 'json'):
+        return lambda obj: json.dumps(obj, separators=(',', ':')).encode()
+
+    raise ValueError(f'encoder must be json or orjson, not {encoder}')
+
+
+def _compressor(compress):
+    """Streaming compressor with `compress` and `flush` methods, or None"""
+    if compress is None:
+        return None
+    if compress == 'gzip':
+        # wbits of 31 writes a gzip header and trailer
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    try:
+        import zstandard
+    except ImportError:
+        msg = 'zstandard is required for zstd compression. Install it with:\n'
+        msg += 'pip install transitland_wrapper[zstd]'
+        raise ImportError(msg)
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        msg = 'pyarrow is required for Parquet, Arrow and FlatGeobuf output. '
+        msg += 'Install it with:\npip install transitland_wrapper[arrow]'
+        raise ImportError(msg)
+
+    return pyarrow
+
+
+def _import_pyogrio():
+    try:
+        import pyogrio
+    except ImportError:
+        msg = 'pyogrio is required for FlatGeobuf output. Install it with:\n'
+        msg += 'pip install transitland_wrapper[arrow]'
+        raise ImportError(msg)
+
+    return pyogrio
@@ -0,0 +1,98 @@
+"""Incremental parsing of large response pages
+
+With a large `per_page` and route geometries included, a single page can be
+tens of MB, which would otherwise sit in memory both as raw bytes and as a
+fully parsed dict. In streaming mode, the results array of each response is
+parsed from the network stream one item at a time, so peak memory stays
+around one feature plus read buffers, whatever the page size.
+
+Requires ijson, which can be installed with
+`pip install transitland_wrapper[stream]`.
+"""
+import io
+from itertools import islice
+
+from .transitland import ALL_ENDPOINT_TYPES
+
+# Number of features processed at once in streaming mode
+BATCH_SIZE = 256
+
+
+def iter_page(endpoint, response, meta):
+    """Parse the results of a response one at a time
+
+    Args:
+        - endpoint: endpoint the response is from
+        - response: a requests.Response sent with `stream=True`, or any
+          response with a `content` attribute
+        - meta: dict that is filled in with the response's meta once it has
+          been parsed. transit.land sends meta after the results, so it is
+          only complete once the generator is exhausted.
+
+    Yields:
+        each item of the response's results array
+    """
+    ijson = _import_ijson()
+    if ALL_ENDPOINT_TYPES[endpoint] == '.geojson':
+        item_prefix = 'features.item'
+    else:
+        item_prefix = f'{endpoint}.item'
+
+    builder, builder_prefix = None, None
+    for prefix, event, value in ijson.parse(
+            _response_stream(response), use_float=True):
+        if builder is None:
+            if prefix in (item_prefix, 'meta') and event == 'start_map':
+                builder = ijson.common.ObjectBuilder()
+                builder_prefix = prefix
+            else:
+                continue
+
+        builder.event(event, value)
+        if prefix == builder_prefix and event == 'end_map':
+            if builder_prefix == 'meta':
+                meta.update(builder.value)
+            else:
+                yield builder.value
+            builder = None
+
+
+def map_batches(features, func, batch_size=BATCH_SIZE):
+    """Apply a function taking a page of features to an iterator of features,
+    in small batches
+
+    Args:
+        - features: iterable of features
+        - func: function taking a list of features and returning an iterable
+          of features, such as `IntersectionFilter.filter`
+    """
+    features = iter(features)
+    while True:
+        batch = list(islice(features, batch_size))
+        if not batch:
+            return
+
+        for feature in func(batch):
+            yield feature
+
+
+def _response_stream(response):
+    raw = getattr(response, 'raw', None)
+    if raw is not None:
+        # Let urllib3 undo any gzip encoding
+        raw.decode_content = True
+        return raw
+
+    return io.BytesIO(response.content)
+
+
+def _import_ijson():
+    try:
+        import ijson
+        import ijson.common
+    except ImportError:
+        msg = 'ijson is required for streaming mode. Install it with:\n'
+        msg += 'pip install transitland_wrapper[stream]'
+        raise ImportError(msg)
+
+    return ijson
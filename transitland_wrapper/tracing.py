@@ -0,0 +1,280 @@
+"""Trace where the time of a crawl goes
+
+With tracing turned on by `configure_tracing()`, the phases of a crawl are
+recorded as spans, each with a start, a duration and the thread it ran on:
+
+- `load_geometry`: reading a geometry file on the CLI
+- `fetch`: sending a request and downloading its response, with retries
+- `parse`: decoding the JSON of a response
+- `filter`, `project`, `simplify`: the steps `base()` applies to each page
+- `serialize`: encoding and writing output, on the writer thread
+
+`Tracer.report()` sums spans by phase, and `Tracer.write_chrome_trace()`
+writes them in the Trace Event Format, which chrome://tracing and
+https://ui.perfetto.dev display as a timeline.
+
+A `Sampler` complements spans with a statistical profile: a background thread
+records the function every other thread is running at regular intervals,
+which points to the hot functions within a phase. Threads blocked waiting on
+another thread, such as idle workers, are left out.
+
+Tracing is off by default, and `span()` then does nothing.
+"""
+import json
+import os
+import sys
+import threading
+from collections import Counter, defaultdict
+from time import perf_counter
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+class Tracer:
+    """Record spans from any thread
+
+    Attributes:
+        - spans: list of (name, start, duration, thread id, args) tuples, in
+          seconds since the tracer was created
+    """
+    def __init__(self):
+        self.started = perf_counter()
+        self.spans = []
+
+    def span(self, name, **args):
+        """Context manager recording a span around its block
+
+        Args:
+            - name: name of the phase
+            - args: values to show with the span in a trace viewer
+        """
+        return _Span(self, name, args)
+
+    def report(self):
+        """Multi-line summary of the time spent in each phase
+
+        Spans of the same phase on different threads overlap, so their total
+        can exceed the wall time.
+        """
+        wall = perf_counter() - self.started
+        totals = defaultdict(float)
+        counts = Counter()
+        for name, _, duration, _, _ in self.spans:
+            totals[name] += duration
+            counts[name] += 1
+
+        lines = [f'{"phase":<16} {"count":>7} {"total s":>9} {"mean ms":>9} '
+                 f'{"% wall":>7}']
+        for name in sorted(totals, key=totals.get, reverse=True):
+            lines.append(
+                f'{name:<16} {counts[name]:>7} {totals[name]:>9.3f} '
+                f'{totals[name] / counts[name] * 1000:>9.2f} '
+                f'{totals[name] / wall:>7.1%}')
+        lines.append(f'{"wall":<16} {"":>7} {wall:>9.3f}')
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        """Spans as a dict in the Trace Event Format"""
+        pid = os.getpid()
+        events = [{
+            'name': name,
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': duration * 1e6,
+            'pid': pid,
+            'tid': tid,
+            'args': args,
+        } for name, start, duration, tid, args in self.spans]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter()
+        self.tracer.spans.append((
+            self.name,
+            self.start - self.tracer.started,
+            end - self.start,
+            threading.get_ident(),
+            self.args))
+
+
+class _NullSpan:
+    """Span that records nothing, used while tracing is off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Sampler:
+    """Sample the running function of every thread at an interval
+
+    Args:
+        - interval: seconds between samples
+
+    Attributes:
+        - samples: number of samples taken of threads that weren't idle
+        - idle: number of samples of threads waiting on another thread
+    """
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0
+        self._self = Counter()
+        self._total = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                if _is_idle(frame):
+                    self.idle += 1
+                    continue
+                self.samples += 1
+                self._self[_frame_key(frame)] += 1
+                # Count each function once per sample, however deep
+                seen = set()
+                while frame is not None:
+                    key = _frame_key(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        self._total[key] += 1
+                    frame = frame.f_back
+
+    def report(self, n=20):
+        """The n functions most often running, with their share of samples
+
+        `self` counts samples in the function itself, `total` also counts
+        samples in the functions it called.
+        """
+        if not self.samples:
+            return 'no samples'
+
+        lines = [f'{"self":>6} {"total":>6}  function']
+        for key, count in self._self.most_common(n):
+            filename, lineno, name = key
+            lines.append(
+                f'{count / self.samples:>6.1%} '
+                f'{self._total[key] / self.samples:>6.1%}  '
+                f'{name} ({_short_path(filename)}:{lineno})')
+        lines.append(
+            f'{self.samples} samples of all threads, {self.idle} idle '
+            f'samples left out')
+        return '\n'.join(lines)
+
+
+def _is_idle(frame):
+    """Whether a thread is blocked on a lock, condition or event"""
+    code = frame.f_code
+    return (
+        code.co_name in ('wait', '_wait_for_tstate_lock')
+        and code.co_filename == threading.__file__)
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def _short_path(filename):
+    """Path relative to the package or site-packages, for readability"""
+    for marker in ('site-packages' + os.sep, 'transitland_wrapper' + os.sep):
+        i = filename.rfind(marker)
+        if i >= 0:
+            if marker.startswith('transitland_wrapper'):
+                return filename[i:]
+            return filename[i + len(marker):]
+    return filename
+
+
+def traced(name, func):
+    """Wrap func to record a span around each call, if tracing is on"""
+    tracer = get_tracer()
+    if tracer is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        with tracer.span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def span(name, **args):
+    """Record a span with the shared tracer, if tracing is on
+
+    Returns:
+        context manager
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, **args)
+
+
+def configure_tracing():
+    """Turn on shared tracing
+
+    Returns:
+        the new shared Tracer
+    """
+    global _tracer
+    with _tracer_lock:
+        _tracer = Tracer()
+        return _tracer
+
+
+def disable_tracing():
+    """Turn off shared tracing"""
+    global _tracer
+    with _tracer_lock:
+        _tracer = None
+
+
+def get_tracer():
+    """Get the shared tracer, or None if tracing is off"""
+    return _tracer
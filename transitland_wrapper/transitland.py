@@ -1,18 +1,33 @@
+import queue
 import sys
+import threading
+from collections import deque
 from collections.abc import Iterable
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ThreadPoolExecutor, wait)
 from datetime import datetime
-from time import sleep
+from functools import partial
+from itertools import islice
+from time import monotonic, sleep
 
-import requests
-from shapely.geometry import asShape
-from shapely.prepared import prep
+from .autotune import PageSizeTuner, with_per_page
+from .cache import cache_key, geometry_bounds, get_cache, get_lookup_cache
+from .checkpoint import Checkpoint
+from .exceptions import (
+    DeadlineExceeded, HTTPStatusError, RetryError, TransitlandError)
+from .metrics import (
+    RequestRecord, get_metrics, record_page, record_stream_page)
+from .ratelimit import get_rate_limiter
+from .retry import get_circuit_breaker, get_retry_policy
+from .session import BASE_URL, get_session
+from .tracing import span, traced
 
 ALLOWED_GEOMETRY_INTERSECTION_TYPES = [
     'Polygon',
     'MultiPolygon',
     'LineString',
     'MultiLineString',
-] # yapf: disable
+]  # yapf: disable
 
 # Endpoint and whether it accepts GeoJSON responses
 ALL_ENDPOINT_TYPES = {
@@ -25,6 +40,83 @@ ALL_ENDPOINT_TYPES = {
     'feeds': '.geojson',
 }
 
+# Parameters accepted by each endpoint function
+ENDPOINT_KEYS = {
+    'stops': [
+        'geometry',
+        'radius',
+        'served_by',
+        'gtfs_id',
+        'per_page',
+        'page_all',
+    ],
+    'operators': [
+        'geometry',
+        'radius',
+        'gtfs_id',
+        'per_page',
+        'page_all',
+    ],
+    'routes': [
+        'geometry',
+        'radius',
+        'operated_by',
+        'vehicle_type',
+        'include_geometry',
+        'gtfs_id',
+        'per_page',
+        'page_all',
+    ],
+    'route_stop_patterns': [
+        'geometry',
+        'traversed_by',
+        'stops_visited',
+        'trips',
+        'per_page',
+        'page_all',
+    ],
+    'schedule_stop_pairs': [
+        'geometry',
+        'origin_onestop_id',
+        'destination_onestop_id',
+        'date',
+        'service_from_date',
+        'service_before_date',
+        'origin_departure_between',
+        'trip',
+        'route_onestop_id',
+        'operator_onestop_id',
+        'active',
+        'per_page',
+        'page_all',
+    ],
+    'feeds': [
+        'geometry',
+        'per_page',
+        'page_all',
+    ],
+}
+
+# Parameters accepted by every endpoint function, in addition to the
+# endpoint-specific ones
+COMMON_KEYS = [
+    'session',
+    'workers',
+    'ordered',
+    'prefetch',
+    'shard',
+    'cover',
+    'stream',
+    'precision',
+    'simplify_tolerance',
+    'fields',
+    'limit',
+    'resume_from',
+]
+
+# Marks the end of an iterator, or a value missing from a cache
+_DONE = object()
+
 
 def stops(**kwargs):
     """Request stops info
@@ -38,15 +130,11 @@ def stops(**kwargs):
           geometries. Not used for Polygon geometries.
         - served_by: search by operator onestop_id or route onestop_id
         - gtfs_id: ID used in a GTFS feed's stops.txt file
-        - per_page: number of results per page, by default 50
+        - per_page: number of results per page, by default 50, or 'auto' to
+          tune the page size while paging
         - page_all: page over all responses
     """
-    allowed_keys = [
-        'geometry', 'radius', 'served_by', 'gtfs_id', 'per_page', 'page_all'
-    ]
-    if any(k not in allowed_keys for k in kwargs.keys()):
-        msg = f'invalid parameter; allowed parameters are:\n{allowed_keys}'
-        raise ValueError(msg)
+    _check_keys(kwargs, ENDPOINT_KEYS['stops'])
     return base(endpoint='stops', **kwargs)
 
 
@@ -61,13 +149,11 @@ def operators(**kwargs):
         - radius: radius in meters to search around, default 100m for Point
           geometries. Not used for Polygon geometries.
         - gtfs_id: ID used in a GTFS feed's agencies.txt file
-        - per_page: number of results per page, by default 50
+        - per_page: number of results per page, by default 50, or 'auto' to
+          tune the page size while paging
         - page_all: page over all responses
     """
-    allowed_keys = ['geometry', 'radius', 'gtfs_id', 'per_page', 'page_all']
-    if any(k not in allowed_keys for k in kwargs.keys()):
-        msg = f'invalid parameter; allowed parameters are:\n{allowed_keys}'
-        raise ValueError(msg)
+    _check_keys(kwargs, ENDPOINT_KEYS['operators'])
 
     return base(endpoint='operators', **kwargs)
 
@@ -88,22 +174,11 @@ def routes(**kwargs):
           column and the Extended GTFS Route Types.
         - include_geometry: If True, includes route geometry. Default: True
         - gtfs_id: ID used in a GTFS feed's routes.txt file
-        - per_page: number of results per page, by default 50
+        - per_page: number of results per page, by default 50, or 'auto' to
+          tune the page size while paging
         - page_all: page over all responses
     """
-    allowed_keys = [
-        'geometry',
-        'radius',
-        'operated_by',
-        'vehicle_type',
-        'include_geometry',
-        'gtfs_id',
-        'per_page',
-        'page_all',
-    ]
-    if any(k not in allowed_keys for k in kwargs.keys()):
-        msg = f'invalid parameter; allowed parameters are:\n{allowed_keys}'
-        raise ValueError(msg)
+    _check_keys(kwargs, ENDPOINT_KEYS['routes'])
 
     return base(endpoint='routes', **kwargs)
 
@@ -117,22 +192,15 @@ def route_stop_patterns(**kwargs):
           will be done by bounding box, and then results will be filtered for
           intersection.
         - traversed_by: find all Route Stop Patterns belonging to route
-        - stops_visited: any one or more stop Onestop IDs, separated by comma. Finds Route Stop Patterns with stops_visited in stop_pattern.
-        - trips: any one or more trip ids, separated by comma. Finds Route Stop Patterns with specified trips in trips.
-        - per_page: number of results per page, by default 50
+        - stops_visited: any one or more stop Onestop IDs, separated by comma.
+          Finds Route Stop Patterns with stops_visited in stop_pattern.
+        - trips: any one or more trip ids, separated by comma. Finds Route
+          Stop Patterns with specified trips in trips.
+        - per_page: number of results per page, by default 50, or 'auto' to
+          tune the page size while paging
         - page_all: page over all responses
     """
-    allowed_keys = [
-        'geometry',
-        'traversed_by',
-        'stops_visited',
-        'trips',
-        'per_page',
-        'page_all',
-    ]
-    if any(k not in allowed_keys for k in kwargs.keys()):
-        msg = f'invalid parameter; allowed parameters are:\n{allowed_keys}'
-        raise ValueError(msg)
+    _check_keys(kwargs, ENDPOINT_KEYS['route_stop_patterns'])
 
     return base(endpoint='route_stop_patterns', **kwargs)
 
@@ -145,56 +213,143 @@ def schedule_stop_pairs(**kwargs):
           the geometry. If a Polygon or MultiPolygon is provided, the search
           will be done by bounding box, and then results will be filtered for
           intersection.
-        - origin_onestop_id: Find all Schedule Stop Pairs from origin. Accepts multiple Onestop IDs, separated by commas
-        - destination_onestop_id: Find all Schedule Stop Pairs to a destination. Accepts multiple Onestop IDs, separated by commas
+        - origin_onestop_id: Find all Schedule Stop Pairs from origin.
+          Accepts multiple Onestop IDs, separated by commas
+        - destination_onestop_id: Find all Schedule Stop Pairs to a
+          destination. Accepts multiple Onestop IDs, separated by commas
         - date: Find all Schedule Stop Pairs from origin on date
         - service_from_date: Find all Schedule Stop Pairs in effect from a date
-        - service_before_date: Find all Schedule Stop Pairs in effect before a date
-        - origin_departure_between: Find all Schedule Stop Pairs with origin_departure_time in a range
+        - service_before_date: Find all Schedule Stop Pairs in effect before a
+          date
+        - origin_departure_between: Find all Schedule Stop Pairs with
+          origin_departure_time in a range
         - trip: Find all Schedule Stop Pairs by trip identifier
-        - route_onestop_id: Find all Schedule Stop Pairs by route. Accepts multiple Onestop IDs, separated by commas.
-        - operator_onestop_id: Find all Schedule Stop Pairs by operator. Accepts multiple Onestop IDs, separated by commas.
+        - route_onestop_id: Find all Schedule Stop Pairs by route. Accepts
+          multiple Onestop IDs, separated by commas.
+        - operator_onestop_id: Find all Schedule Stop Pairs by operator.
+          Accepts multiple Onestop IDs, separated by commas.
         - active: Schedule Stop Pairs from active FeedVersions
-        - per_page: number of results per page, by default 50
+        - per_page: number of results per page, by default 50, or 'auto' to
+          tune the page size while paging
         - page_all: page over all responses
     """
-    allowed_keys = [
-        'geometry',
-        'origin_onestop_id',
-        'destination_onestop_id',
-        'date',
-        'service_from_date',
-        'service_before_date',
-        'origin_departure_between',
-        'trip',
-        'route_onestop_id',
-        'operator_onestop_id',
-        'active',
-        'per_page',
-        'page_all',
-    ]
-    if any(k not in allowed_keys for k in kwargs.keys()):
-        msg = f'invalid parameter; allowed parameters are:\n{allowed_keys}'
-        raise ValueError(msg)
+    _check_keys(kwargs, ENDPOINT_KEYS['schedule_stop_pairs'])
 
-    # Validate dates
-    date_keys = ['date', 'service_from_date', 'service_before_date']
-    for key, val in kwargs.items():
-        if key in date_keys:
-            if val:
-                validate_date(val)
+    _validate_dates(kwargs)
 
     return base(endpoint='schedule_stop_pairs', **kwargs)
 
 
-def onestop_id(oid):
+def onestop_id(oid, session=None):
     """Request onestop_id info
 
     Args:
         - oid: a Onestop ID for any type of entity (for example, a stop or an
           operator)
+        - session: requests.Session to use. By default the shared session
+          from `transitland_wrapper.session`.
     """
-    return _request_transit_land('onestop_id', params={'id': oid})
+    return _request_transit_land(
+        'onestop_id', params={'id': oid}, session=session)
+
+
+def onestop_ids(oids, workers=4, ordered=True, session=None):
+    """Request onestop_id info for many Onestop IDs
+
+    Each distinct ID is requested once: repeated IDs share the request in
+    flight, and IDs looked up before are answered from the in-memory cache in
+    `transitland_wrapper.cache.get_lookup_cache()`. Other IDs are requested
+    by up to `workers` threads at once, within the rate limit.
+
+    Args:
+        - oids: iterable of Onestop IDs. Read lazily, so it can be a file.
+        - workers: number of IDs to request at once
+        - ordered: if True, yield results in input order. Otherwise yield
+          them as they complete.
+        - session: requests.Session to use. By default the shared session
+          from `transitland_wrapper.session`.
+
+    Returns:
+        generator of (oid, result) tuples, one for each item of oids. result
+        is None for IDs unknown to transit.land.
+    """
+    lookup_cache = get_lookup_cache()
+
+    def fetch(oid):
+        url = _endpoint_url('onestop_id', {'id': oid})
+        try:
+            return _get_json(url, session=session)
+        except HTTPStatusError as e:
+            if e.status_code != 404:
+                raise
+            return None
+
+    # Bound how far reading runs ahead of the oldest unanswered ID
+    max_waiting = workers * 16
+    oids = iter(oids)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    in_flight = {}
+    # In input order: (oid, result or future)
+    waiting = deque()
+    # Out of order: number of occurrences of each ID in flight
+    counts = {}
+    exhausted = False
+    try:
+        while True:
+            while (not exhausted and len(in_flight) < workers
+                   and len(waiting) < max_waiting):
+                oid = next(oids, _DONE)
+                if oid is _DONE:
+                    exhausted = True
+                    break
+
+                future = in_flight.get(oid)
+                if future is None:
+                    result = lookup_cache.get(oid, _DONE)
+                    if result is not _DONE:
+                        if ordered:
+                            waiting.append((oid, result))
+                        else:
+                            yield oid, result
+                        continue
+
+                    future = executor.submit(fetch, oid)
+                    in_flight[oid] = future
+
+                if ordered:
+                    waiting.append((oid, future))
+                else:
+                    counts[oid] = counts.get(oid, 0) + 1
+
+            if ordered:
+                if not waiting:
+                    break
+
+                oid, result = waiting.popleft()
+                if isinstance(result, Future):
+                    result = result.result()
+                    if in_flight.pop(oid, None) is not None:
+                        lookup_cache.set(oid, result)
+                yield oid, result
+                continue
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight.values(), return_when=FIRST_COMPLETED)
+            for oid, future in list(in_flight.items()):
+                if future not in done:
+                    continue
+
+                result = future.result()
+                lookup_cache.set(oid, result)
+                del in_flight[oid]
+                for _ in range(counts.pop(oid)):
+                    yield oid, result
+    finally:
+        for future in in_flight.values():
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
 def feeds(**kwargs):
@@ -206,28 +361,161 @@ def feeds(**kwargs):
           will be done by bounding box, and then results will be filtered for
           intersection.
     """
-    allowed_keys = [
-        'geometry',
-        'per_page',
-        'page_all',
-    ]
-    if any(k not in allowed_keys for k in kwargs.keys()):
-        msg = f'invalid parameter; allowed parameters are:\n{allowed_keys}'
-        raise ValueError(msg)
+    _check_keys(kwargs, ENDPOINT_KEYS['feeds'])
 
     return base(endpoint='feeds', **kwargs)
 
 
 def base(
         endpoint,
+        geometry=None,
+        page_all=True,
+        session=None,
+        workers=1,
+        ordered=True,
+        prefetch=0,
+        shard=None,
+        cover=None,
+        stream=False,
+        per_page=50,
+        precision=None,
+        simplify_tolerance=None,
+        fields=None,
+        limit=None,
+        resume_from=None,
+        **kwargs):
+    geometry_filter = _prepare_filter(endpoint, geometry)
+    tuner = None
+    if per_page == 'auto':
+        per_page = PageSizeTuner()
+    if isinstance(per_page, PageSizeTuner):
+        tuner, per_page = per_page, per_page.per_page
+        if workers > 1 or shard:
+            msg = "per_page='auto' cannot be used with workers or shard"
+            raise ValueError(msg)
+    elif limit is not None and geometry_filter is None:
+        # Every result counts toward the limit, so don't request more
+        per_page = max(1, min(per_page, limit))
+
+    params = _build_params(geometry=geometry, per_page=per_page, **kwargs)
+    reducer = _prepare_reducer(precision, simplify_tolerance)
+    if stream and (workers > 1 or prefetch or shard or cover):
+        msg = 'stream cannot be used with workers, prefetch, shard or cover'
+        raise ValueError(msg)
+    checkpoint, resume_url = _prepare_resume(
+        endpoint, params, resume_from, page_all=page_all)
+    if checkpoint is not None or resume_url is not None:
+        if workers > 1 or prefetch or shard or cover or limit is not None:
+            msg = 'resume_from cannot be used with workers, prefetch, shard, '
+            msg += 'cover or limit'
+            raise ValueError(msg)
+        if checkpoint is not None and checkpoint.complete:
+            return
+
+    if shard or cover:
+        if (geometry is None
+                or geometry.type not in ALLOWED_GEOMETRY_INTERSECTION_TYPES):
+            msg = 'shard and cover require a geometry of type '
+            msg += f'{ALLOWED_GEOMETRY_INTERSECTION_TYPES}'
+            raise ValueError(msg)
+        if shard and cover:
+            raise ValueError('shard and cover cannot be used together')
+        if shard and not page_all:
+            # Tiles are split by their total number of results
+            raise ValueError('shard requires page_all')
+
+    if cover:
+        from .planner import Cover, plan_cover
+        from .sharding import deduplicate_pages
+        if not isinstance(cover, Cover):
+            cover = plan_cover(geometry) if cover is True else plan_cover(
+                geometry, max_boxes=cover)
+
+        def request_box(bounds):
+            box_params = dict(params, bbox=','.join(map(str, bounds)))
+            return _request_transit_land(
+                endpoint,
+                params=box_params,
+                page_all=page_all,
+                session=session,
+                workers=workers,
+                ordered=ordered,
+                tuner=tuner)
+
+        features_iter = deduplicate_pages(
+            page for bounds in cover.boxes for page in request_box(bounds))
+    elif shard:
+        from .sharding import request_sharded
+        features_iter = request_sharded(
+            endpoint,
+            geometry,
+            params=params,
+            max_features=shard,
+            workers=workers,
+            session=session)
+    else:
+        features_iter = _request_transit_land(
+            endpoint,
+            params=params,
+            page_all=page_all,
+            session=session,
+            workers=workers,
+            ordered=ordered,
+            stream=stream,
+            tuner=tuner,
+            resume_url=resume_url,
+            checkpoint=checkpoint)
+
+    if prefetch:
+        features_iter = _prefetch(features_iter, prefetch)
+
+    # Functions applied to each page, in order
+    steps = []
+    if fields is not None:
+        steps.append(traced(
+            'project', partial(_project_features, fields=set(fields))))
+    if geometry_filter is not None:
+        steps.append(traced('filter', geometry_filter.filter))
+    if reducer is not None:
+        steps.append(traced('simplify', reducer.reduce))
+
+    if stream:
+        from .streaming import map_batches
+        steps = [partial(map_batches, func=step) for step in steps]
+        if get_metrics() is not None:
+            steps = [partial(
+                record_stream_page, endpoint=endpoint, steps=steps)]
+    elif get_metrics() is not None:
+        # Count results before and after the steps, which filter by geometry
+        steps = [partial(record_page, endpoint=endpoint, steps=steps)]
+
+    counter = _LimitCounter(limit)
+    try:
+        while not counter.done:
+            features = next(features_iter, _DONE)
+            if features is _DONE:
+                break
+
+            for step in steps:
+                features = step(features)
+            yield counter.take(features)
+    finally:
+        # Stop background requests once the limit is reached
+        close = getattr(features_iter, 'close', None)
+        if close is not None:
+            close()
+
+
+def _build_params(
         gtfs_id=None,
         geometry=None,
         radius=None,
         include_geometry=True,
         active=False,
         per_page=50,
-        page_all=True,
         **kwargs):
+    """Convert endpoint function arguments into query parameters
+    """
     params = {}
     if gtfs_id is not None:
         params['imported_with_gtfs_id'] = True
@@ -242,10 +530,11 @@ def base(
                 params['r'] = radius
 
         elif geometry.type in ALLOWED_GEOMETRY_INTERSECTION_TYPES:
-            params['bbox'] = ','.join(map(str, geometry.bounds))
+            params['bbox'] = ','.join(map(str, geometry_bounds(geometry)))
 
         else:
-            msg = f'Geometry type must be one of {ALLOWED_GEOMETRY_INTERSECTION_TYPES}'
+            msg = 'Geometry type must be one of '
+            msg += f'{ALLOWED_GEOMETRY_INTERSECTION_TYPES}'
             raise ValueError(msg)
 
     if not include_geometry:
@@ -267,79 +556,451 @@ def base(
             else:
                 params[key] = value
 
-    features_iter = _request_transit_land(
-        endpoint, params=params, page_all=page_all)
+    return params
+
 
+def _prepare_filter(endpoint, geometry):
+    """Prepare geometry for filtering an endpoint's results by intersection
+
+    Returns:
+        IntersectionFilter, or None if results should not be filtered
+    """
     endpoint_type = ALL_ENDPOINT_TYPES[endpoint]
     if ((endpoint_type == '.geojson') and (geometry is not None)
             and (geometry.type in ALLOWED_GEOMETRY_INTERSECTION_TYPES)):
-        # "To test one polygon containment against a large batch of points, one
-        # should first use the prepared.prep() function"
-        prepared_geometry = prep(geometry)
-        for features in features_iter:
-            kept_features = []
-            for feature in features:
-                if prepared_geometry.intersects(asShape(feature['geometry'])):
-                    kept_features.append(feature)
-
-            yield kept_features
-    else:
-        # Not sure why, but this works and just
-        # return features_iter
-        # didn't actually go through the iterator?
-        for x in features_iter:
-            yield x
+        # Only imported when needed, since importing shapely is slow
+        from .filtering import IntersectionFilter
+        return IntersectionFilter(geometry)
 
+    return None
 
-def _request_transit_land(endpoint, params=None, page_all=True):
+
+def _prepare_resume(endpoint, params, resume_from, page_all=True):
+    """Find where a crawl resumes from
+
+    Args:
+        - resume_from: url of the page to start from, a Checkpoint, or the
+          path of a checkpoint file
+
+    Returns:
+        (Checkpoint or None, url to start from or None)
+    """
+    if resume_from is None:
+        return None, None
+    if not page_all or endpoint == 'onestop_id':
+        raise ValueError('resume_from requires page_all')
+    if isinstance(resume_from, str) and '://' in resume_from:
+        return None, resume_from
+
+    checkpoint = resume_from
+    if not isinstance(checkpoint, Checkpoint):
+        checkpoint = Checkpoint(checkpoint)
+    _, query = cache_key(_endpoint_url(endpoint, params), params)
+    checkpoint.start(query)
+    return checkpoint, checkpoint.next_url
+
+
+def _project_features(features, fields):
+    """Keep only the given fields of each result
+
+    GeoJSON features keep their type, id and geometry, and only the given
+    properties.
+    """
+    projected = []
+    for feature in features:
+        if feature.get('type') == 'Feature':
+            new_feature = {
+                k: v
+                for k, v in feature.items()
+                if k in fields or k in ('type', 'id', 'geometry')}
+            properties = feature.get('properties')
+            if properties is not None:
+                new_feature['properties'] = {
+                    k: v
+                    for k, v in properties.items() if k in fields}
+        else:
+            new_feature = {k: v for k, v in feature.items() if k in fields}
+        projected.append(new_feature)
+
+    return projected
+
+
+class _LimitCounter:
+    """Truncate pages once a number of results has been yielded
+
+    Args:
+        - limit: maximum number of results, or None for no limit
+    """
+    def __init__(self, limit=None):
+        self.remaining = limit
+
+    @property
+    def done(self):
+        return self.remaining is not None and self.remaining <= 0
+
+    def take(self, features):
+        """Truncate a page to the remaining number of results
+
+        Lists are truncated at once. Other iterables, such as streamed pages,
+        are truncated as they are consumed.
+        """
+        if self.remaining is None:
+            return features
+        if isinstance(features, list):
+            features = features[:self.remaining]
+            self.remaining -= len(features)
+            return features
+        return self._take_lazily(features)
+
+    def _take_lazily(self, features):
+        for feature in features:
+            if self.done:
+                return
+            self.remaining -= 1
+            yield feature
+
+
+def _prepare_reducer(precision=None, simplify_tolerance=None):
+    """Prepare reduction of result geometries
+
+    Args:
+        - precision: number of decimal places, or a GeometryReducer
+        - simplify_tolerance: simplification tolerance in degrees
+
+    Returns:
+        GeometryReducer, or None if geometries should be kept as they are
+    """
+    if precision is None and not simplify_tolerance:
+        return None
+
+    from .simplify import GeometryReducer
+    if isinstance(precision, GeometryReducer):
+        if simplify_tolerance is not None:
+            msg = 'simplify_tolerance must be set on the GeometryReducer '
+            msg += 'passed as precision'
+            raise ValueError(msg)
+        return precision
+
+    return GeometryReducer(
+        precision=precision,
+        simplify_tolerance=simplify_tolerance,
+        measure=False)
+
+
+def _request_transit_land(
+        endpoint,
+        params=None,
+        page_all=True,
+        session=None,
+        workers=1,
+        ordered=True,
+        stream=False,
+        tuner=None,
+        resume_url=None,
+        checkpoint=None):
     """Wrapper to transit.land API to page over all results
 
     Args:
         - endpoint: endpoint to send requests to
         - params: None or dict of params for sending requests
         - page_all: page over all responses
+        - session: requests.Session to use. By default the shared session.
+        - workers: number of pages to fetch at once when paging over all
+          responses. See `_request_pages_concurrently`.
+        - ordered: if False, yield concurrently fetched pages as they complete
+          instead of in order
+        - stream: parse each response incrementally, and yield each page as
+          an iterator of results. See `transitland_wrapper.streaming`.
+        - tuner: PageSizeTuner that chooses the size of each page after the
+          first. See `transitland_wrapper.autotune`.
+        - resume_url: url of a later page to start paging from, such as a
+          `meta['next']` saved by an earlier crawl. It already has all params.
+        - checkpoint: Checkpoint updated as each page is handled. See
+          `transitland_wrapper.checkpoint`.
 
     Returns:
         dict of transit.land output
     """
-    assert endpoint in ALL_ENDPOINT_TYPES.keys(), 'Invalid endpoint'
-    endpoint_type = ALL_ENDPOINT_TYPES[endpoint]
-    if endpoint == 'onestop_id':
-        url = f'https://transit.land/api/v1/{endpoint}/{params["id"]}'
-    else:
-        url = f'https://transit.land/api/v1/{endpoint}{endpoint_type}'
+    url = _endpoint_url(endpoint, params)
+    if resume_url is not None:
+        url, params = resume_url, None
+
+    if page_all and workers > 1 and endpoint != 'onestop_id':
+        return _request_pages_concurrently(
+            endpoint,
+            url,
+            params=params,
+            session=session,
+            workers=workers,
+            ordered=ordered)
+
+    return _follow_next(
+        endpoint,
+        url,
+        params=params,
+        page_all=page_all,
+        session=session,
+        stream=stream,
+        tuner=tuner,
+        checkpoint=checkpoint)
+
+
+def _follow_next(
+        endpoint,
+        url,
+        params=None,
+        page_all=True,
+        session=None,
+        stream=False,
+        tuner=None,
+        checkpoint=None):
+    """Request pages one after another by following meta['next']
+
+    In streaming mode, each page is an iterator over the response being
+    parsed, and must be consumed before the next page is requested. Results
+    left unread when the caller moves on are parsed and dropped, since the
+    meta comes after them.
+
+    With a `tuner`, the time taken by each page is measured, and the next page
+    is requested with the size it chooses.
 
+    With a `checkpoint`, a page counts as handled once the caller asks for the
+    next one, and the url of the next page is then saved. The checkpoint is
+    marked complete after the last page.
+    """
+    stream = stream and endpoint != 'onestop_id'
     # Page over responses if necessary
     # If there are more responses in another page, there will be a 'next'
     # key in the meta with the url to request
     while True:
-        r = _send_request(url, params=params)
-        d = r.json()
-
-        if endpoint_type == '.geojson':
-            assert d['type'] == 'FeatureCollection'
-            assert set(d.keys()) == {'features', 'meta', 'type'}
-            yield d['features']
-        elif endpoint == 'onestop_id':
-            yield d
-            break
+        start = monotonic()
+        with span('fetch', url=url):
+            r = _send_request(
+                url, params=params, session=session, stream=stream)
+        if stream:
+            from .streaming import iter_page
+            meta = {}
+            page = iter_page(endpoint, r, meta)
+            try:
+                yield page
+                for _ in page:
+                    pass
+            finally:
+                close = getattr(r, 'close', None)
+                if close is not None:
+                    close()
         else:
-            assert set(d.keys()) == {endpoint, 'meta'}
-            yield d[endpoint]
+            with span('parse'):
+                d = r.json()
+            # onestop_id responses have no meta, and are never paged
+            meta = d.get('meta')
+            page = _parse_page(endpoint, d)
+            seconds = monotonic() - start
+            yield page
 
-        if not page_all:
+        if endpoint == 'onestop_id' or not page_all:
             break
 
         # If the 'next' key does not exist, done; so break
-        if d['meta'].get('next') is None:
+        if meta.get('next') is None:
+            if checkpoint is not None:
+                checkpoint.finish()
             break
 
         # Otherwise, keep paging
-        url = d['meta']['next']
+        url = meta['next']
         params = None
 
+        # Only full pages from the network say anything about page size
+        if tuner is not None and not getattr(r, 'from_cache', False):
+            if stream:
+                seconds = monotonic() - start
+                results, nbytes = meta.get('per_page', tuner.per_page), None
+            else:
+                results, nbytes = len(page), len(r.content)
+            url = with_per_page(url, tuner.record(results, seconds, nbytes))
+
+        if checkpoint is not None:
+            checkpoint.advance(url)
+
+
+def _request_pages_concurrently(
+        endpoint, url, params=None, session=None, workers=4, ordered=True):
+    """Request all pages with a pool of worker threads
+
+    The first page is requested with `total=true`, so that its meta includes
+    the total number of results. The offsets of all remaining pages are then
+    known up front, and they are fetched by up to `workers` threads at once.
+    All requests still go through the shared rate limiter.
+
+    If the API doesn't report a total, falls back to following meta['next'].
+
+    Args:
+        - ordered: if True, yield pages in order. Otherwise yield them as they
+          complete.
+    """
+    params = dict(params or {}, total='true')
+    d = _get_json(url, params=params, session=session)
+    yield _parse_page(endpoint, d)
+
+    meta = d['meta']
+    if meta.get('next') is None:
+        return
+
+    page_params = _remaining_page_params(meta, params)
+    if page_params is None:
+        yield from _follow_next(
+            endpoint, meta['next'], page_all=True, session=session)
+        return
+
+    def fetch(page_params):
+        d = _get_json(url, params=page_params, session=session)
+        return _parse_page(endpoint, d)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    page_params = iter(page_params)
+    try:
+        # Keep at most `workers` requests in flight, so that pages aren't
+        # fetched much faster than they are consumed
+        for p in islice(page_params, workers):
+            pending.append(executor.submit(fetch, p))
+
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                pending.remove(future)
+
+            features = future.result()
+            for p in islice(page_params, 1):
+                pending.append(executor.submit(fetch, p))
+
+            yield features
+    finally:
+        # Runs when the consumer stops early too, through GeneratorExit
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _prefetch(pages, depth):
+    """Fetch up to `depth` pages ahead in a background thread
+
+    While the caller processes one page, the following pages are already
+    being requested, so network time overlaps with processing time.
+
+    When the caller stops iterating early, the background thread is stopped
+    and the underlying iterator closed. If a request is in progress at that
+    time, closing waits for it to finish.
 
-def _send_request(url, params=None, sleep_time=2):
+    Args:
+        - pages: iterator of pages
+        - depth: maximum number of fetched pages to hold in memory
+    """
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # Block until there's room in the queue, unless told to stop
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for page in pages:
+                if not put((page, None)):
+                    return
+        except Exception as e:
+            put((_DONE, e))
+        else:
+            put((_DONE, None))
+        finally:
+            close = getattr(pages, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            page, error = q.get()
+            if page is _DONE:
+                if error is not None:
+                    raise error
+                return
+
+            yield page
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _remaining_page_params(meta, params):
+    """Compute params for every page after the first from offset metadata
+
+    Returns:
+        list of params dicts, or None if meta doesn't include the total
+        number of results
+    """
+    total = meta.get('total')
+    per_page = meta.get('per_page')
+    if total is None or not per_page:
+        return None
+
+    offset = meta.get('offset', 0)
+    return [
+        dict(params, offset=o, per_page=per_page)
+        for o in range(offset + per_page, total, per_page)]
+
+
+def _endpoint_url(endpoint, params=None):
+    """Url of the first page of an endpoint
+    """
+    assert endpoint in ALL_ENDPOINT_TYPES.keys(), 'Invalid endpoint'
+    endpoint_type = ALL_ENDPOINT_TYPES[endpoint]
+    if endpoint == 'onestop_id':
+        return f'{BASE_URL}/api/v1/{endpoint}/{params["id"]}'
+
+    return f'{BASE_URL}/api/v1/{endpoint}{endpoint_type}'
+
+
+def _parse_page(endpoint, d):
+    """Extract the list of results from a decoded response
+
+    For the onestop_id endpoint, the whole response is the result.
+    """
+    endpoint_type = ALL_ENDPOINT_TYPES[endpoint]
+    if endpoint_type == '.geojson':
+        assert d['type'] == 'FeatureCollection'
+        assert set(d.keys()) == {'features', 'meta', 'type'}
+        return d['features']
+    elif endpoint == 'onestop_id':
+        return d
+    else:
+        assert set(d.keys()) == {endpoint, 'meta'}
+        return d[endpoint]
+
+
+def _get_json(url, params=None, session=None):
+    """Send a request and decode its JSON body
+
+    Traced as `fetch` and `parse` spans. See `transitland_wrapper.tracing`.
+    """
+    with span('fetch', url=url):
+        r = _send_request(url, params=params, session=session)
+    with span('parse'):
+        return r.json()
+
+
+def _send_request(url, params=None, session=None, stream=False):
     """Make request to transit.land API
 
     Wrapper for requests to transit.land API to stay within rate limit
@@ -348,27 +1009,189 @@ def _send_request(url, params=None, sleep_time=2):
     presumably resets after each 60-second period. (It's not per 1-second
     period, because I was able to make 60 requests in like 10 seconds).
 
-    Given this, when I hit r.status_code, I'll sleep for 2 seconds before
-    trying again.
+    Given this, each request first takes a token from the shared rate limiter
+    in `transitland_wrapper.ratelimit`, which spaces requests to use the whole
+    budget without going over it.
+
+    Failed requests are retried according to the shared retry policy in
+    `transitland_wrapper.retry`. A 429 holds off all requests through the rate
+    limiter, since another client may be sharing the budget.
+
+    Requests are sent through `session`, or the shared pooled session if not
+    given, so consecutive pages reuse the same keep-alive connections.
+
+    If the response cache in `transitland_wrapper.cache` is turned on, fresh
+    cached responses are returned without sending a request, and expired ones
+    are revalidated with a conditional request.
+
+    With `stream=True`, the body of the response is not downloaded up front,
+    so that it can be parsed as it arrives. Such responses are not stored in
+    the cache.
+
+    If metrics are turned on in `transitland_wrapper.metrics`, each request
+    is recorded there once it succeeds or fails.
+
+    Raises:
+        - HTTPStatusError: the response status is not retryable
+        - RetryError: the request failed `max_attempts` times
+        - DeadlineExceeded: retrying would run past the policy's deadline
+        - CircuitOpenError: the API is failing and requests fail fast
     """
-    r = requests.get(url, params=params)
-    if r.status_code == 200:
-        return r
+    from requests.exceptions import ConnectionError, Timeout
+
+    record = RequestRecord(url)
+    cache = get_cache()
+    cached, headers = None, None
+    if cache is not None:
+        record.cache = 'miss'
+        cached = cache.get(url, params, stale=True)
+        if cached is not None:
+            if cached.fresh:
+                record.cache = 'hit'
+                record.finish(cached)
+                return cached
+            headers = cached.conditional_headers()
+
+    if session is None:
+        session = get_session()
+    rate_limiter = get_rate_limiter()
+    policy = get_retry_policy()
+    circuit_breaker = get_circuit_breaker()
+
+    start = monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        record.attempts = attempt
+        try:
+            trial = circuit_breaker.before_request()
+        except TransitlandError as e:
+            record.finish(error=e)
+            raise
+        try:
+            record.rate_limit_wait += rate_limiter.acquire()
+
+            r, error = None, None
+            try:
+                r = session.get(
+                    url,
+                    params=params,
+                    headers=headers,
+                    timeout=policy.timeout,
+                    stream=stream)
+            except (ConnectionError, Timeout) as e:
+                error = e
+            else:
+                if r.status_code == 304 and cached is not None:
+                    r.close()
+                    circuit_breaker.record_success()
+                    cache.revalidate(url, params)
+                    record.cache = 'revalidated'
+                    record.finish(cached)
+                    return cached
 
-    elif r.status_code == 429:
-        sleep(sleep_time)
-        return _send_request(url, params=params)
+                if r.status_code == 200:
+                    circuit_breaker.record_success()
+                    if cache is not None and not stream:
+                        cache.set(url, params, r, stale=cached)
+                    record.finish(r, stream=stream)
+                    return r
+
+                if stream:
+                    # Release the connection of a response that won't be read
+                    r.close()
+
+            try:
+                delay = _handle_failure(
+                    url, params, attempt, start, response=r, error=error)
+            except TransitlandError as e:
+                record.finish(r, error=e, stream=stream)
+                raise
+        finally:
+            if trial:
+                # Whatever happened, don't leave the breaker waiting on it
+                circuit_breaker.release_trial()
+        if r is not None and r.status_code == 429 and rate_limiter.rate:
+            # Hold off all requests, not just this one
+            rate_limiter.penalize(delay)
+        else:
+            sleep(delay)
+
+
+def _handle_failure(url, params, attempt, start, response=None, error=None):
+    """Decide whether and when to retry a failed request
+
+    Args:
+        - url, params: the failed request
+        - attempt: number of the attempt that failed, starting at 1
+        - start: `monotonic()` time of the first attempt
+        - response: the response, if one was received. Must have
+          `status_code`, `headers` and `url` attributes.
+        - error: the connection error, if no response was received
+
+    Returns:
+        seconds to wait before the next attempt
+    """
+    policy = get_retry_policy()
+    circuit_breaker = get_circuit_breaker()
 
+    if response is None:
+        circuit_breaker.record_failure()
+    elif not policy.should_retry(response):
+        # The API is up, the request is just bad
+        circuit_breaker.record_success()
+        raise HTTPStatusError(response)
+    elif response.status_code == 429:
+        # A 429 means we're over budget, not that the API is down
+        circuit_breaker.record_success()
     else:
-        print(f'returned with status code: {r.status_code}', file=sys.stderr)
+        circuit_breaker.record_failure()
+
+    if policy.max_attempts is not None and attempt >= policy.max_attempts:
+        raise RetryError(url, attempt, response=response, error=error)
+
+    delay = policy.get_delay(attempt, response=response)
+    if (policy.deadline is not None
+            and monotonic() - start + delay > policy.deadline):
+        raise DeadlineExceeded(
+            url,
+            attempt,
+            response=response,
+            error=error,
+            msg=f'deadline of {policy.deadline}s exceeded')
+
+    if response is None or response.status_code != 429:
+        if response is not None:
+            print(
+                f'returned with status code: {response.status_code}',
+                file=sys.stderr)
+        else:
+            print(f'request failed: {error!r}', file=sys.stderr)
         print(f'url: {url}', file=sys.stderr)
         if params is not None:
             print(f'params: {params}', file=sys.stderr)
+        print(f'retrying in {delay:.1f}s', file=sys.stderr)
+
+    return delay
+
+
+def _check_keys(kwargs, allowed_keys):
+    """Raise ValueError if kwargs has keys not in allowed_keys or COMMON_KEYS
+    """
+    allowed_keys = allowed_keys + COMMON_KEYS
+    if any(k not in allowed_keys for k in kwargs.keys()):
+        msg = f'invalid parameter; allowed parameters are:\n{allowed_keys}'
+        raise ValueError(msg)
 
-        sleep(sleep_time)
-        return _send_request(url, params=params)
 
-    return r
+def _validate_dates(kwargs):
+    """Validate date parameters of schedule_stop_pairs
+    """
+    date_keys = ['date', 'service_from_date', 'service_before_date']
+    for key, val in kwargs.items():
+        if key in date_keys:
+            if val:
+                validate_date(val)
 
 
 def validate_date(date_text):